@@ -2,18 +2,24 @@ import jwt
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.conf import settings
+from sr_user_api.metrics import record_auth
+from sr_user_api.revocation import revocation_list
+from sr_user_api.token_cache import VerifiedTokenCache
 from sr_user_api.users import SimpleUser
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Кэш уже проверенных токенов, общий для всех запросов процесса
+token_cache = VerifiedTokenCache(maxsize=getattr(settings, 'JWT_TOKEN_CACHE_SIZE', 1024))
+
 
 class JWTAuthentication(BaseAuthentication):
     """
     Класс для аутентификации пользователей с использованием JWT (JSON Web Tokens).
 
     Этот класс проверяет наличие JWT-токена в cookies (`access_token`) или в заголовке
-    `Authorization` запроса. Если токен валиден и не истёк, создаётся объект `SimpleUser`
+    `Authorization` запроса. Если токен валиден, не истёк и не отозван, создаётся объект `SimpleUser`
     с данными пользователя из токена.
     """
     def authenticate(self, request):
@@ -24,10 +30,13 @@ class JWTAuthentication(BaseAuthentication):
             1. Проверяет наличие токена в cookies под ключом `access_token`.
             2. Если токен не найден в cookies, ищет его в заголовке `Authorization`
                в формате `Bearer <token>`.
-            3. Если токен найден, декодирует его с использованием секретного ключа
-               `JWT_SECRET_KEY` и алгоритма `HS256`.
-            4. Если токен действителен, создаёт объект `SimpleUser` с данными пользователя.
-            5. Если токен просрочен или неверен, выбрасывает исключение `AuthenticationFailed`.
+            3. Если токен уже есть в кэше проверенных токенов и не истёк, берёт payload из кэша.
+            4. Иначе декодирует его с использованием секретного ключа
+               `JWT_SECRET_KEY` и алгоритма `HS256`
+               и сохраняет payload в кэш до момента истечения токена.
+            5. Проверяет, не отозван ли токен (`jti` в чёрном списке, см. `sr_user_api.revocation`).
+            6. Если токен действителен, создаёт объект `SimpleUser` с данными пользователя.
+            7. Если токен просрочен, неверен или отозван, выбрасывает исключение `AuthenticationFailed`.
 
         :param request: HTTP-запрос, содержащий данные для аутентификации.
         :type request: rest_framework.request.Request
@@ -35,6 +44,24 @@ class JWTAuthentication(BaseAuthentication):
                  Возвращает `None`, если аутентификация не выполнена.
         :rtype: tuple or None
 
+        :raises AuthenticationFailed: Если токен истёк, неверен или отозван.
+        """
+        decoded = self.decode(request)
+        if decoded is None:
+            return None
+        payload, outcome = decoded
+        if revocation_list.is_revoked(payload.get('jti')):
+            self.reject_revoked(payload)
+        return self.login(payload, outcome)
+
+    def decode(self, request):
+        """
+        Находит токен в запросе и возвращает его payload из кэша проверенных токенов или после `jwt.decode`.
+
+        :return: Кортеж `(payload, outcome)`, где `outcome` — `cache_hit` или `success`,
+                 либо `None`, если токен не передан.
+        :rtype: tuple or None
+
         :raises AuthenticationFailed: Если токен истёк или неверен.
         """
         logger.info("Начало аутентификации в JWTAuthentication")
@@ -49,18 +76,61 @@ class JWTAuthentication(BaseAuthentication):
 
         if not token:
             logger.warning("Токен не найден ни в cookies, ни в заголовке Authorization")
+            record_auth('missing')
             return None
 
+        payload = token_cache.get(token)
+        if payload is not None:
+            logger.info("Токен найден в кэше проверенных токенов")
+            return payload, 'cache_hit'
+
         try:
             payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=['HS256'])
-            logger.info(f"Токен успешно декодирован: {payload}")
+            logger.debug("Токен успешно декодирован, срок действия до %s", payload.get('exp'))
         except jwt.ExpiredSignatureError:
             logger.error("Ошибка аутентификации: срок действия токена истёк")
+            record_auth('expired')
             raise AuthenticationFailed('Токен истёк')
         except jwt.InvalidTokenError:
             logger.error("Ошибка аутентификации: неверный токен")
+            record_auth('invalid')
             raise AuthenticationFailed('Неверный токен')
 
+        token_cache.set(token, payload)
+        return payload, 'success'
+
+    @staticmethod
+    def login(payload, outcome):
         user = SimpleUser(payload)
-        logger.info(f"Пользователь успешно аутентифицирован: {user.id}")
+        logger.info("Пользователь успешно аутентифицирован: %s", user.id)
+        record_auth(outcome)
         return (user, None)
+
+    @staticmethod
+    def reject_revoked(payload):
+        logger.warning("Ошибка аутентификации: токен %s отозван", payload.get('jti'))
+        record_auth('revoked')
+        raise AuthenticationFailed('Токен отозван')
+
+    async def aauthenticate(self, request):
+        """
+        Асинхронный вариант `authenticate` для нативных async-представлений, работающих под ASGI.
+
+        Проверка токена выполняется в памяти процесса. К БД (обновление списка отозванных токенов
+        и проверка срабатываний фильтра) обращение идёт через `sync_to_async`, поэтому цикл событий
+        не блокируется.
+
+        :param request: HTTP-запрос, содержащий данные для аутентификации.
+        :type request: django.http.HttpRequest
+        :return: Кортеж с объектом пользователя и `None` или `None`, если токен не передан.
+        :rtype: tuple or None
+
+        :raises AuthenticationFailed: Если токен истёк, неверен или отозван.
+        """
+        decoded = self.decode(request)
+        if decoded is None:
+            return None
+        payload, outcome = decoded
+        if await revocation_list.ais_revoked(payload.get('jti')):
+            self.reject_revoked(payload)
+        return self.login(payload, outcome)
@@ -0,0 +1,163 @@
+import contextvars
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Псевдоним БД, из которой читает текущий запрос (None - основная БД)
+_read_database = contextvars.ContextVar('read_database', default=None)
+
+# Реплики, признанные недоступными, и момент, до которого они не используются
+_unavailable_until = {}
+# Момент последней проверки отставания реплики
+_lag_checked_at = {}
+
+PIN_COOKIE = 'db_pinned'
+PIN_CACHE_PREFIX = 'db_pin'
+
+# Отставание реплики в секундах; 0, если всё полученное WAL уже применено или БД не является репликой
+REPLICATION_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    """
+    Роутер БД: запись всегда в основную БД, чтение — из реплики, выбранной для текущего запроса
+    (`use_database`), иначе тоже из основной.
+
+    Реплики содержат те же данные, что и основная БД, поэтому связи между объектами из разных
+    псевдонимов разрешены, а миграции применяются только к основной БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def use_database(alias):
+    """
+    Направляет чтение текущего запроса (контекста) в БД `alias` (`None` — в основную).
+
+    :return: Токен для `reset_database`.
+    :rtype: contextvars.Token
+    """
+    return _read_database.set(alias)
+
+
+def reset_database(token):
+    _read_database.reset(token)
+
+
+def choose_replica():
+    """
+    Выбирает доступную реплику для чтения.
+
+    Реплики перебираются в случайном порядке. Реплика пропускается, если к ней не удаётся подключиться
+    или её отставание превышает `DATABASE_REPLICA_MAX_LAG` секунд (проверяется не чаще раза
+    в `DATABASE_REPLICA_CHECK_INTERVAL` секунд); такая реплика не используется
+    `DATABASE_REPLICA_RETRY_SECONDS` секунд.
+
+    :return: Псевдоним реплики или `None`, если доступных реплик нет (чтение из основной БД).
+    :rtype: str or None
+    """
+    replicas = list(getattr(settings, 'DATABASE_REPLICAS', []))
+    random.shuffle(replicas)
+    now = time.monotonic()
+    check_interval = getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', 5)
+    retry_after = getattr(settings, 'DATABASE_REPLICA_RETRY_SECONDS', 5)
+    for alias in replicas:
+        if _unavailable_until.get(alias, 0) > now:
+            continue
+        connection = connections[alias]
+        try:
+            connection.ensure_connection()
+            if connection.vendor == 'postgresql' and now - _lag_checked_at.get(alias, -check_interval) >= check_interval:
+                with connection.cursor() as cursor:
+                    cursor.execute(REPLICATION_LAG_SQL)
+                    lag = cursor.fetchone()[0] or 0
+                _lag_checked_at[alias] = now
+                if lag > getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5):
+                    logger.warning("Реплика %s отстаёт на %.1f с, чтение из основной БД", alias, lag)
+                    _unavailable_until[alias] = now + retry_after
+                    continue
+        except DatabaseError:
+            logger.warning("Реплика %s недоступна, чтение из основной БД", alias, exc_info=True)
+            _unavailable_until[alias] = now + retry_after
+            continue
+        return alias
+    return None
+
+
+def _pin_cache():
+    return caches[getattr(settings, 'DATABASE_PIN_CACHE_ALIAS', 'default')]
+
+
+def pin_to_primary(user_ids, response=None):
+    """
+    Закрепляет чтение пользователей за основной БД на `DATABASE_PIN_SECONDS` секунд после записи,
+    чтобы они не получили из реплики устаревшие данные.
+
+    Отметка сохраняется в кэше по `id` пользователя и, если передан ответ, в cookie клиента.
+
+    :param user_ids: Идентификаторы пользователей, данные которых изменены.
+    :type user_ids: list
+    :param response: Ответ, в который добавляется cookie (необязательно).
+    :type response: django.http.HttpResponse or None
+    """
+    window = getattr(settings, 'DATABASE_PIN_SECONDS', 10)
+    if not window or not getattr(settings, 'DATABASE_REPLICAS', None):
+        return
+    _pin_cache().set_many({f'{PIN_CACHE_PREFIX}:{user_id}': True for user_id in user_ids}, window)
+    if response is not None:
+        response.set_cookie(PIN_COOKIE, '1', max_age=window, httponly=True, samesite='Lax')
+
+
+def is_pinned(request, user_id):
+    """
+    Проверяет, должно ли чтение для запроса выполняться из основной БД после недавней записи.
+
+    :param request: HTTP-запрос.
+    :type request: django.http.HttpRequest
+    :param user_id: Идентификатор текущего пользователя (или `None`).
+    :type user_id: str or None
+    :rtype: bool
+    """
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    return user_id is not None and bool(_pin_cache().get(f'{PIN_CACHE_PREFIX}:{user_id}'))
+
+
+async def apin_to_primary(user_ids, response=None):
+    """
+    Асинхронный аналог `pin_to_primary`.
+    """
+    window = getattr(settings, 'DATABASE_PIN_SECONDS', 10)
+    if not window or not getattr(settings, 'DATABASE_REPLICAS', None):
+        return
+    await _pin_cache().aset_many({f'{PIN_CACHE_PREFIX}:{user_id}': True for user_id in user_ids}, window)
+    if response is not None:
+        response.set_cookie(PIN_COOKIE, '1', max_age=window, httponly=True, samesite='Lax')
+
+
+async def ais_pinned(request, user_id):
+    """
+    Асинхронный аналог `is_pinned`.
+    """
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    return user_id is not None and bool(await _pin_cache().aget(f'{PIN_CACHE_PREFIX}:{user_id}'))
@@ -0,0 +1,181 @@
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from sr_user_api.metrics import record_concurrency_limit, record_shed
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+SHEDDABLE = 'sheddable'
+
+# Доля адаптивного лимита, которую может занять запрос каждого приоритета: при перегрузке первыми
+# отклоняются дорогие запросы, а лимит для критичных остаётся полным
+DEFAULT_PRIORITY_SHARES = {CRITICAL: 1.0, NORMAL: 0.75, SHEDDABLE: 0.5}
+
+
+class AdaptiveLimiter:
+    """
+    Адаптивный лимит одновременно выполняемых запросов (AIMD с градиентным уменьшением).
+
+    Для каждого маршрута хранится базовая задержка — оценка времени ответа без нагрузки (быстро
+    опускается к новым минимумам и медленно поднимается). Если запрос выполнялся дольше базовой
+    задержки в `tolerance` раз (и дольше `min_latency` секунд), лимит умножается на отношение
+    допустимой задержки к фактической, но не меньше чем на `backoff`, и не чаще раза в `window` секунд.
+    Иначе, если лимит был занят хотя бы наполовину, он растёт на `1 / limit` (примерно на единицу
+    за «окно» из `limit` запросов).
+
+    Атрибуты:
+        - `limit` (float): Текущий лимит одновременно выполняемых запросов.
+        - `in_flight` (int): Количество выполняемых запросов.
+    """
+    def __init__(self, initial=8, minimum=1, maximum=64, tolerance=2.0, min_latency=0.05, backoff=0.5,
+                 window=0.5, shares=None):
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.min_latency = min_latency
+        self.backoff = backoff
+        self.window = window
+        self.shares = shares or DEFAULT_PRIORITY_SHARES
+        self._baselines = {}
+        self._decreased_at = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, priority):
+        """
+        Занимает место для запроса с приоритетом `priority`, если лимит для этого приоритета не исчерпан.
+
+        :return: Количество выполняемых запросов до этого (для `release`) или `None`, если запрос отклонён.
+        :rtype: int or None
+        """
+        with self._lock:
+            if self.in_flight >= max(1.0, self.limit * self.shares.get(priority, self.shares[NORMAL])):
+                return None
+            self.in_flight += 1
+            return self.in_flight - 1
+
+    def release(self, route, latency, in_flight):
+        """
+        Освобождает место и пересчитывает лимит по времени выполнения запроса.
+
+        :param route: Шаблон маршрута запроса.
+        :type route: str
+        :param latency: Время выполнения запроса в секундах или `None`, если лимит пересчитывать не нужно.
+        :type latency: float or None
+        :param in_flight: Значение, возвращённое `try_acquire`.
+        :type in_flight: int
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if latency is None:
+                return
+            baseline = self._baselines.get(route, latency)
+            # Базовая задержка быстро следует за уменьшением и медленно — за ростом времени ответа
+            baseline += (latency - baseline) * (0.2 if latency < baseline else 0.01)
+            self._baselines[route] = baseline
+
+            now = time.monotonic()
+            if latency > self.min_latency and latency > baseline * self.tolerance:
+                if now - self._decreased_at >= self.window:
+                    gradient = max(self.backoff, baseline * self.tolerance / latency)
+                    self.limit = max(self.minimum, self.limit * gradient)
+                    self._decreased_at = now
+            elif in_flight + 1 >= self.limit / 2:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    Middleware, ограничивающий количество одновременно выполняемых запросов процесса адаптивным лимитом
+    и отклоняющий лишние запросы ответом `503 Service Unavailable` с заголовком `Retry-After`.
+
+    Когда БД замедляется, время ответа растёт и лимит уменьшается, поэтому запросы не копятся в очереди
+    воркера до таймаута клиента, а сразу получают отказ. Приоритет запроса определяется по шаблону
+    маршрута (`LOAD_SHEDDING_ROUTE_PRIORITIES`, по умолчанию `normal`); загрузка файлов (multipart)
+    всегда получает низший приоритет `sheddable`.
+
+    Лимит действует в пределах процесса, поэтому имеет смысл при нескольких потоках на воркер
+    (`gunicorn --threads`) или под ASGI. Работает как в синхронном, так и в асинхронном стеке; место
+    освобождается и при исключении или отмене запроса (разрыв соединения под ASGI).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.enabled = getattr(settings, 'LOAD_SHEDDING_ENABLED', True)
+        self.priorities = getattr(settings, 'LOAD_SHEDDING_ROUTE_PRIORITIES', {})
+        self.retry_after = getattr(settings, 'LOAD_SHEDDING_RETRY_AFTER', 1)
+        self.limiter = AdaptiveLimiter(
+            initial=getattr(settings, 'LOAD_SHEDDING_INITIAL_LIMIT', 8),
+            minimum=getattr(settings, 'LOAD_SHEDDING_MIN_LIMIT', 1),
+            maximum=getattr(settings, 'LOAD_SHEDDING_MAX_LIMIT', 64),
+            tolerance=getattr(settings, 'LOAD_SHEDDING_LATENCY_TOLERANCE', 2.0),
+            min_latency=getattr(settings, 'LOAD_SHEDDING_MIN_LATENCY', 0.05),
+        )
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.abort(request)
+            raise
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.abort(request)
+            raise
+        return self.finish(request, response)
+
+    def abort(self, request):
+        """
+        Освобождает место запроса, прерванного исключением, не пересчитывая лимит.
+        """
+        admitted = getattr(request, '_load_shedding', None)
+        if admitted is not None:
+            route, in_flight, _ = admitted
+            self.limiter.release(route, None, in_flight)
+
+    def finish(self, request, response):
+        admitted = getattr(request, '_load_shedding', None)
+        if admitted is not None:
+            route, in_flight, started = admitted
+            if response.streaming:
+                # Потоковый ответ (выгрузка) занимает поток до конца передачи, но его длительность
+                # зависит от объёма данных, а не от нагрузки, поэтому на лимит не влияет
+                response._resource_closers.append(lambda: self.limiter.release(route, None, in_flight))
+            else:
+                self.limiter.release(route, time.perf_counter() - started, in_flight)
+                record_concurrency_limit(self.limiter.limit)
+        return response
+
+    def priority(self, request, route):
+        if request.content_type == 'multipart/form-data':
+            return SHEDDABLE
+        return self.priorities.get(route, NORMAL)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.enabled:
+            return None
+        route = request.resolver_match.route
+        priority = self.priority(request, route)
+        in_flight = self.limiter.try_acquire(priority)
+        if in_flight is None:
+            record_shed(route, priority)
+            response = JsonResponse({"detail": "Service is overloaded, retry later."}, status=503)
+            response['Retry-After'] = str(self.retry_after)
+            return response
+        request._load_shedding = (route, in_flight, time.perf_counter())
+        return None
@@ -0,0 +1,77 @@
+import atexit
+import copy
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Обработчик логов, который не блокирует поток запроса на записи в поток вывода.
+
+    В потоке запроса запись лишь подготавливается (подстановка аргументов в сообщение) и кладётся
+    в ограниченную очередь; форматирование и запись в поток выполняет `QueueListener` в фоновом потоке.
+    Если очередь переполнена, запись отбрасывается и учитывается в `dropped` — запрос не ждёт вывода.
+
+    Подключается в `LOGGING` вместо `logging.StreamHandler`; форматтер, заданный в конфигурации,
+    применяется в фоновом потоке.
+
+    При закрытии (`close`, в том числе при выходе из процесса) фоновый поток останавливается после записи
+    всех записей, уже стоящих в очереди.
+
+    Атрибуты:
+        - `dropped` (int): Количество записей, отброшенных из-за переполнения очереди.
+        - `running` (bool): Фоновый поток записи запущен и ещё не остановлен.
+    """
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.running = True
+        self.dropped = 0
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # `close` вызывается и при завершении `logging`, и через `atexit`: поток останавливается один раз
+        if self.running:
+            self.running = False
+            self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Фильтр, пропускающий только часть записей уровня ниже `WARNING`.
+
+    Предупреждения и ошибки проходят всегда, остальные записи — с вероятностью `rate`.
+
+    Атрибуты:
+        - `rate` (float): Доля пропускаемых записей от 0 до 1.
+    """
+    def __init__(self, rate=1.0, name=''):
+        super().__init__(name)
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
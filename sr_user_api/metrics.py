@@ -0,0 +1,232 @@
+import ipaddress
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Если задана переменная окружения PROMETHEUS_MULTIPROC_DIR, значения метрик пишутся в mmap-файлы этого каталога
+# (по файлу на процесс) и суммируются по всем воркерам gunicorn при выдаче /metrics
+MULTIPROCESS_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса.',
+    ['route', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Количество SQL-запросов на один HTTP-запрос.',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    'http_request_db_duration_seconds', 'Суммарное время SQL-запросов на один HTTP-запрос.',
+    ['route'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+AUTH_OUTCOMES = Counter(
+    'jwt_authentication', 'Результаты аутентификации JWTAuthentication.',
+    ['outcome'],
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups', 'Обращения к кэшам на чтение (доля попаданий: hit / (hit + miss)).',
+    ['cache', 'result'],
+)
+
+LOAD_SHED = Counter(
+    'http_requests_shed', 'Запросы, отклонённые при перегрузке (503).',
+    ['route', 'priority'],
+)
+CONCURRENCY_LIMIT = Gauge(
+    'http_concurrency_limit', 'Текущий адаптивный лимит одновременно выполняемых запросов воркера.',
+    multiprocess_mode='liveall',
+)
+
+
+def record_auth(outcome):
+    """
+    Учитывает результат аутентификации: `cache_hit`, `success`, `missing`, `expired`, `invalid` или `revoked`.
+    """
+    AUTH_OUTCOMES.labels(outcome).inc()
+
+
+def record_cache_lookup(cache, hit):
+    """
+    Учитывает обращение к кэшу `cache` (попадание или промах).
+    """
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def record_shed(route, priority):
+    """
+    Учитывает запрос, отклонённый `AdaptiveConcurrencyMiddleware`.
+    """
+    LOAD_SHED.labels(route, priority).inc()
+
+
+def record_concurrency_limit(limit):
+    CONCURRENCY_LIMIT.set(limit)
+
+
+class QueryStats:
+    """
+    Обёртка выполнения SQL (`connection.execute_wrapper`), считающая количество и время запросов.
+
+    Атрибуты:
+        - `count` (int): Количество выполненных запросов.
+        - `duration` (float): Суммарное время выполнения запросов в секундах.
+        - `closed` (bool): Метрики запроса уже записаны, новые SQL-запросы не учитываются.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.closed = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+# Счётчик SQL-запросов текущего HTTP-запроса. Контекст копируется в потоки `sync_to_async`, поэтому запросы
+# асинхронного ORM, выполняемые не в потоке цикла событий, тоже учитываются
+_query_stats = ContextVar('query_stats', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Обёртка выполнения SQL, установленная на все подключения: передаёт запрос `QueryStats` текущего HTTP-запроса.
+    """
+    stats = _query_stats.get()
+    if stats is None or stats.closed:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    """
+    Устанавливает `count_queries` на подключение. Подключения Django свои в каждом потоке, поэтому обёртка
+    ставится при открытии каждого подключения (сигнал `connection_created`) и при начале запроса.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter)
+
+
+class MetricsMiddleware:
+    """
+    Middleware, собирающий метрики по каждому запросу: время обработки, количество и время SQL-запросов.
+
+    Метрики помечаются шаблоном маршрута (`user/profile/`, а не фактическим путём), чтобы число
+    временных рядов не зависело от идентификаторов в URL. Запросы, не совпавшие ни с одним маршрутом,
+    помечаются как `unmatched`.
+
+    Для потоковых ответов (`StreamingHttpResponse`, `FileResponse`) метрики записываются при закрытии
+    ответа: SQL-запросы, которые выполняет тело ответа при передаче, тоже учитываются, а время
+    включает передачу тела. Работает как в синхронном, так и в асинхронном стеке: SQL-запросы
+    считаются через контекстную переменную, а не по подключениям потока, в котором выполняется middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, started = self.start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            stats.closed = True
+            raise
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, started = self.start()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            stats.closed = True
+            raise
+        return self.finish(request, response, stats, started)
+
+    @staticmethod
+    def start():
+        for connection in connections.all():
+            install_query_counter(connection)
+        stats = QueryStats()
+        _query_stats.set(stats)
+        return stats, time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, stats, started):
+        def observe():
+            stats.closed = True
+            elapsed = time.perf_counter() - started
+            match = getattr(request, 'resolver_match', None)
+            route = match.route if match else 'unmatched'
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(elapsed)
+            DB_QUERIES.labels(route).observe(stats.count)
+            DB_TIME.labels(route).observe(stats.duration)
+
+        if response.streaming:
+            # Тело потокового ответа выполняет свои запросы уже после выхода из middleware;
+            # обработчики `_resource_closers` вызываются в `response.close()` после передачи тела
+            response._resource_closers.append(observe)
+        else:
+            observe()
+        return response
+
+
+def metrics_allowed(request):
+    """
+    Проверяет доступ к `/metrics`: токен `METRICS_AUTH_TOKEN` в заголовке `Authorization: Bearer`
+    или адрес клиента из `METRICS_ALLOWED_NETWORKS`.
+    """
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', '')
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in getattr(settings, 'METRICS_ALLOWED_NETWORKS', ()))
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Отдаёт метрики в текстовом формате Prometheus.
+
+    В многопроцессном режиме значения собираются из файлов всех воркеров. Доступ ограничен
+    `metrics_allowed`, остальные запросы получают `403 FORBIDDEN`.
+
+    :param request: HTTP-запрос.
+    :type request: django.http.HttpRequest
+    :rtype: django.http.HttpResponse
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    registry = REGISTRY
+    if os.environ.get(MULTIPROCESS_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,123 @@
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+
+def adapt_method_mode(is_async, method, method_is_async):
+    """
+    Приводит `method` к синхронному или асинхронному виду, как `BaseHandler.adapt_method_mode`.
+    """
+    if is_async and not method_is_async:
+        return sync_to_async(method, thread_sensitive=True)
+    if not is_async and method_is_async:
+        return async_to_sync(method)
+    return method
+
+
+class MiddlewareChain:
+    """
+    Цепочка middleware, собранная так же, как её собирает `BaseHandler.load_middleware` из `MIDDLEWARE`.
+
+    Каждый middleware получает обработчик в поддерживаемом им режиме (`sync_capable`/`async_capable`),
+    а переходы между синхронным и асинхронным кодом добавляются только на границах, где режим меняется.
+
+    Атрибуты:
+        - `handler` (callable): Вход в цепочку: принимает запрос и возвращает ответ (корутину, если `is_async`).
+        - `view_middleware` (list): Методы `process_view` в порядке вызова.
+        - `template_response_middleware` (list): Методы `process_template_response` в порядке вызова.
+        - `exception_middleware` (list): Методы `process_exception` в порядке вызова.
+    """
+    def __init__(self, middleware, get_response, is_async=False):
+        self.view_middleware = []
+        self.template_response_middleware = []
+        self.exception_middleware = []
+        handler = get_response
+        handler_is_async = is_async
+        for middleware_path in reversed(middleware):
+            middleware_class = import_string(middleware_path)
+            can_sync = getattr(middleware_class, 'sync_capable', True)
+            can_async = getattr(middleware_class, 'async_capable', False)
+            if not can_sync and not can_async:
+                raise ImproperlyConfigured(f'Middleware {middleware_path} must have at least one of '
+                                           f'sync_capable/async_capable set to True.')
+            middleware_is_async = can_async if handler_is_async or not can_sync else False
+            adapted_handler = adapt_method_mode(middleware_is_async, handler, handler_is_async)
+            try:
+                instance = middleware_class(adapted_handler)
+            except MiddlewareNotUsed:
+                continue
+            # Хуки цепочки вызываются из синхронных методов `PathMiddlewareDispatcher`
+            if hasattr(instance, 'process_view'):
+                self.view_middleware.insert(0, self.sync_hook(instance.process_view))
+            if hasattr(instance, 'process_template_response'):
+                self.template_response_middleware.append(self.sync_hook(instance.process_template_response))
+            if hasattr(instance, 'process_exception'):
+                self.exception_middleware.append(self.sync_hook(instance.process_exception))
+            handler = convert_exception_to_response(instance)
+            handler_is_async = middleware_is_async
+        self.handler = adapt_method_mode(is_async, handler, handler_is_async)
+
+    @staticmethod
+    def sync_hook(method):
+        return adapt_method_mode(False, method, iscoroutinefunction(method))
+
+
+class PathMiddlewareDispatcher:
+    """
+    Middleware, выбирающий набор middleware по пути запроса.
+
+    Запросы к путям из `STATELESS_PATH_PREFIXES` (API с JWT-аутентификацией, метрики, аватары) проходят
+    через короткую цепочку `STATELESS_MIDDLEWARE` — без сессий, CSRF, аутентификации Django и сообщений,
+    которые этим путям не нужны. Остальные запросы (админка, Silk, неизвестные пути) проходят через
+    полную цепочку `FULL_MIDDLEWARE`.
+
+    Располагается последним в `MIDDLEWARE`: хуки `process_view`, `process_exception`
+    и `process_template_response` выбранной цепочки вызываются после хуков общих middleware,
+    то есть в том же порядке, что и при плоском списке `MIDDLEWARE`.
+
+    Работает как в синхронном, так и в асинхронном стеке: под ASGI цепочки собираются в асинхронном
+    режиме, и запрос переходит в поток только на первом синхронном middleware цепочки. Хуки остаются
+    синхронными: Django вызывает их через `sync_to_async` одним переходом на все хуки выбранной цепочки.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        is_async = iscoroutinefunction(get_response)
+        if is_async:
+            markcoroutinefunction(self)
+        self.full = MiddlewareChain(getattr(settings, 'FULL_MIDDLEWARE', []), get_response, is_async)
+        self.stateless = MiddlewareChain(getattr(settings, 'STATELESS_MIDDLEWARE', []), get_response, is_async)
+        self.prefixes = tuple(getattr(settings, 'STATELESS_PATH_PREFIXES', ()))
+
+    def chain(self, request):
+        return self.stateless if self.prefixes and request.path_info.startswith(self.prefixes) else self.full
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.chain(request).handler(request)
+
+    async def __acall__(self, request):
+        return await self.chain(request).handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for process_view in self.chain(request).view_middleware:
+            response = process_view(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_exception(self, request, exception):
+        for process_exception in self.chain(request).exception_middleware:
+            response = process_exception(request, exception)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        for process_template_response in self.chain(request).template_response_middleware:
+            response = process_template_response(request, response)
+        return response
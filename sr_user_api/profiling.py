@@ -0,0 +1,107 @@
+import hmac
+import json
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, которым разработчик запрашивает полную запись Silk для своего запроса
+PROFILING_HEADER = 'HTTP_X_SILK_PROFILE'
+
+
+def is_ignored_path(request):
+    """
+    Проверяет, начинается ли путь запроса с одного из префиксов `PROFILING_IGNORE_PATH_PREFIXES`.
+
+    :param request: HTTP-запрос.
+    :type request: django.http.HttpRequest
+    :rtype: bool
+    """
+    prefixes = tuple(getattr(settings, 'PROFILING_IGNORE_PATH_PREFIXES', ()))
+    return bool(prefixes) and request.path_info.startswith(prefixes)
+
+
+def should_intercept(request):
+    """
+    Решает, записывать ли запрос в Silk (подключается через `SILKY_INTERCEPT_FUNC`).
+
+    Запросы к путям из `PROFILING_IGNORE_PATH_PREFIXES` не записываются никогда. Остальные запросы
+    записываются, если в заголовке `X-Silk-Profile` передан токен `PROFILING_DEBUG_TOKEN`,
+    либо они попали в случайную выборку с долей `PROFILING_SAMPLE_RATE`. Прочие запросы проходят
+    без сбора SQL и тела запроса и ничего не пишут в таблицы Silk.
+
+    :param request: HTTP-запрос.
+    :type request: django.http.HttpRequest
+    :rtype: bool
+    """
+    if is_ignored_path(request):
+        return False
+    token = getattr(settings, 'PROFILING_DEBUG_TOKEN', '')
+    header = request.META.get(PROFILING_HEADER)
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        return True
+    return random.random() < getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+
+
+class SlowRequestProfilingMiddleware:
+    """
+    Middleware, сохраняющий в Silk сводку по медленным запросам, не попавшим в выборку.
+
+    Располагается в `MIDDLEWARE` перед `SilkyMiddleware`. Если запрос не записывался Silk, но выполнялся
+    дольше `PROFILING_SLOW_REQUEST_MS` миллисекунд, в Silk сохраняются путь, метод, представление,
+    время выполнения и статус ответа (без SQL-запросов и тел), чтобы медленные запросы были видны в `/silk/`.
+    Записи подчиняются общему лимиту `SILKY_MAX_RECORDED_REQUESTS` и удаляются вместе с остальными.
+    Запросы к путям из `PROFILING_IGNORE_PATH_PREFIXES` не сохраняются.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 0)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        if (threshold and elapsed >= threshold and not getattr(request, 'silk_is_intercepted', False)
+                and not is_ignored_path(request)):
+            try:
+                record_slow_request(request, response, elapsed)
+            except DatabaseError:
+                logger.warning("Не удалось сохранить медленный запрос %s %s в Silk", request.method, request.path)
+        return response
+
+
+def record_slow_request(request, response, elapsed):
+    """
+    Сохраняет сводку по запросу в модели Silk `Request`/`Response`.
+
+    :param request: HTTP-запрос.
+    :type request: django.http.HttpRequest
+    :param response: HTTP-ответ.
+    :type response: django.http.HttpResponse
+    :param elapsed: Время выполнения запроса в миллисекундах.
+    :type elapsed: float
+    """
+    from silk.models import Request, Response
+
+    end_time = timezone.now()
+    match = getattr(request, 'resolver_match', None)
+    silk_request = Request.objects.create(
+        path=request.path,
+        method=request.method,
+        query_params=json.dumps(request.GET.dict()) if request.GET else '',
+        view_name=match.view_name if match else '',
+        start_time=end_time - timedelta(milliseconds=elapsed),
+        end_time=end_time,
+    )
+    Response.objects.create(
+        request=silk_request,
+        status_code=response.status_code,
+        encoded_headers=json.dumps({'Content-Type': response.get('Content-Type', '')}),
+    )
@@ -0,0 +1,56 @@
+import math
+import re
+from decimal import Decimal
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+# Числа с плавающей точкой, которые orjson и `json` записывают по-разному: `json` использует экспоненту
+# (`1e+16`, `1e-05`), а orjson — `1e16` или `0.00001`. Совпадения внутри строк лишь включают медленный путь.
+FLOAT_MISMATCH = re.compile(rb'\de-?\d|0\.0000')
+
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def has_non_finite(data):
+    """
+    Проверяет, есть ли в данных `NaN` или бесконечность: orjson записывает их как `null`,
+    а `JSONRenderer` отклоняет (`STRICT_JSON`) или записывает как `NaN`/`Infinity`.
+    """
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, Decimal):
+        return not data.is_finite()
+    if isinstance(data, dict):
+        return any(has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(has_non_finite(value) for value in data)
+    return False
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON-рендерер на основе orjson, выдающий те же байты, что и `rest_framework.renderers.JSONRenderer`.
+
+    Типы, которые DRF форматирует по-своему (даты и время, `Decimal`, ленивые строки и т.д.), передаются
+    в `JSONEncoder` DRF через `default`. Если совпадение с выводом DRF не гарантировано — запрошен отступ,
+    изменены настройки `UNICODE_JSON`/`COMPACT_JSON`, в данных есть целые вне 64 бит, ключи не строки,
+    числа в экспоненциальной записи, `NaN` или бесконечность, — ответ формируется родительским `JSONRenderer`.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if (self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if FLOAT_MISMATCH.search(ret) or (b'null' in ret and has_non_finite(data)):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Как и JSONRenderer, экранируем U+2028 и U+2029, недопустимые в строках JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Минимальная ёмкость фильтра, чтобы при пустом чёрном списке не пересобирать его на каждое добавление
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """
+    Фильтр Блума для строк.
+
+    Отвечает «точно нет» или «возможно есть» с долей ложных срабатываний около `error_rate`
+    при количестве элементов не больше `capacity`. Позиции битов вычисляются из одного
+    дайджеста BLAKE2b двойным хэшированием.
+
+    Атрибуты:
+        - `capacity` (int): Количество элементов, на которое рассчитан фильтр.
+        - `count` (int): Количество добавленных элементов.
+    """
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.count = 0
+        self._size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self._size for index in range(self._hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """
+    Отозванные JWT (`jti`) из таблиц `rest_framework_simplejwt.token_blacklist` в памяти процесса.
+
+    Проверка токена выполняется по фильтру Блума без обращения к БД; запрос к БД делается только
+    при срабатывании фильтра, чтобы отсеять ложные срабатывания. Фильтр обновляется не чаще раза
+    в `JWT_REVOCATION_REFRESH_SECONDS` секунд: добавляются записи чёрного списка, появившиеся
+    с прошлого обновления (с запасом `JWT_REVOCATION_OVERLAP_SECONDS` на задержку фиксации транзакций
+    и расхождение часов). Раз в `JWT_REVOCATION_REBUILD_SECONDS` секунд, а также при заполнении фильтр
+    собирается заново только из ещё не истёкших токенов.
+
+    Если БД недоступна, используется прежнее состояние фильтра, а токен при ошибке проверки
+    считается не отозванным (с предупреждением в журнале).
+    """
+    def __init__(self):
+        self._filter = BloomFilter(MIN_CAPACITY, self._error_rate())
+        self._revoked = {}  # Подтверждённые отозванные jti и сроки их истечения
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+        self._rebuilt_at = None
+        self._since = None
+
+    @staticmethod
+    def _error_rate():
+        return getattr(settings, 'JWT_REVOCATION_FALSE_POSITIVE_RATE', 0.001)
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'JWT_REVOCATION_CHECK', True)
+
+    def needs_refresh(self):
+        return (self._refreshed_at is None
+                or time.monotonic() - self._refreshed_at >= getattr(settings, 'JWT_REVOCATION_REFRESH_SECONDS', 5))
+
+    def refresh(self):
+        """
+        Добавляет в фильтр новые записи чёрного списка или собирает фильтр заново.
+
+        Обновление выполняет один поток; остальные в это время проверяют токены по текущему фильтру
+        (кроме самой первой загрузки, которую ждут все).
+        """
+        if not self._lock.acquire(blocking=self._refreshed_at is None):
+            return
+        try:
+            if not self.needs_refresh():
+                return
+            from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+            started = time.monotonic()
+            now = timezone.now()
+            rebuild = (self._rebuilt_at is None or self._filter.count >= self._filter.capacity
+                       or started - self._rebuilt_at >= getattr(settings, 'JWT_REVOCATION_REBUILD_SECONDS', 3600))
+            queryset = BlacklistedToken.objects.filter(token__expires_at__gt=now)
+            if not rebuild:
+                overlap = timedelta(seconds=getattr(settings, 'JWT_REVOCATION_OVERLAP_SECONDS', 30))
+                queryset = queryset.filter(blacklisted_at__gte=self._since - overlap)
+            try:
+                jtis = list(queryset.values_list('token__jti', flat=True))
+            except DatabaseError:
+                logger.warning("Не удалось обновить список отозванных токенов", exc_info=True)
+                self._refreshed_at = started
+                return
+
+            if rebuild:
+                bloom = BloomFilter(max(MIN_CAPACITY, 2 * len(jtis)), self._error_rate())
+                for jti in jtis:
+                    bloom.add(jti)
+                self._filter = bloom
+                self._revoked = {jti: expires_at for jti, expires_at in self._revoked.items() if expires_at > now}
+                self._rebuilt_at = started
+                logger.info("Фильтр отозванных токенов пересобран: %s записей", len(jtis))
+            else:
+                for jti in jtis:
+                    if jti not in self._filter:
+                        self._filter.add(jti)
+            self._since = now
+            self._refreshed_at = started
+        finally:
+            self._lock.release()
+
+    def confirm(self, jti):
+        """
+        Проверяет по БД, действительно ли отозван токен, на котором сработал фильтр.
+
+        :param jti: Идентификатор токена.
+        :type jti: str
+        :rtype: bool
+        """
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+        expires_at = self._revoked.get(jti)
+        if expires_at is None:
+            try:
+                expires_at = (BlacklistedToken.objects.filter(token__jti=jti)
+                              .values_list('token__expires_at', flat=True).first())
+            except DatabaseError:
+                logger.warning("Не удалось проверить отзыв токена %s", jti, exc_info=True)
+                return False
+            if expires_at is None:
+                return False
+            self._revoked[jti] = expires_at
+        return True
+
+    def is_revoked(self, jti):
+        """
+        Проверяет, отозван ли токен с идентификатором `jti`.
+
+        :param jti: Значение `jti` из payload токена (или `None` для токенов без него).
+        :type jti: str or None
+        :rtype: bool
+        """
+        if not jti or not self.enabled():
+            return False
+        if self.needs_refresh():
+            self.refresh()
+        return jti in self._filter and self.confirm(jti)
+
+    async def ais_revoked(self, jti):
+        """
+        Асинхронный вариант `is_revoked`: обращения к БД выполняются в потоке через `sync_to_async`.
+        """
+        if not jti or not self.enabled():
+            return False
+        if self.needs_refresh():
+            await sync_to_async(self.refresh)()
+        return jti in self._filter and await sync_to_async(self.confirm)(jti)
+
+
+# Список отозванных токенов, общий для всех запросов процесса
+revocation_list = RevocationList()
@@ -12,9 +12,12 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from datetime import timedelta
 import environ
 
+from sr_user_api.profiling import should_intercept
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -53,6 +56,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'corsheaders',
@@ -64,19 +68,40 @@ INSTALLED_APPS = [
 
 ]
 
+# Общие middleware для всех запросов; остальные подключаются PathMiddlewareDispatcher в зависимости от пути
 MIDDLEWARE = [
+    'sr_user_api.metrics.MetricsMiddleware',
+    'sr_user_api.load_shedding.AdaptiveConcurrencyMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'sr_user_api.middleware.PathMiddlewareDispatcher',
+]
+
+# Полная цепочка: админка, Silk и все пути, не перечисленные в STATELESS_PATH_PREFIXES
+FULL_MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-
-    'corsheaders.middleware.CorsMiddleware',
+    'sr_user_api.profiling.SlowRequestProfilingMiddleware',
     'silk.middleware.SilkyMiddleware',
+]
 
+# Короткая цепочка для путей без сессий: API аутентифицируется только JWT, а представления DRF
+# и так освобождены от проверки CSRF (csrf_exempt)
+STATELESS_MIDDLEWARE = [
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'sr_user_api.profiling.SlowRequestProfilingMiddleware',
+    'silk.middleware.SilkyMiddleware',
 ]
+STATELESS_PATH_PREFIXES = ['/user/', '/media/', '/metrics']
+
+# Проверки админки ищут middleware сессий, аутентификации и сообщений только в MIDDLEWARE,
+# а здесь они подключаются через FULL_MIDDLEWARE
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
 
 ROOT_URLCONF = 'sr_user_api.urls'
 
@@ -113,11 +138,147 @@ DATABASES = {
     },
 }
 
+# Реплики PostgreSQL только для чтения (хосты через запятую); остальные параметры подключения как у основной БД
+DATABASE_REPLICA_HOSTS = env.list('DATABASE_REPLICA_HOSTS_USER_API', default=[])
+for index, host in enumerate(DATABASE_REPLICA_HOSTS):
+    # В тестах реплика указывает на тестовую копию основной БД
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Запись — в основную БД, чтение профилей, поиска и пакетной выдачи — из реплик (см. sr_user_api/db_router.py)
+DATABASE_ROUTERS = ['sr_user_api.db_router.ReplicaRouter']
+# Сколько секунд после записи чтение пользователя выполняется из основной БД (read-your-writes)
+DATABASE_PIN_SECONDS = env.int('DATABASE_PIN_SECONDS_USER_API', default=10)
+# Кэш для отметок о недавней записи; при нескольких процессах должен быть общим (например, Redis)
+DATABASE_PIN_CACHE_ALIAS = 'default'
+# Допустимое отставание реплики (в секундах) и период его проверки
+DATABASE_REPLICA_MAX_LAG = env.float('DATABASE_REPLICA_MAX_LAG_USER_API', default=5)
+DATABASE_REPLICA_CHECK_INTERVAL = 5
+# На сколько секунд реплика исключается из чтения после ошибки подключения или превышения отставания
+DATABASE_REPLICA_RETRY_SECONDS = 30
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sr-user-api',
+    },
+}
+
+# Время жизни сериализованного профиля пользователя в кэше (в секундах)
+USER_PROFILE_CACHE_ALIAS = 'default'
+USER_PROFILE_CACHE_TIMEOUT = env.int('USER_PROFILE_CACHE_TIMEOUT', default=300)
+
+# Максимальный размер документа `settings` пользователя (в байтах)
+USER_SETTINGS_MAX_BYTES = env.int('USER_SETTINGS_MAX_BYTES', default=64 * 1024)
+
+# Максимальное количество идентификаторов в одном запросе к `/user/batch/`
+USER_BATCH_MAX_SIZE = env.int('USER_BATCH_MAX_SIZE', default=100)
+
+# Пакетное создание пользователей в `/user/create/`: максимальный размер пакета и размер части для `bulk_create`
+USER_BULK_CREATE_MAX_SIZE = env.int('USER_BULK_CREATE_MAX_SIZE', default=10000)
+USER_BULK_CREATE_CHUNK_SIZE = env.int('USER_BULK_CREATE_CHUNK_SIZE', default=500)
+
+# Idempotency-Key для `/user/create/`: сколько секунд хранится ответ для повторов и сколько — отметка
+# о выполняемом запросе. При нескольких процессах кэш должен быть общим (например, Redis)
+IDEMPOTENCY_CACHE_ALIAS = 'default'
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=600)
+IDEMPOTENCY_LOCK_TTL = 30
+
+# Поиск пользователей: размер страницы по умолчанию и максимальный
+USER_SEARCH_PAGE_SIZE = 20
+USER_SEARCH_MAX_PAGE_SIZE = 100
+
+# Лента изменений: размер страницы и запас (в секундах) на задержку фиксации транзакций
+USER_CHANGES_PAGE_SIZE = 100
+USER_CHANGES_MAX_PAGE_SIZE = 1000
+USER_CHANGES_SAFETY_WINDOW = 2
+
+# Выгрузка пользователей: размер порции, читаемой из серверного курсора
+USER_EXPORT_CHUNK_SIZE = 2000
+
+# Админка: выше этой оценки количества записей точный COUNT(*) не выполняется
+ADMIN_EXACT_COUNT_THRESHOLD = 10000
+
+# Доступ к /metrics: по токену (заголовок `Authorization: Bearer <METRICS_AUTH_TOKEN>` в настройках
+# scrape Prometheus) или с адресов из METRICS_ALLOWED_NETWORKS; остальные запросы получают 403
+METRICS_AUTH_TOKEN = env.str('METRICS_AUTH_TOKEN', default='')
+METRICS_ALLOWED_NETWORKS = env.list('METRICS_ALLOWED_NETWORKS', default=['127.0.0.0/8', '::1/128'])
+
+# Адаптивный лимит одновременно выполняемых запросов воркера (см. sr_user_api/load_shedding.py): при росте
+# времени ответа лимит снижается, и лишние запросы сразу получают 503 с Retry-After вместо ожидания в очереди
+LOAD_SHEDDING_ENABLED = env.bool('LOAD_SHEDDING_ENABLED', default=True)
+LOAD_SHEDDING_INITIAL_LIMIT = env.int('LOAD_SHEDDING_INITIAL_LIMIT', default=8)
+LOAD_SHEDDING_MIN_LIMIT = 1
+LOAD_SHEDDING_MAX_LIMIT = 64
+# Во сколько раз время ответа должно превысить базовое (и быть не меньше LOAD_SHEDDING_MIN_LATENCY секунд),
+# чтобы лимит был снижен
+LOAD_SHEDDING_LATENCY_TOLERANCE = 2.0
+LOAD_SHEDDING_MIN_LATENCY = 0.05
+LOAD_SHEDDING_RETRY_AFTER = 1
+# Приоритеты маршрутов: critical занимает весь лимит, normal (по умолчанию) — 75%, sheddable — 50%.
+# Загрузка аватара (multipart) всегда sheddable. Отдача аватаров дешёвая (файл или X-Accel-Redirect, производные
+# создаются в фоне), а без неё клиент не может показать профиль, поэтому она critical
+LOAD_SHEDDING_ROUTE_PRIORITIES = {
+    'user/create/': 'critical',
+    'user/profile/': 'critical',
+    'user/async/create/': 'critical',
+    'user/async/profile/': 'critical',
+    'metrics': 'critical',
+    'media/avatars/<path:name>': 'critical',
+    'user/search/': 'sheddable',
+    'user/export/': 'sheddable',
+    'user/avatar/uploads/': 'sheddable',
+    'user/avatar/uploads/<uuid:upload_id>/': 'sheddable',
+}
+
+# Silk: записываются только запросы из выборки, запросы с заголовком `X-Silk-Profile: <PROFILING_DEBUG_TOKEN>`
+# и сводки по запросам дольше PROFILING_SLOW_REQUEST_MS (0 - не записывать медленные запросы)
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', default=0.01)
+PROFILING_DEBUG_TOKEN = env('PROFILING_DEBUG_TOKEN', default='')
+PROFILING_SLOW_REQUEST_MS = env.int('PROFILING_SLOW_REQUEST_MS', default=1000)
+# Запросы к этим путям (сам Silk, метрики Prometheus) не записываются ни в выборку, ни как медленные
+PROFILING_IGNORE_PATH_PREFIXES = ['/silk/', '/metrics']
+
+SILKY_INTERCEPT_FUNC = should_intercept
+# SilkyMiddleware подключается через PathMiddlewareDispatcher, а silk_profile ищет в MIDDLEWARE этот класс
+SILKY_MIDDLEWARE_CLASS = 'sr_user_api.middleware.PathMiddlewareDispatcher'
+# Не больше SILKY_MAX_RECORDED_REQUESTS записей: лишние удаляются при сохранении новых
+# (проверка выполняется для SILKY_MAX_RECORDED_REQUESTS_CHECK_PERCENT процентов записей)
+SILKY_MAX_RECORDED_REQUESTS = env.int('SILKY_MAX_RECORDED_REQUESTS', default=10000)
+SILKY_MAX_RECORDED_REQUESTS_CHECK_PERCENT = 10
+# Тела запросов и ответов больше этого размера (в байтах) не сохраняются
+SILKY_MAX_REQUEST_BODY_SIZE = 64 * 1024
+SILKY_MAX_RESPONSE_BODY_SIZE = 64 * 1024
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'sr_user_api.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'sr_user_api.renderers.ORJSONRenderer',  # Тот же вывод, что у JSONRenderer, но быстрее
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
+# Размер in-process кэша проверенных JWT-токенов (0 - кэш отключён)
+JWT_TOKEN_CACHE_SIZE = env.int('JWT_TOKEN_CACHE_SIZE', default=1024)
+# Области доступа (claim `scope` в JWT) межсервисных и административных токенов: только они получают
+# данные других пользователей (пакетное чтение, поиск, выгрузка, лента изменений, пакетное создание)
+JWT_SERVICE_SCOPES = env.list('JWT_SERVICE_SCOPES', default=['service'])
+
+# Проверка отзыва токенов по таблицам token_blacklist (см. sr_user_api/revocation.py): новые отзывы
+# подхватываются не позже чем через JWT_REVOCATION_REFRESH_SECONDS секунд, фильтр пересобирается
+# из неистёкших токенов раз в JWT_REVOCATION_REBUILD_SECONDS секунд
+JWT_REVOCATION_CHECK = env.bool('JWT_REVOCATION_CHECK', default=True)
+JWT_REVOCATION_REFRESH_SECONDS = env.int('JWT_REVOCATION_REFRESH_SECONDS', default=5)
+JWT_REVOCATION_REBUILD_SECONDS = 3600
+# Запас на задержку фиксации транзакций и расхождение часов при инкрементальном обновлении (в секундах)
+JWT_REVOCATION_OVERLAP_SECONDS = 30
+# Доля ложных срабатываний фильтра Блума (каждое стоит одного запроса к БД)
+JWT_REVOCATION_FALSE_POSITIVE_RATE = 0.001
+
 # Auth Logic in Auth Service!
 # SIMPLE_JWT = {
 #     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -173,6 +334,32 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Уменьшенные копии аватаров: размеры (px), форматы и фоновый пул для их генерации
+AVATAR_VARIANT_SIZES = (64, 128, 256)
+AVATAR_VARIANT_FORMATS = ('webp', 'jpeg')
+AVATAR_WORKERS = env.int('AVATAR_WORKERS', default=2)
+AVATAR_QUEUE_SIZE = env.int('AVATAR_QUEUE_SIZE', default=100)
+
+# Возобновляемая загрузка аватаров (/user/avatar/uploads/): каталог незавершённых загрузок (общий для всех
+# воркеров), максимальный размер файла и срок жизни загрузки (в секундах)
+AVATAR_UPLOAD_DIR = env.str('AVATAR_UPLOAD_DIR', default=os.path.join(tempfile.gettempdir(), 'avatar-uploads'))
+AVATAR_UPLOAD_MAX_BYTES = env.int('AVATAR_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024)
+AVATAR_UPLOAD_EXPIRE_SECONDS = 24 * 3600
+# Допустимые форматы и максимальное количество пикселей загружаемого изображения
+AVATAR_UPLOAD_FORMATS = ('JPEG', 'PNG', 'WEBP')
+AVATAR_UPLOAD_MAX_PIXELS = 40_000_000
+# Пул процессов проверки изображений: количество процессов, очередь проверок и таймаут ожидания (в секундах)
+AVATAR_VALIDATION_WORKERS = env.int('AVATAR_VALIDATION_WORKERS', default=2)
+AVATAR_VALIDATION_QUEUE_SIZE = env.int('AVATAR_VALIDATION_QUEUE_SIZE', default=16)
+AVATAR_VALIDATION_TIMEOUT = 30
+
+# Отдача аватаров: `None` - файл отдаёт Django, `x-accel-redirect` - nginx (internal location
+# с префиксом AVATAR_SENDFILE_PREFIX, указывающий на MEDIA_ROOT), `x-sendfile` - Apache/lighttpd
+AVATAR_SENDFILE_MODE = env.str('AVATAR_SENDFILE_MODE', default=None)
+AVATAR_SENDFILE_PREFIX = '/protected-media/'
+# Время кэширования аватаров, сохранённых не по содержимому (в секундах)
+AVATAR_CACHE_MAX_AGE = 3600
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -198,6 +385,20 @@ CORS_ALLOW_HEADERS = [
     'Content-Type',
     'X-CSRFToken',
     'Access-Control-Allow-Origin',
+    'If-Match',
+    'If-None-Match',
+    'Upload-Length',
+    'Upload-Offset',
+    'Tus-Resumable',
+]
+
+# Заголовки ответа, доступные JavaScript на другом источнике (состояние возобновляемой загрузки)
+CORS_EXPOSE_HEADERS = [
+    'Location',
+    'Upload-Offset',
+    'Upload-Length',
+    'Upload-Expires',
+    'Tus-Resumable',
 ]
 
 CORS_ALLOWED_ORIGIN_REGEXES = [
@@ -237,6 +438,13 @@ CSRF_TRUSTED_ORIGINS = [
 
 ]
 
+# Запись логов через очередь в фоновом потоке (QueueHandler/QueueListener), чтобы запрос не ждал вывода
+LOG_ASYNC = env.bool('LOG_ASYNC', default=True)
+LOG_QUEUE_SIZE = env.int('LOG_QUEUE_SIZE', default=10000)
+
+# Доля записываемых INFO/DEBUG-сообщений аутентификации (предупреждения и ошибки пишутся всегда)
+AUTH_LOG_SAMPLE_RATE = env.float('AUTH_LOG_SAMPLE_RATE', default=0.01)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -251,10 +459,20 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        'auth_sampling': {
+            '()': 'sr_user_api.log.SamplingFilter',
+            'rate': AUTH_LOG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            '()': 'sr_user_api.log.QueueStreamHandler',
+            'queue_size': LOG_QUEUE_SIZE,
             'formatter': 'verbose',  # Используем форматтер с временной меткой
+        } if LOG_ASYNC else {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
         },
     },
     'root': {
@@ -272,5 +490,8 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'sr_user_api.authentication': {  # строки аутентификации пишутся на каждый запрос — сэмплируем
+            'filters': ['auth_sampling'],
+        },
     },
 }
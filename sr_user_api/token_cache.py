@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """
+    Ограниченный LRU-кэш уже проверенных JWT-токенов.
+
+    Ключом служит SHA-256 дайджест токена, значением — декодированный payload и момент истечения
+    токена (`exp`). Запись живёт не дольше, чем сам токен: по наступлении `exp` она удаляется
+    и больше не отдаётся. В кэш попадают только токены, успешно прошедшие `jwt.decode`.
+
+    Атрибуты:
+        - `maxsize` (int): Максимальное количество записей. `0` отключает кэш.
+        - `hits` (int): Количество обращений, обслуженных из кэша.
+        - `misses` (int): Количество обращений, потребовавших полной проверки токена.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """
+        Возвращает payload проверенного токена или `None`, если токена нет в кэше либо он истёк.
+
+        :param token: JWT-токен в исходном виде.
+        :type token: str
+        :return: Декодированный payload токена или `None`.
+        :rtype: dict or None
+        """
+        if not self.maxsize:
+            return None
+
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            payload, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, token, payload):
+        """
+        Сохраняет payload проверенного токена до момента его истечения.
+
+        Токены без числового `exp` не кэшируются, так как срок жизни записи определить нельзя.
+
+        :param token: JWT-токен в исходном виде.
+        :type token: str
+        :param payload: Декодированный и проверенный payload токена.
+        :type payload: dict
+        """
+        exp = payload.get('exp')
+        if not self.maxsize or not isinstance(exp, (int, float)) or exp <= time.time():
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Очищает кэш и сбрасывает счётчики.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Возвращает текущие показатели кэша.
+
+        :return: Словарь с ключами `size`, `maxsize`, `hits` и `misses`.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
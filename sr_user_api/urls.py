@@ -17,8 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from sr_user_api.metrics import metrics_view
+from user_service.media import serve_avatar
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('user_service.urls')),
     path('silk/', include('silk.urls', namespace='silk')),
+    path('media/avatars/<path:name>', serve_avatar, name='avatar'),
+    path('metrics', metrics_view, name='metrics'),
 ]
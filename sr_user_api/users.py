@@ -1,4 +1,7 @@
 
+from django.conf import settings
+
+
 class SimpleUser:
     """
     Упрощённое представление аутентифицированного пользователя.
@@ -6,11 +9,17 @@ class SimpleUser:
     Атрибуты:
         - `id` (str): Идентификатор пользователя, полученный из JWT-пayload.
         - `username` (str): Имя пользователя, полученное из JWT-пayload.
+        - `scopes` (frozenset): Области доступа из claim `scope` (строка через пробел или список).
+        - `is_service` (bool): Токен выдан сервису или администратору (есть область из `JWT_SERVICE_SCOPES`)
+         и даёт доступ к данным всех пользователей.
         - `is_authenticated` (bool): Флаг, указывающий, что пользователь аутентифицирован. Всегда `True`.
     """
     def __init__(self, payload):
         self.id = payload.get('user_id')
         self.username = payload.get('username')
+        scope = payload.get('scope') or ()
+        self.scopes = frozenset(scope.split() if isinstance(scope, str) else scope)
+        self.is_service = not self.scopes.isdisjoint(getattr(settings, 'JWT_SERVICE_SCOPES', ('service',)))
         self.is_authenticated = True
 
 
@@ -20,6 +29,8 @@ class AnonymousUser:
 
     Атрибуты:
         - `is_authenticated` (bool): Флаг, указывающий, что пользователь не аутентифицирован. Всегда `False`.
+        - `is_service` (bool): Всегда `False`.
     """
     def __init__(self):
         self.is_authenticated = False
+        self.is_service = False
@@ -1,8 +1,21 @@
+import uuid
+
 from django.contrib import admin
 from .models import User
+from .pagination import EstimatedCountPaginator
 
 
 @admin.register(User)
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ['id', 'first_name', 'last_name', 'created_at', 'updated_at']
-    search_fields = ['id', 'first_name', 'last_name']
+    search_fields = ['first_name', 'last_name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по UUID идёт по первичному ключу, а не через ILIKE по тексту id
+        try:
+            user_id = uuid.UUID(search_term.strip())
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id=user_id), False
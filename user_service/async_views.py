@@ -0,0 +1,317 @@
+import json
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from sr_user_api.authentication import JWTAuthentication
+from sr_user_api.db_router import ais_pinned, apin_to_primary, choose_replica, reset_database, use_database
+from sr_user_api.renderers import ORJSONRenderer
+
+from .avatars import schedule_avatar_processing
+from .cache import aget_cached_profile, ainvalidate_profile, aset_cached_profile
+from .conditional import evaluate_preconditions, has_conditional_headers, set_validators
+from .idempotency import (
+    IDEMPOTENCY_HEADER,
+    aclaim,
+    acomplete,
+    arelease,
+    idempotency_cache_key,
+    replay,
+    request_fingerprint,
+    validate_key,
+)
+from .models import User
+from .permissions import is_self_or_service
+from .serializers import (
+    USER_ROW_FIELDS,
+    UserSerializer,
+    parse_sparse_fields,
+    project_fields,
+    user_columns,
+    user_row_representation,
+)
+from .updates import changed, insert_returning, update_returning
+
+
+def json_response(data, status=200):
+    """
+    Формирует JSON-ответ, байт в байт совпадающий с ответом DRF (`ORJSONRenderer`).
+
+    :param data: Данные для сериализации в JSON.
+    :type data: dict or list
+    :param status: HTTP-статус ответа.
+    :type status: int
+    :rtype: django.http.HttpResponse
+    """
+    return HttpResponse(ORJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+class AsyncAPIView(View):
+    """
+    Базовое асинхронное представление для работы под ASGI-сервером.
+
+    Аутентифицирует запрос через `JWTAuthentication.aauthenticate`, разбирает JSON-тело и отдаёт
+    ошибки в том же формате, что и DRF (`{"detail": ...}`), чтобы клиенты не замечали разницы
+    между синхронными и асинхронными эндпоинтами.
+
+    Атрибуты:
+        - `authentication_required` (bool): Требуется ли аутентифицированный пользователь.
+    """
+    authentication_required = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Как и в DRF, аутентификация выполняется по JWT, а не по сессии, поэтому CSRF-проверка не нужна
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = await JWTAuthentication().aauthenticate(request)
+        except AuthenticationFailed as exc:
+            return json_response({"detail": str(exc.detail)}, status=exc.status_code)
+
+        request.user = result[0] if result else None
+        if self.authentication_required and request.user is None:
+            return json_response({"detail": "Authentication credentials were not provided."}, status=403)
+
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        return await handler(request, *args, **kwargs)
+
+    @staticmethod
+    def parse_json(request):
+        """
+        Разбирает JSON-тело запроса.
+
+        :param request: HTTP-запрос.
+        :type request: django.http.HttpRequest
+        :return: Разобранные данные или `None`, если тело не является корректным JSON.
+        :rtype: dict or list or None
+        """
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+
+
+# Асинхронное создание нового пользователя
+class AsyncCreateUserView(AsyncAPIView):
+    """
+    Асинхронный аналог `CreateUserView` (только JSON).
+
+    Атрибуты:
+        - `authentication_required` (bool): Доступ разрешён всем, так как пользователь создаётся после авторизации.
+    """
+    authentication_required = False
+
+    async def post(self, request):
+        """
+        Обрабатывает POST-запросы для создания нового пользователя.
+
+        Процесс:
+            1. Для запроса с `Idempotency-Key` возвращает сохранённый ответ на повтор (см. `idempotent`).
+            2. Валидирует входящие данные с помощью `UserSerializer`.
+            3. Создаёт пользователя одним `INSERT ... ON CONFLICT DO NOTHING` и сбрасывает его профиль в кэше.
+            4. Возвращает данные созданного пользователя с кодом статуса `201 CREATED`. Если пользователь
+               с таким `id` уже существует, возвращает его текущий профиль с кодом статуса `200 OK` самому
+               пользователю или сервису, остальным — `409 CONFLICT` без данных профиля.
+
+        :param request: HTTP-запрос, содержащий данные для создания пользователя.
+        :type request: django.http.HttpRequest
+        :rtype: django.http.HttpResponse
+        """
+        data = self.parse_json(request)
+        if not isinstance(data, dict):
+            return json_response({"detail": "Invalid JSON body."}, status=400)
+
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return await self.create(data, request.user)
+        error = validate_key(key)
+        if error is not None:
+            return json_response({"detail": error}, status=400)
+
+        cache_key = idempotency_cache_key(request.path, key, request.user)
+        fingerprint = request_fingerprint(data)
+        record = await aclaim(cache_key, fingerprint)
+        if record is not None:
+            return replay(record, fingerprint, json_response)
+
+        try:
+            response = await self.create(data, request.user)
+        except BaseException:
+            await arelease(cache_key)
+            raise
+        await acomplete(cache_key, fingerprint, json.loads(response.content), response)
+        return response
+
+    @staticmethod
+    async def create(data, caller):
+        """
+        Валидирует данные и создаёт пользователя для `post`; `caller` — пользователь запроса.
+        """
+        serializer = UserSerializer(data=data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+
+        user = User(**serializer.validated_data)
+        if await sync_to_async(insert_returning)(user, ['id']) is None:
+            if not is_self_or_service(caller, user.id):
+                return json_response({"detail": "A user with this id already exists."}, status=409)
+            row = await User.objects.filter(id=user.id).values(*USER_ROW_FIELDS).afirst()
+            return json_response(user_row_representation(row))
+
+        await ainvalidate_profile(user.id)
+        response = json_response(UserSerializer(user).data, status=201)
+        await apin_to_primary([user.id], response)
+        return response
+
+
+# Асинхронный просмотр и обновление профиля пользователя
+class AsyncUserProfileView(AsyncAPIView):
+    """
+    Асинхронный аналог `UserProfileView` (только JSON, без загрузки аватара).
+
+    Использует асинхронные методы ORM (`aget`, `asave`, `aupdate`) и асинхронный API кэша,
+    поэтому под ASGI-сервером медленный запрос к БД не блокирует обработку других запросов процесса.
+    """
+
+    async def get(self, request):
+        """
+        Обрабатывает GET-запросы для получения профиля текущего пользователя.
+
+        Поведение совпадает с `UserProfileView.get`: кэш профилей, `ETag`/`Last-Modified`, ответ `304`,
+        параметры `fields`/`exclude` и чтение из реплики БД, если оно не закреплено за основной.
+
+        :param request: HTTP-запрос.
+        :type request: django.http.HttpRequest
+        :rtype: django.http.HttpResponse
+        """
+        try:
+            fields = parse_sparse_fields(request.GET)
+        except ValidationError as exc:
+            return json_response(exc.detail, status=400)
+
+        user_id = request.user.id
+        cached = await aget_cached_profile(user_id)
+        if cached is not None:
+            return (evaluate_preconditions(request, user_id, cached['updated_at'])
+                    or set_validators(json_response(project_fields(cached, fields)), user_id, cached['updated_at']))
+
+        replica = None if await ais_pinned(request, user_id) else await sync_to_async(choose_replica)()
+        token = use_database(replica)
+        try:
+            return await self.load_profile(request, user_id, fields)
+        finally:
+            reset_database(token)
+
+    @staticmethod
+    async def load_profile(request, user_id, fields):
+        """
+        Загружает профиль из БД (если он не найден в кэше) и формирует ответ для `get`.
+        """
+        if has_conditional_headers(request):
+            updated_at = await User.objects.filter(id=user_id).values_list('updated_at', flat=True).afirst()
+            if updated_at is None:
+                return json_response({"detail": "User not found."}, status=404)
+            not_modified = evaluate_preconditions(request, user_id, updated_at)
+            if not_modified is not None:
+                return not_modified
+
+        columns = USER_ROW_FIELDS if fields is None else user_columns([*fields, 'updated_at'])
+        row = await User.objects.filter(id=user_id).values(*columns).afirst()
+        if row is None:
+            return json_response({"detail": "User not found."}, status=404)
+
+        data = user_row_representation(row, fields=fields)
+        if fields is None:
+            await aset_cached_profile(user_id, data)
+        return set_validators(json_response(data), user_id, row['updated_at'])
+
+    async def patch(self, request):
+        """
+        Обрабатывает PATCH-запросы для частичного обновления профиля текущего пользователя.
+
+        Процесс:
+            1. Валидирует входящие данные с помощью `UserSerializer`.
+            2. Для условного запроса читает версию строки и проверяет `If-Match` (`412 PRECONDITION FAILED`).
+            3. Обновляет строку одним `UPDATE ... RETURNING` только если хотя бы одно поле изменилось.
+               Условный запрос дополнительно ограничен `WHERE updated_at = <версия клиента>`,
+               поэтому параллельная запись приводит к `412`, а не к потере изменений. При очистке аватара
+               после фиксации ставит в фоновый пул удаление старого файла (`update_profile`).
+            4. Обновляет профиль в кэше и возвращает данные с `ETag` и `Last-Modified`. Если изменений нет,
+               `updated_at` не меняется и возвращается текущий профиль.
+
+        :param request: HTTP-запрос, содержащий данные для обновления пользователя.
+        :type request: django.http.HttpRequest
+        :rtype: django.http.HttpResponse
+        """
+        data = self.parse_json(request)
+        if not isinstance(data, dict):
+            return json_response({"detail": "Invalid JSON body."}, status=400)
+
+        user_id = request.user.id
+        serializer = UserSerializer(User(id=user_id), data=data, partial=True)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+
+        queryset = User.objects.filter(id=user_id)
+        version = None
+        if has_conditional_headers(request):
+            version = await queryset.values_list('updated_at', flat=True).afirst()
+            if version is None:
+                return json_response({"detail": "User not found."}, status=404)
+            precondition_failed = evaluate_preconditions(request, user_id, version)
+            if precondition_failed is not None:
+                return precondition_failed
+            queryset = queryset.filter(updated_at=version)
+
+        changes = {field: value for field, value in serializer.validated_data.items() if field != 'id'}
+        rows = []
+        if changes:
+            rows = await sync_to_async(self.update_profile)(queryset, changes)
+
+        if not rows:
+            row = await User.objects.filter(id=user_id).values(*USER_ROW_FIELDS).afirst()
+            if row is None:
+                return json_response({"detail": "User not found."}, status=404)
+            if version is not None and row['updated_at'] != version:
+                return json_response({"detail": "Profile was modified concurrently."}, status=412)
+            return set_validators(json_response(user_row_representation(row)), user_id, row['updated_at'])
+
+        data = user_row_representation(rows[0])
+        await aset_cached_profile(user_id, data)
+        response = set_validators(json_response(data), user_id, rows[0]['updated_at'])
+        await apin_to_primary([user_id], response)
+        return response
+
+    @staticmethod
+    def update_profile(queryset, changes):
+        """
+        Обновляет профиль для `patch` одним `UPDATE ... RETURNING`, если хотя бы одно поле изменилось.
+
+        При смене (очистке) аватара, как и `UserProfileView.patch`, блокирует строку, читает прежний аватар
+        и после фиксации транзакции ставит в фоновый пул удаление старого файла.
+
+        :param queryset: Обновляемая строка пользователя.
+        :type queryset: django.db.models.QuerySet
+        :param changes: Новые значения полей.
+        :type changes: dict
+        :return: Обновлённые строки (`USER_ROW_FIELDS`).
+        :rtype: list[dict]
+        """
+        with transaction.atomic() if 'avatar' in changes else nullcontext():
+            previous = None
+            if 'avatar' in changes:
+                previous = queryset.select_for_update().values_list('avatar', flat=True).first()
+            rows = update_returning(queryset.filter(changed(changes)), {**changes, 'updated_at': timezone.now()},
+                                    USER_ROW_FIELDS)
+            if rows and 'avatar' in changes:
+                schedule_avatar_processing(changes['avatar'], previous)
+        return rows
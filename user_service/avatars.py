@@ -0,0 +1,367 @@
+import functools
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import connections, router, transaction
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+AVATAR_DIR = 'avatars'
+VARIANTS_DIR = f'{AVATAR_DIR}/variants'
+
+# Имя аватара, сохранённого по содержимому: avatars/<sha256>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(rf'^{AVATAR_DIR}/(?P<digest>[0-9a-f]{{64}})\.\w+$')
+
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+# Производные `(digest, size, image_format)`, создание которых уже стоит в очереди пула
+_pending_variants = set()
+
+
+def variant_sizes():
+    return getattr(settings, 'AVATAR_VARIANT_SIZES', (64, 128, 256))
+
+
+def variant_formats():
+    return getattr(settings, 'AVATAR_VARIANT_FORMATS', ('webp', 'jpeg'))
+
+
+def content_addressed_name(uploaded):
+    """
+    Формирует имя аватара по SHA-256 его содержимого.
+
+    Одинаковые изображения получают одинаковое имя, поэтому хранятся и обрабатываются один раз.
+
+    :param uploaded: Загруженный и уже проверенный Pillow файл изображения.
+    :type uploaded: django.core.files.uploadedfile.UploadedFile
+    :return: Имя файла в хранилище вида `avatars/<sha256>.<ext>`.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+    uploaded.seek(0)
+
+    image_format = getattr(getattr(uploaded, 'image', None), 'format', None) or 'jpeg'
+    return avatar_name(digest.hexdigest(), image_format.lower())
+
+
+def avatar_name(digest, image_format):
+    """
+    Имя аватара в хранилище по SHA-256 его содержимого и формату изображения (в нижнем регистре).
+    """
+    return f'{AVATAR_DIR}/{digest}.{FORMAT_EXTENSIONS.get(image_format, image_format)}'
+
+
+def lock_avatar(name, shared=True):
+    """
+    Блокирует имя аватара до конца текущей транзакции (advisory lock PostgreSQL по `hashtext(name)`).
+
+    Запись ссылки на аватар берёт разделяемую блокировку, `delete_unused_avatar` — эксклюзивную:
+    файл не удаляется, пока транзакция, которая на него ссылается, не зафиксирована, а запись,
+    начатая после удаления, видит, что файла уже нет. На других СУБД блокировка не берётся.
+
+    :param name: Имя аватара в хранилище.
+    :type name: str
+    :param shared: Разделяемая (запись ссылки) или эксклюзивная (удаление) блокировка.
+    :type shared: bool
+    """
+    connection = connections[router.db_for_write(User)]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT pg_advisory_xact_lock{'_shared' if shared else ''}(hashtext(%s))", [name])
+
+
+def save_avatar(uploaded):
+    """
+    Сохраняет загруженный аватар в хранилище поля `User.avatar`, как это делает `save()` модели.
+
+    Вызывается в транзакции, которая записывает аватар в профиль: имя блокируется (`lock_avatar`)
+    до её фиксации. Если такой же файл уже есть в хранилище, повторная копия не сохраняется.
+
+    :param uploaded: Загруженный файл с именем, уже сформированным `content_addressed_name`.
+    :type uploaded: django.core.files.File
+    :return: Имя сохранённого файла в хранилище.
+    :rtype: str
+    """
+    field = User._meta.get_field('avatar')
+    name = field.generate_filename(None, uploaded.name)
+    lock_avatar(name)
+    if field.storage.exists(name):
+        return name
+    saved_name = field.storage.save(name, uploaded, max_length=field.max_length)
+    if saved_name != name:
+        # Этот же файл параллельно сохранил другой запрос — дубликат не нужен
+        field.storage.delete(saved_name)
+    return name
+
+
+def avatar_digest(name):
+    """
+    Возвращает SHA-256 дайджест аватара по его имени или `None` для аватаров, сохранённых не по содержимому.
+    """
+    match = CONTENT_ADDRESSED_NAME.match(name or '')
+    return match.group('digest') if match else None
+
+
+def variant_name(digest, size, image_format):
+    return f'{VARIANTS_DIR}/{digest}/{size}.{FORMAT_EXTENSIONS[image_format]}'
+
+
+def avatar_variant_urls(name, request=None):
+    """
+    Возвращает URL всех производных изображений аватара.
+
+    URL публикуются сразу после сохранения аватара. Запрос производной, которую фоновая обработка ещё
+    не создала, получает `404` и ставит её создание в очередь (см. `schedule_variant_generation`);
+    до этого клиент показывает оригинал `avatar`.
+
+    :param name: Имя оригинального аватара в хранилище.
+    :type name: str
+    :param request: HTTP-запрос для построения абсолютных URL (необязательно).
+    :type request: rest_framework.request.Request or None
+    :return: Словарь вида `{"64": {"webp": url, "jpeg": url}, ...}` или `None`, если производных нет.
+    :rtype: dict or None
+    """
+    digest = avatar_digest(name)
+    if digest is None:
+        return None
+
+    variants = {}
+    for size, urls in _variant_storage_urls(digest, tuple(variant_sizes()), tuple(variant_formats())):
+        variants[size] = {image_format: request.build_absolute_uri(url) if request else url
+                          for image_format, url in urls}
+    return variants
+
+
+@functools.lru_cache(maxsize=4096)
+def _variant_storage_urls(digest, sizes, formats):
+    """
+    URL производных в хранилище. Имена производных зависят только от содержимого аватара,
+    поэтому URL вычисляются один раз на аватар, а не на каждый ответ.
+    """
+    return tuple(
+        (str(size), tuple((image_format, default_storage.url(variant_name(digest, size, image_format)))
+                          for image_format in formats))
+        for size in sizes
+    )
+
+
+@receiver(setting_changed)
+def _reset_variant_urls(setting, **kwargs):
+    if setting in ('MEDIA_URL', 'STORAGES'):
+        _variant_storage_urls.cache_clear()
+
+
+def generate_avatar_variants(name, variants=None):
+    """
+    Создаёт производные изображения аватара всех размеров и форматов.
+
+    Уже существующие производные (например, от такого же аватара другого пользователя) не пересоздаются.
+
+    :param name: Имя оригинального аватара в хранилище.
+    :type name: str
+    :param variants: Пары `(size, image_format)`, которые нужно создать. По умолчанию — все производные.
+    :type variants: list or None
+    """
+    digest = avatar_digest(name)
+    if digest is None:
+        return
+
+    if variants is None:
+        variants = [(size, image_format) for size in variant_sizes() for image_format in variant_formats()]
+    pending = [(size, image_format) for size, image_format in variants
+               if not default_storage.exists(variant_name(digest, size, image_format))]
+    if not pending:
+        return
+
+    with default_storage.open(name, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+
+    for size, image_format in pending:
+        variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        if image_format == 'jpeg':
+            variant = variant.convert('RGB')
+        buffer = io.BytesIO()
+        variant.save(buffer, format=image_format.upper(), quality=85)
+        target = variant_name(digest, size, image_format)
+        saved_name = default_storage.save(target, ContentFile(buffer.getvalue()))
+        if saved_name != target:
+            # Эту же копию параллельно создал другой воркер — дубликат не нужен
+            default_storage.delete(saved_name)
+
+
+def ensure_avatar_variant(digest, size, image_format):
+    """
+    Создаёт производную аватара, запрошенную раньше, чем её создала фоновая обработка
+    (`schedule_avatar_processing`). Выполняется в фоновом пуле (`schedule_variant_generation`).
+
+    :param digest: SHA-256 оригинала аватара.
+    :type digest: str
+    :param size: Размер производной в пикселях.
+    :type size: int
+    :param image_format: Формат производной (`webp`, `jpeg`).
+    :type image_format: str
+    :return: Имя производной в хранилище или `None`, если такой производной не бывает
+             или оригинал не используется ни одним пользователем.
+    :rtype: str or None
+    """
+    if size not in variant_sizes() or image_format not in variant_formats():
+        return None
+    with transaction.atomic():
+        name = (User.objects.filter(avatar__startswith=f'{AVATAR_DIR}/{digest}.')
+                .values_list('avatar', flat=True).first())
+        if name is None or avatar_digest(name) != digest:
+            return None
+        # Оригинал не удалится, пока из него создаётся производная
+        lock_avatar(name)
+        generate_avatar_variants(name, [(size, image_format)])
+    return variant_name(digest, size, image_format)
+
+
+def delete_unused_avatar(name):
+    """
+    Удаляет оригинал аватара и его производные, если аватар больше не используется ни одним пользователем.
+
+    Проверка и удаление выполняются под эксклюзивной блокировкой имени (`lock_avatar`), поэтому
+    параллельная запись ссылки на такой же файл (дедупликация по содержимому) не останется без файла.
+
+    :param name: Имя оригинального аватара в хранилище.
+    :type name: str
+    """
+    if not name:
+        return
+
+    with transaction.atomic():
+        lock_avatar(name, shared=False)
+        if User.objects.filter(avatar=name).exists():
+            return
+
+        default_storage.delete(name)
+        digest = avatar_digest(name)
+        if digest is None:
+            return
+        for size in variant_sizes():
+            for image_format in variant_formats():
+                default_storage.delete(variant_name(digest, size, image_format))
+    try:
+        os.rmdir(default_storage.path(f'{VARIANTS_DIR}/{digest}'))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def process_avatar_change(new_name, old_name):
+    try:
+        if new_name:
+            generate_avatar_variants(new_name)
+        if old_name and old_name != new_name:
+            delete_unused_avatar(old_name)
+    except Exception:
+        logger.exception("Ошибка обработки аватара %s", new_name)
+
+
+def _process_in_pool(new_name, old_name):
+    try:
+        process_avatar_change(new_name, old_name)
+    finally:
+        connections.close_all()
+        _slots.release()
+
+
+def _get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'AVATAR_WORKERS', 2),
+                                           thread_name_prefix='avatar')
+            _slots = threading.BoundedSemaphore(getattr(settings, 'AVATAR_QUEUE_SIZE', 100))
+    return _executor
+
+
+def schedule_avatar_processing(new_name, old_name=None):
+    """
+    Ставит в фоновый пул генерацию производных нового аватара и удаление старого.
+
+    Задача отправляется только после фиксации транзакции. Если очередь пула переполнена
+    (`AVATAR_QUEUE_SIZE`), задача не отбрасывается, а выполняется в потоке запроса: так старый аватар
+    всё равно удаляется, а переполнение пула замедляет запросы вместо потери задач. Производные, которые
+    ещё не созданы, ставятся в очередь при первом обращении к ним (`schedule_variant_generation`).
+
+    :param new_name: Имя нового аватара в хранилище.
+    :type new_name: str or None
+    :param old_name: Имя предыдущего аватара в хранилище.
+    :type old_name: str or None
+    """
+    if new_name == old_name:
+        return
+
+    def submit():
+        executor = _get_executor()
+        if _slots.acquire(blocking=False):
+            executor.submit(_process_in_pool, new_name, old_name)
+            return
+        logger.warning("Очередь обработки аватаров переполнена, %s обрабатывается в потоке запроса", new_name)
+        process_avatar_change(new_name, old_name)
+
+    transaction.on_commit(submit)
+
+
+def _generate_variant_in_pool(variant):
+    try:
+        ensure_avatar_variant(*variant)
+    except Exception:
+        logger.exception("Ошибка создания производной %s аватара %s", variant[1:], variant[0])
+    finally:
+        with _executor_lock:
+            _pending_variants.discard(variant)
+        connections.close_all()
+        _slots.release()
+
+
+def schedule_variant_generation(digest, size, image_format):
+    """
+    Ставит в фоновый пул создание производной, которую запросили раньше, чем её создала обработка аватара.
+
+    Запрос производную не ждёт. Повторные обращения к производной, создание которой уже стоит в очереди,
+    новых задач не добавляют. Если очередь пула переполнена (`AVATAR_QUEUE_SIZE`), задача не ставится:
+    производная будет поставлена в очередь при следующем обращении к ней.
+
+    :param digest: SHA-256 оригинала аватара.
+    :type digest: str
+    :param size: Размер производной в пикселях.
+    :type size: int
+    :param image_format: Формат производной (`webp`, `jpeg`).
+    :type image_format: str
+    """
+    if size not in variant_sizes() or image_format not in variant_formats():
+        return
+
+    variant = (digest, size, image_format)
+    executor = _get_executor()
+    with _executor_lock:
+        if variant in _pending_variants:
+            return
+        if not _slots.acquire(blocking=False):
+            logger.warning("Очередь обработки аватаров переполнена, производная %s аватара %s не поставлена",
+                           variant[1:], digest)
+            return
+        _pending_variants.add(variant)
+    executor.submit(_generate_variant_in_pool, variant)
@@ -0,0 +1,123 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from sr_user_api.metrics import record_cache_lookup
+
+PROFILE_CACHE_PREFIX = 'user_profile'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'USER_PROFILE_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'USER_PROFILE_CACHE_TIMEOUT', 300)
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+    record_cache_lookup(PROFILE_CACHE_PREFIX, outcome == 'hits')
+
+
+def profile_cache_key(user_id):
+    """
+    Формирует ключ кэша для сериализованного профиля пользователя.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    :return: Ключ кэша.
+    :rtype: str
+    """
+    return f'{PROFILE_CACHE_PREFIX}:{user_id}'
+
+
+def get_cached_profile(user_id):
+    """
+    Возвращает сериализованный профиль пользователя из кэша.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    :return: Данные профиля в том виде, в котором их отдаёт `UserSerializer`, или `None`, если в кэше их нет.
+    :rtype: dict or None
+    """
+    data = _cache().get(profile_cache_key(user_id))
+    _record('misses' if data is None else 'hits')
+    return data
+
+
+def set_cached_profile(user_id, data):
+    """
+    Сохраняет сериализованный профиль пользователя в кэш на `USER_PROFILE_CACHE_TIMEOUT` секунд.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    :param data: Данные профиля, полученные из `UserSerializer`.
+    :type data: dict
+    """
+    _cache().set(profile_cache_key(user_id), dict(data), _timeout())
+
+
+def invalidate_profile(user_id):
+    """
+    Удаляет профиль пользователя из кэша.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    """
+    _cache().delete(profile_cache_key(user_id))
+
+
+async def aget_cached_profile(user_id):
+    """
+    Асинхронный вариант `get_cached_profile`.
+    """
+    data = await _cache().aget(profile_cache_key(user_id))
+    _record('misses' if data is None else 'hits')
+    return data
+
+
+async def aset_cached_profile(user_id, data):
+    """
+    Асинхронный вариант `set_cached_profile`.
+    """
+    await _cache().aset(profile_cache_key(user_id), dict(data), _timeout())
+
+
+async def ainvalidate_profile(user_id):
+    """
+    Асинхронный вариант `invalidate_profile`.
+    """
+    await _cache().adelete(profile_cache_key(user_id))
+
+
+def invalidate_profiles(user_ids):
+    """
+    Удаляет из кэша профили нескольких пользователей одним обращением к кэшу.
+
+    :param user_ids: Идентификаторы пользователей.
+    :type user_ids: list
+    """
+    _cache().delete_many([profile_cache_key(user_id) for user_id in user_ids])
+
+
+def profile_cache_stats():
+    """
+    Возвращает счётчики попаданий и промахов кэша профилей для текущего процесса.
+
+    :return: Словарь с ключами `hits`, `misses` и `hit_ratio`.
+    :rtype: dict
+    """
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
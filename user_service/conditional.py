@@ -0,0 +1,92 @@
+import hashlib
+from datetime import timezone
+
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+CONDITIONAL_HEADERS = (
+    'HTTP_IF_MATCH',
+    'HTTP_IF_NONE_MATCH',
+    'HTTP_IF_MODIFIED_SINCE',
+    'HTTP_IF_UNMODIFIED_SINCE',
+)
+
+
+def _as_datetime(updated_at):
+    if isinstance(updated_at, str):
+        return parse_datetime(updated_at)
+    return updated_at
+
+
+def profile_etag(user_id, updated_at):
+    """
+    Формирует строгий ETag профиля пользователя.
+
+    ETag зависит только от идентификатора пользователя и времени последнего обновления записи,
+    поэтому его можно вычислить без сериализации профиля.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    :param updated_at: Время последнего обновления (`datetime` или строка в формате ISO 8601).
+    :type updated_at: datetime.datetime or str
+    :return: Значение ETag в кавычках.
+    :rtype: str
+    """
+    updated_at = _as_datetime(updated_at).astimezone(timezone.utc)
+    digest = hashlib.md5(f'{user_id}:{updated_at.isoformat()}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def has_conditional_headers(request):
+    """
+    Проверяет, содержит ли запрос условные заголовки (`If-Match`, `If-None-Match` и т.д.).
+
+    :param request: HTTP-запрос.
+    :type request: rest_framework.request.Request
+    :rtype: bool
+    """
+    return any(header in request.META for header in CONDITIONAL_HEADERS)
+
+
+def evaluate_preconditions(request, user_id, updated_at):
+    """
+    Проверяет условные заголовки запроса относительно текущей версии профиля.
+
+    Для `GET` возвращает `304 Not Modified`, если версия клиента актуальна; для изменяющих запросов
+    возвращает `412 Precondition Failed`, если версия клиента устарела (`If-Match`).
+
+    :param request: HTTP-запрос.
+    :type request: rest_framework.request.Request
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    :param updated_at: Время последнего обновления профиля.
+    :type updated_at: datetime.datetime or str
+    :return: Готовый ответ `304`/`412` или `None`, если запрос нужно обработать полностью.
+    :rtype: django.http.HttpResponse or None
+    """
+    updated_at = _as_datetime(updated_at)
+    etag = profile_etag(user_id, updated_at)
+    response = get_conditional_response(request, etag=etag, last_modified=int(updated_at.timestamp()))
+    if response is not None:
+        set_validators(response, user_id, updated_at)
+    return response
+
+
+def set_validators(response, user_id, updated_at):
+    """
+    Добавляет в ответ заголовки `ETag` и `Last-Modified` для профиля пользователя.
+
+    :param response: Ответ, в который добавляются заголовки.
+    :type response: django.http.HttpResponse
+    :param user_id: Идентификатор пользователя.
+    :type user_id: str or uuid.UUID
+    :param updated_at: Время последнего обновления профиля.
+    :type updated_at: datetime.datetime or str
+    :return: Тот же объект ответа.
+    :rtype: django.http.HttpResponse
+    """
+    updated_at = _as_datetime(updated_at)
+    response['ETag'] = profile_etag(user_id, updated_at)
+    response['Last-Modified'] = http_date(updated_at.timestamp())
+    return response
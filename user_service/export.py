@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import User
+
+# Поля, доступные для выгрузки (в порядке по умолчанию)
+EXPORT_FIELDS = ['id', 'first_name', 'last_name', 'native_language', 'avatar', 'settings', 'created_at', 'updated_at']
+
+# Параметры фильтрации по диапазону дат и соответствующие им условия ORM
+RANGE_FILTERS = {
+    'created_after': 'created_at__gte',
+    'created_before': 'created_at__lt',
+    'updated_after': 'updated_at__gte',
+    'updated_before': 'updated_at__lt',
+}
+
+
+def export_queryset(fields, filters):
+    """
+    Формирует выборку пользователей для выгрузки.
+
+    :param fields: Выгружаемые поля из `EXPORT_FIELDS`.
+    :type fields: list
+    :param filters: Границы диапазонов дат по ключам из `RANGE_FILTERS`.
+    :type filters: dict
+    :return: Выборка словарей с выбранными полями, упорядоченная по `(created_at, id)`.
+    :rtype: django.db.models.QuerySet
+    """
+    lookups = {RANGE_FILTERS[name]: value for name, value in filters.items() if value is not None}
+    return User.objects.filter(**lookups).order_by('created_at', 'id').values(*fields)
+
+
+def iter_ndjson(fields, filters, chunk_size=None):
+    """
+    Построчно выгружает пользователей в формате NDJSON (одна JSON-запись на строку).
+
+    Записи читаются через `QuerySet.iterator(chunk_size=...)`, что в PostgreSQL использует
+    серверный курсор, поэтому в памяти одновременно находится не больше одной порции записей
+    независимо от размера таблицы. Значения форматируются так же, как в `UserSerializer`.
+
+    :param fields: Выгружаемые поля из `EXPORT_FIELDS`.
+    :type fields: list
+    :param filters: Границы диапазонов дат по ключам из `RANGE_FILTERS`.
+    :type filters: dict
+    :param chunk_size: Размер порции, читаемой из курсора (по умолчанию `USER_EXPORT_CHUNK_SIZE`).
+    :type chunk_size: int or None
+    :return: Генератор строк NDJSON в байтах.
+    :rtype: collections.abc.Iterator[bytes]
+    """
+    chunk_size = chunk_size or getattr(settings, 'USER_EXPORT_CHUNK_SIZE', 2000)
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for row in export_queryset(fields, filters).iterator(chunk_size=chunk_size):
+        if 'avatar' in row:
+            row['avatar'] = default_storage.url(row['avatar']) if row['avatar'] else None
+        yield encoder.encode(row).encode() + b'\n'
+
+
+def parse_fields(value):
+    """
+    Разбирает список полей, переданный через запятую, и проверяет его по `EXPORT_FIELDS`.
+
+    :param value: Строка вида `id,first_name` или пустое значение (все поля).
+    :type value: str or None
+    :return: Список полей.
+    :rtype: list
+    :raises ValueError: Если передано неизвестное поле.
+    """
+    if not value:
+        return list(EXPORT_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(EXPORT_FIELDS)}.")
+    return fields
+
@@ -0,0 +1,223 @@
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_CACHE_PREFIX = 'idempotency'
+# Заголовок ответа, повторённого по `Idempotency-Key`
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# Заголовки исходного ответа, которые сохраняются и повторяются вместе с телом (и все cookie ответа,
+# например отметка `pin_to_primary`)
+STORED_HEADERS = ('ETag', 'Last-Modified', 'Location')
+MAX_KEY_LENGTH = 255
+
+# Отметка в хранилище: запрос с этим ключом ещё выполняется
+IN_PROGRESS = 'in_progress'
+
+
+def _cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 600)
+
+
+def _lock_timeout():
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TTL', 30)
+
+
+def idempotency_cache_key(path, key, user=None):
+    """
+    Формирует ключ хранилища для `Idempotency-Key` запроса к `path`.
+
+    Сам ключ клиента хэшируется, чтобы в ключ кэша не попадали произвольные символы. Ключи разных
+    вызывающих (по `id` из JWT; все анонимные запросы — один вызывающий) не пересекаются: повтор чужого
+    ключа не получает сохранённый ответ другого пользователя.
+
+    :param path: Путь запроса.
+    :type path: str
+    :param key: Значение заголовка `Idempotency-Key`.
+    :type key: str
+    :param user: Пользователь запроса (`SimpleUser`, `AnonymousUser` или `None`).
+    :rtype: str
+    """
+    caller = user.id if user and user.is_authenticated else ''
+    digest = hashlib.sha256(json.dumps([caller, key]).encode()).hexdigest()
+    return f'{IDEMPOTENCY_CACHE_PREFIX}:{path}:{digest}'
+
+
+def request_fingerprint(data):
+    """
+    Возвращает отпечаток тела запроса, чтобы отличать повтор от другого запроса с тем же ключом.
+
+    :param data: Разобранное тело запроса (для multipart файлы учитываются по имени).
+    :type data: dict or list or django.http.QueryDict
+    :rtype: str
+    """
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def validate_key(key):
+    """
+    Проверяет значение заголовка `Idempotency-Key`.
+
+    :return: Текст ошибки или `None`, если ключ допустим.
+    :rtype: str or None
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters long."
+    return None
+
+
+def replay(record, fingerprint, response_class):
+    """
+    Формирует ответ на повтор запроса по записи из хранилища.
+
+    :param record: Запись о запросе с тем же ключом.
+    :type record: dict
+    :param fingerprint: Отпечаток тела текущего запроса.
+    :type fingerprint: str
+    :param response_class: Конструктор ответа, принимающий `(data, status)`.
+    :type response_class: callable
+    :return: Сохранённый ответ с его заголовками `STORED_HEADERS`, cookie и заголовком `Idempotent-Replayed`,
+        `409`, если исходный запрос ещё выполняется, или `422`, если ключ использован с другим телом запроса.
+    :rtype: django.http.HttpResponse
+    """
+    if record['fingerprint'] != fingerprint:
+        return response_class(
+            {"detail": f"{IDEMPOTENCY_HEADER} was already used with a different request body."}, 422)
+    if record['status'] == IN_PROGRESS:
+        return response_class({"detail": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."}, 409)
+
+    response = response_class(record['data'], record['status'])
+    for header, value in record.get('headers', {}).items():
+        response[header] = value
+    for cookie in record.get('cookies', ()):
+        response.cookies.load(cookie)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def claim(cache_key, fingerprint):
+    """
+    Атомарно занимает ключ на время выполнения запроса (`IDEMPOTENCY_LOCK_TTL` секунд).
+
+    :return: `None`, если ключ занят этим запросом, иначе запись о запросе, выполненном (или
+        выполняемом) ранее с тем же ключом.
+    :rtype: dict or None
+    """
+    cache = _cache()
+    record = {'fingerprint': fingerprint, 'status': IN_PROGRESS}
+    while not cache.add(cache_key, record, _lock_timeout()):
+        existing = cache.get(cache_key)
+        if existing is not None:
+            return existing
+    return None
+
+
+def response_record(fingerprint, data, response):
+    """
+    Формирует запись хранилища об ответе: статус, данные, заголовки `STORED_HEADERS` и cookie.
+
+    :param fingerprint: Отпечаток тела запроса.
+    :type fingerprint: str
+    :param data: Данные ответа до сериализации.
+    :type data: dict or list
+    :param response: Ответ представления.
+    :type response: django.http.HttpResponse
+    :rtype: dict
+    """
+    return {
+        'fingerprint': fingerprint,
+        'status': response.status_code,
+        'data': data,
+        'headers': {header: response[header] for header in STORED_HEADERS if response.has_header(header)},
+        'cookies': [morsel.OutputString() for morsel in response.cookies.values()],
+    }
+
+
+def complete(cache_key, fingerprint, data, response):
+    """
+    Сохраняет ответ на `IDEMPOTENCY_KEY_TTL` секунд для повторов с тем же ключом.
+
+    Ответы с ошибкой сервера не сохраняются: ключ освобождается, и повтор выполнится заново.
+    """
+    if response.status_code >= 500:
+        release(cache_key)
+        return
+    _cache().set(cache_key, response_record(fingerprint, data, response), _timeout())
+
+
+def release(cache_key):
+    _cache().delete(cache_key)
+
+
+async def aclaim(cache_key, fingerprint):
+    """
+    Асинхронный аналог `claim`.
+    """
+    cache = _cache()
+    record = {'fingerprint': fingerprint, 'status': IN_PROGRESS}
+    while not await cache.aadd(cache_key, record, _lock_timeout()):
+        existing = await cache.aget(cache_key)
+        if existing is not None:
+            return existing
+    return None
+
+
+async def arelease(cache_key):
+    await _cache().adelete(cache_key)
+
+
+async def acomplete(cache_key, fingerprint, data, response):
+    """
+    Асинхронный аналог `complete`.
+    """
+    if response.status_code >= 500:
+        await arelease(cache_key)
+        return
+    await _cache().aset(cache_key, response_record(fingerprint, data, response), _timeout())
+
+
+def idempotent(method):
+    """
+    Декоратор метода DRF-представления, поддерживающий заголовок `Idempotency-Key`.
+
+    Процесс:
+        1. Запрос без заголовка обрабатывается как обычно.
+        2. Первый запрос с ключом занимает его в хранилище и после обработки сохраняет ответ
+           на `IDEMPOTENCY_KEY_TTL` секунд (кроме ошибок `5xx` и исключений — тогда ключ освобождается).
+        3. Повтор с тем же ключом и телом получает сохранённый ответ (вместе с заголовками `STORED_HEADERS`
+           и cookie) с заголовком `Idempotent-Replayed` без обращения к представлению и БД. Повтор во время
+           выполнения исходного запроса получает `409`, повтор с другим телом — `422`.
+    """
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return method(self, request, *args, **kwargs)
+        error = validate_key(key)
+        if error is not None:
+            return Response({"detail": error}, status=400)
+
+        cache_key = idempotency_cache_key(request.path, key, request.user)
+        fingerprint = request_fingerprint(request.data)
+        record = claim(cache_key, fingerprint)
+        if record is not None:
+            return replay(record, fingerprint, Response)
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except BaseException:
+            release(cache_key)
+            raise
+        complete(cache_key, fingerprint, response.data, response)
+        return response
+    return wrapper
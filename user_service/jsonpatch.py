@@ -0,0 +1,153 @@
+import json
+
+from django.conf import settings
+from django.db.models import F, Func, JSONField, TextField, Value
+from django.db.models.functions import Cast
+from django.db.models.lookups import LessThanOrEqual
+from rest_framework import serializers
+from rest_framework.parsers import JSONParser
+
+MERGE_PATCH_MEDIA_TYPE = 'application/merge-patch+json'
+JSON_PATCH_MEDIA_TYPE = 'application/json-patch+json'
+
+JSON_PATCH_OPERATIONS = ('add', 'remove', 'replace')
+
+# SQLSTATE ошибки `jsonb_apply_patch`, если путь операции не существует (миграция 0007)
+JSON_PATCH_CONFLICT_SQLSTATE = 'JP409'
+
+
+class MergePatchParser(JSONParser):
+    """
+    Парсер тела запроса в формате JSON Merge Patch (RFC 7396).
+    """
+    media_type = MERGE_PATCH_MEDIA_TYPE
+
+
+class JSONPatchParser(JSONParser):
+    """
+    Парсер тела запроса в формате JSON Patch (RFC 6902).
+    """
+    media_type = JSON_PATCH_MEDIA_TYPE
+
+
+class JSONBMergePatch(Func):
+    """
+    Применяет JSON Merge Patch к полю `jsonb` на стороне PostgreSQL (функция `jsonb_merge_patch`).
+    """
+    function = 'jsonb_merge_patch'
+    output_field = JSONField()
+
+    def __init__(self, expression, patch):
+        super().__init__(expression, Value(patch, output_field=JSONField()))
+
+
+class JSONBApplyPatch(Func):
+    """
+    Применяет список операций JSON Patch к полю `jsonb` на стороне PostgreSQL (функция `jsonb_apply_patch`).
+    """
+    function = 'jsonb_apply_patch'
+    output_field = JSONField()
+
+    def __init__(self, expression, operations):
+        super().__init__(expression, Value(operations, output_field=JSONField()))
+
+
+def json_patch_conflict(error):
+    """
+    Возвращает сообщение `jsonb_apply_patch` о неприменимой операции JSON Patch
+    или `None`, если ошибка БД вызвана другой причиной.
+
+    :param error: Ошибка, возникшая при выполнении `UPDATE`.
+    :type error: django.db.DatabaseError
+    :rtype: str or None
+    """
+    cause = error.__cause__
+    if getattr(cause, 'pgcode', None) != JSON_PATCH_CONFLICT_SQLSTATE:
+        return None
+    return cause.diag.message_primary
+
+
+class OctetLength(Func):
+    function = 'octet_length'
+
+
+def settings_size_within_limit(expression):
+    """
+    Условие для `UPDATE ... WHERE`: размер нового документа `settings` не превышает `USER_SETTINGS_MAX_BYTES`.
+    """
+    return LessThanOrEqual(OctetLength(Cast(expression, TextField())), settings_max_bytes())
+
+
+def settings_max_bytes():
+    return getattr(settings, 'USER_SETTINGS_MAX_BYTES', 64 * 1024)
+
+
+def settings_size(value):
+    """
+    Возвращает размер документа `settings` в байтах так же, как его считает `settings_size_within_limit`:
+    длину текстового представления `jsonb` в UTF-8 (разделители `, ` и `: `, символы вне ASCII не экранируются).
+
+    :param value: Документ настроек.
+    :type value: dict
+    :rtype: int
+    """
+    return len(json.dumps(value, ensure_ascii=False, separators=(', ', ': ')).encode())
+
+
+def parse_pointer(pointer):
+    """
+    Разбирает JSON Pointer (RFC 6901) вида `/settings/a/b` в список ключей внутри `settings`.
+
+    :param pointer: JSON Pointer относительно профиля пользователя.
+    :type pointer: str
+    :return: Список ключей пути внутри документа `settings`.
+    :rtype: list
+    :raises serializers.ValidationError: Если путь не указывает внутрь `settings`.
+    """
+    if not isinstance(pointer, str) or not pointer.startswith('/settings/'):
+        raise serializers.ValidationError(f"Path must point inside /settings: {pointer!r}.")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer.split('/')[2:]]
+
+
+def build_settings_update(content_type, data):
+    """
+    Преобразует тело PATCH-запроса в выражение обновления `settings` и остальные поля профиля.
+
+    Для `application/merge-patch+json` член `settings` применяется как JSON Merge Patch, остальные
+    члены обновляют соответствующие поля профиля. Для `application/json-patch+json` тело — список
+    операций `add`/`remove`/`replace`, пути которых указывают внутрь `/settings`.
+
+    :param content_type: Тип содержимого запроса.
+    :type content_type: str
+    :param data: Разобранное тело запроса.
+    :type data: dict or list
+    :return: Кортеж `(expression, fields)`: выражение для нового значения `settings` (или `None`)
+             и словарь остальных полей профиля.
+    :rtype: tuple
+    :raises serializers.ValidationError: Если тело запроса не соответствует формату.
+    """
+    if content_type == MERGE_PATCH_MEDIA_TYPE:
+        if not isinstance(data, dict):
+            raise serializers.ValidationError("Merge patch must be a JSON object.")
+        fields = dict(data)
+        if 'settings' not in fields:
+            return None, fields
+        patch = fields.pop('settings')
+        if not isinstance(patch, dict):
+            raise serializers.ValidationError({'settings': ["Merge patch for settings must be a JSON object."]})
+        return JSONBMergePatch(F('settings'), patch), fields
+
+    if not isinstance(data, list):
+        raise serializers.ValidationError("JSON Patch must be a list of operations.")
+    operations = []
+    for operation in data:
+        if not isinstance(operation, dict) or operation.get('op') not in JSON_PATCH_OPERATIONS:
+            raise serializers.ValidationError(f"Supported operations: {', '.join(JSON_PATCH_OPERATIONS)}.")
+        if operation['op'] != 'remove' and 'value' not in operation:
+            raise serializers.ValidationError(f"Operation {operation['op']!r} requires a value.")
+        operations.append({
+            'op': operation['op'],
+            'path': parse_pointer(operation.get('path')),
+            'value': operation.get('value'),
+        })
+    return JSONBApplyPatch(F('settings'), operations), {}
@@ -0,0 +1,301 @@
+import io
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from sr_user_api.metrics import QueryStats
+from user_service.avatars import content_addressed_name, delete_unused_avatar, generate_avatar_variants
+from user_service.models import User
+
+SCENARIOS = ('create', 'profile_get', 'profile_patch')
+
+LANGUAGES = ['en', 'ru', 'de', 'fr', 'es', 'it', 'pt', 'ja', 'zh', 'ko']
+FIRST_NAMES = ['Anna', 'Ivan', 'Maria', 'Oleg', 'Elena', 'Pavel', 'Olga', 'Sergey', 'Irina', 'Dmitry']
+LAST_NAMES = ['Ivanova', 'Petrov', 'Smirnova', 'Kuznetsov', 'Popova', 'Sokolov', 'Lebedeva', 'Kozlov']
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный тест API пользователей против настроенной (локальной) базы данных.
+
+    Процесс:
+        1. Создаёт `--users` синтетических пользователей с настройками реалистичного размера и аватарами
+           (`--avatars` различных изображений с уменьшенными копиями).
+        2. Для каждого сценария (`create`, `profile_get`, `profile_patch`) выполняет `--requests` запросов
+           из `--concurrency` потоков; каждый поток — отдельный клиент с подписанным JWT случайного пользователя.
+           Запросы проходят через полный стек middleware.
+        3. Выводит пропускную способность, задержки p50/p95/p99 и среднее количество SQL-запросов на запрос,
+           записывает результаты в JSON (`--output`).
+        4. Если передан `--baseline`, сравнивает результаты с ним и завершается с ошибкой при регрессии:
+           падении пропускной способности или росте p95 больше чем на `--tolerance` процентов,
+           либо росте количества SQL-запросов на запрос.
+        5. Удаляет созданных пользователей и аватары (если не передан `--keep`).
+
+    Генератор случайных чисел инициализируется `--seed`, поэтому данные и последовательность запросов
+    воспроизводимы от запуска к запуску.
+
+    Пример:
+        python manage.py benchmark_api --users 5000 --requests 2000 --concurrency 8 --output bench.json
+        python manage.py benchmark_api --baseline bench.json --tolerance 15
+    """
+    help = 'Нагрузочный тест эндпоинтов create/, profile/ (GET и PATCH) с отчётом и проверкой регрессий.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Количество создаваемых пользователей.')
+        parser.add_argument('--avatars', type=int, default=20, help='Количество различных аватаров.')
+        parser.add_argument('--requests', type=int, default=1000, help='Количество запросов на каждый сценарий.')
+        parser.add_argument('--warmup', type=int, default=50, help='Прогревочные запросы (не учитываются).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Количество одновременных клиентов.')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f"Сценарии через запятую (из {', '.join(SCENARIOS)}).")
+        parser.add_argument('--seed', type=int, default=42, help='Начальное значение генератора случайных чисел.')
+        parser.add_argument('--no-cache', action='store_true', help='Отключить кэш профилей.')
+        parser.add_argument('--output', help='Файл для записи результатов в формате JSON.')
+        parser.add_argument('--baseline', help='Файл с результатами предыдущего запуска для сравнения.')
+        parser.add_argument('--tolerance', type=float, default=20.0,
+                            help='Допустимое ухудшение пропускной способности и p95, в процентах.')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные.')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+
+        rng = random.Random(options['seed'])
+        avatars = self.seed_avatars(rng, options['avatars'])
+        user_ids = self.seed_users(rng, options['users'], avatars)
+        created_ids = []
+        cache_timeout = 0 if options['no_cache'] else settings.USER_PROFILE_CACHE_TIMEOUT
+
+        results = {}
+        try:
+            with override_settings(USER_PROFILE_CACHE_TIMEOUT=cache_timeout):
+                for name in scenarios:
+                    make_request = getattr(self, f'request_{name}')
+                    context = {'user_ids': user_ids, 'tokens': {}, 'created_ids': created_ids}
+                    self.run_scenario(make_request, context, options['warmup'], options['concurrency'],
+                                      f"{options['seed']}:{name}:warmup")
+                    results[name] = self.run_scenario(make_request, context, options['requests'],
+                                                      options['concurrency'], f"{options['seed']}:{name}")
+                    self.report(name, results[name])
+        finally:
+            if not options['keep']:
+                self.cleanup(user_ids + created_ids, avatars)
+
+        document = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'users': options['users'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'seed': options['seed'],
+                'profile_cache': not options['no_cache'],
+            },
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(document, file, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+
+        failures = [f"{name}: {result['errors']} запросов завершились ошибкой"
+                    for name, result in results.items() if result['errors']]
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            failures += self.compare(results, baseline.get('scenarios', {}), options['tolerance'])
+        if failures:
+            raise CommandError('Обнаружены регрессии:\n' + '\n'.join(failures))
+
+    def seed_avatars(self, rng, count):
+        """
+        Сохраняет `count` различных JPEG-изображений как аватары и генерирует их уменьшенные копии.
+        """
+        names = []
+        for _ in range(count):
+            image = Image.new('RGB', (512, 512), tuple(rng.randrange(256) for _ in range(3)))
+            for _ in range(20):
+                x, y = rng.randrange(512), rng.randrange(512)
+                image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + rng.randrange(16, 128),
+                                                                        y + rng.randrange(16, 128)))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            content = ContentFile(buffer.getvalue())
+            name = content_addressed_name(content)
+            if not default_storage.exists(name):
+                default_storage.save(name, content)
+            generate_avatar_variants(name)
+            names.append(name)
+        return names
+
+    def seed_users(self, rng, count, avatars):
+        users = [
+            User(
+                id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                native_language=rng.choice(LANGUAGES),
+                avatar=rng.choice(avatars) if avatars and rng.random() < 0.8 else None,
+                settings=self.make_settings(rng),
+            )
+            for _ in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=1000, ignore_conflicts=True)
+        return [user.id for user in users]
+
+    @staticmethod
+    def make_settings(rng):
+        """
+        Формирует документ настроек размером около 1-2 КБ.
+        """
+        return {
+            'theme': rng.choice(['light', 'dark', 'system']),
+            'interface_language': rng.choice(LANGUAGES),
+            'target_languages': rng.sample(LANGUAGES, 3),
+            'notifications': {channel: rng.random() < 0.5 for channel in ('email', 'push', 'sms', 'digest')},
+            'recent_searches': [f'query {rng.randrange(10 ** 6)}' for _ in range(rng.randrange(5, 20))],
+            'shortcuts': {f'action_{i}': f'ctrl+{chr(97 + i)}' for i in range(rng.randrange(5, 20))},
+            'daily_goal': rng.randrange(5, 60),
+        }
+
+    @staticmethod
+    def token(context, user_id):
+        tokens = context['tokens']
+        if user_id not in tokens:
+            tokens[user_id] = jwt.encode({'user_id': str(user_id), 'exp': int(time.time()) + 3600},
+                                         settings.JWT_SECRET_KEY, algorithm='HS256')
+        return tokens[user_id]
+
+    def request_create(self, rng, context):
+        user_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        context['created_ids'].append(user_id)
+        body = {
+            'id': str(user_id),
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'native_language': rng.choice(LANGUAGES),
+            'settings': self.make_settings(rng),
+        }
+        return 'post', '/user/create/', {'data': json.dumps(body), 'content_type': 'application/json'}, 201
+
+    def request_profile_get(self, rng, context):
+        token = self.token(context, rng.choice(context['user_ids']))
+        return 'get', '/user/profile/', {'HTTP_AUTHORIZATION': f'Bearer {token}'}, 200
+
+    def request_profile_patch(self, rng, context):
+        token = self.token(context, rng.choice(context['user_ids']))
+        body = {'first_name': rng.choice(FIRST_NAMES), 'settings': self.make_settings(rng)}
+        return 'patch', '/user/profile/', {
+            'data': json.dumps(body),
+            'content_type': 'application/json',
+            'HTTP_AUTHORIZATION': f'Bearer {token}',
+        }, 200
+
+    def run_scenario(self, make_request, context, total, concurrency, seed):
+        """
+        Выполняет `total` запросов сценария из `concurrency` потоков.
+
+        Каждый поток использует свой генератор случайных чисел, инициализированный `seed` и номером потока.
+
+        :return: Пропускная способность, задержки (мс), среднее количество SQL-запросов и число ошибок.
+        :rtype: dict
+        """
+        latencies, queries, errors = [], [], [0]
+        lock = threading.Lock()
+
+        def worker(index, count):
+            rng = random.Random(f'{seed}:{index}')
+            client = Client()
+            stats = QueryStats()
+            local_latencies, local_queries, local_errors = [], [], 0
+            with connection.execute_wrapper(stats):
+                for _ in range(count):
+                    with lock:
+                        method, path, kwargs, expected = make_request(rng, context)
+                    before = stats.count
+                    started = time.perf_counter()
+                    response = getattr(client, method)(path, **kwargs)
+                    local_latencies.append(time.perf_counter() - started)
+                    local_queries.append(stats.count - before)
+                    local_errors += response.status_code != expected
+            connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                queries.extend(local_queries)
+                errors[0] += local_errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, range(concurrency), self.split(total, concurrency)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors[0],
+            'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': self.percentile(latencies, 50) * 1000,
+            'p95_ms': self.percentile(latencies, 95) * 1000,
+            'p99_ms': self.percentile(latencies, 99) * 1000,
+            'queries_per_request': statistics.fmean(queries) if queries else 0.0,
+        }
+
+    @staticmethod
+    def percentile(values, percent):
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, max(0, round(len(values) * percent / 100) - 1))]
+
+    @staticmethod
+    def split(total, parts):
+        return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:>13}: {result['throughput']:8.1f} req/s  p50={result['p50_ms']:.2f}ms  "
+            f"p95={result['p95_ms']:.2f}ms  p99={result['p99_ms']:.2f}ms  "
+            f"queries/req={result['queries_per_request']:.2f}  errors={result['errors']}"
+        )
+
+    @staticmethod
+    def compare(results, baseline, tolerance):
+        """
+        Сравнивает результаты с базовыми и возвращает список найденных регрессий.
+        """
+        failures = []
+        factor = tolerance / 100
+        for name, result in results.items():
+            base = baseline.get(name)
+            if not base:
+                continue
+            if result['throughput'] < base['throughput'] * (1 - factor):
+                failures.append(f"{name}: throughput {result['throughput']:.1f} < {base['throughput']:.1f} req/s")
+            if result['p95_ms'] > base['p95_ms'] * (1 + factor):
+                failures.append(f"{name}: p95 {result['p95_ms']:.2f} > {base['p95_ms']:.2f} ms")
+            if result['queries_per_request'] > base['queries_per_request'] + 0.01:
+                failures.append(f"{name}: queries/request {result['queries_per_request']:.2f} > "
+                                f"{base['queries_per_request']:.2f}")
+        return failures
+
+    @staticmethod
+    def cleanup(user_ids, avatars):
+        for start in range(0, len(user_ids), 1000):
+            User.objects.filter(id__in=user_ids[start:start + 1000]).delete()
+        for name in avatars:
+            delete_unused_avatar(name)
@@ -0,0 +1,116 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+
+from user_service.models import User
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает пропускную способность синхронного (`/user/profile/`) и асинхронного
+    (`/user/async/profile/`) эндпоинтов профиля при одинаковом количестве воркеров.
+
+    Синхронный режим моделирует sync-воркеры gunicorn: каждый воркер обрабатывает запросы строго по одному.
+    Асинхронный режим моделирует ASGI-воркеры: каждый воркер держит свой цикл событий
+    и обрабатывает `concurrency / workers` запросов одновременно. Запросы проходят через полный стек
+    middleware и выполняются против настроенной базы данных.
+
+    Пример:
+        python manage.py benchmark_async --requests 2000 --concurrency 60 --workers 3
+    """
+    help = 'Сравнивает пропускную способность синхронных и асинхронных эндпоинтов профиля.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Количество запросов на каждый режим.')
+        parser.add_argument('--concurrency', type=int, default=60, help='Количество одновременных клиентов.')
+        parser.add_argument('--workers', type=int, default=3, help='Количество воркеров в каждом режиме.')
+        parser.add_argument('--use-cache', action='store_true',
+                            help='Не отключать кэш профилей (по умолчанию каждый запрос идёт в БД).')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(id=uuid.uuid4(), first_name='Benchmark', settings={'theme': 'dark'})
+        token = jwt.encode({'user_id': str(user.id), 'exp': int(time.time()) + 3600},
+                           settings.JWT_SECRET_KEY, algorithm='HS256')
+        cache_timeout = settings.USER_PROFILE_CACHE_TIMEOUT if options['use_cache'] else 0
+
+        try:
+            with override_settings(USER_PROFILE_CACHE_TIMEOUT=cache_timeout):
+                sync_result = self.run_sync(token, options['requests'], options['workers'])
+                async_result = self.run_async(token, options['requests'], options['workers'],
+                                              options['concurrency'])
+        finally:
+            user.delete()
+
+        for name, result in (('sync', sync_result), ('async', async_result)):
+            self.stdout.write(
+                f"{name:>5}: {result['rps']:8.1f} req/s  "
+                f"p50={result['p50']:.2f}ms  p95={result['p95']:.2f}ms  errors={result['errors']}"
+            )
+
+    @staticmethod
+    def summarize(latencies, errors, elapsed):
+        latencies.sort()
+        return {
+            'rps': len(latencies) / elapsed if elapsed else 0.0,
+            'p50': statistics.median(latencies) * 1000 if latencies else 0.0,
+            'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+            'errors': errors,
+        }
+
+    def run_sync(self, token, total, workers):
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def worker(count):
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get('/user/profile/')
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    errors[0] += response.status_code != 200
+            connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(worker, self.split(total, workers)))
+        return self.summarize(latencies, errors[0], time.perf_counter() - started)
+
+    def run_async(self, token, total, workers, concurrency):
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        async def client_loop(count):
+            client = AsyncClient()
+            headers = {'Authorization': f'Bearer {token}'}
+            for _ in range(count):
+                started = time.perf_counter()
+                response = await client.get('/user/async/profile/', headers=headers)
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    errors[0] += response.status_code != 200
+
+        async def event_loop(count):
+            await asyncio.gather(*(client_loop(part) for part in self.split(count, max(concurrency // workers, 1))))
+
+        def worker(count):
+            asyncio.run(event_loop(count))
+            connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(worker, self.split(total, workers)))
+        return self.summarize(latencies, errors[0], time.perf_counter() - started)
+
+    @staticmethod
+    def split(total, parts):
+        return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
@@ -0,0 +1,121 @@
+import logging
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from sr_user_api.authentication import JWTAuthentication, logger as auth_logger
+from sr_user_api.log import QueueStreamHandler, SamplingFilter
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает задержку `JWTAuthentication.authenticate` при разных режимах логирования.
+
+    Режимы:
+        - `sync` — синхронный `StreamHandler`, все строки аутентификации (как было раньше);
+        - `queue` — `QueueStreamHandler`, все строки аутентификации;
+        - `queue+sampled` — `QueueStreamHandler` и `SamplingFilter` с долей `--sample-rate`.
+
+    Логи пишутся в файл во временном каталоге, запросы выполняются из `--threads` потоков,
+    как в sync-воркере gunicorn с потоками. Обращений к БД нет. `--write-latency` добавляет задержку
+    к каждой записи в поток, моделируя медленный приёмник stdout (pipe в драйвер логов контейнера).
+
+    Пример:
+        python manage.py benchmark_logging --requests 20000 --threads 4 --write-latency 50
+    """
+    help = 'Сравнивает задержку аутентификации при синхронном, очередном и сэмплированном логировании.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Количество запросов на каждый режим.')
+        parser.add_argument('--threads', type=int, default=4, help='Количество потоков.')
+        parser.add_argument('--sample-rate', type=float, default=settings.AUTH_LOG_SAMPLE_RATE,
+                            help='Доля записываемых строк в режиме queue+sampled.')
+        parser.add_argument('--write-latency', type=int, default=0,
+                            help='Задержка каждой записи в поток, мкс (моделирует медленный приёмник логов).')
+
+    def handle(self, *args, **options):
+        token = jwt.encode({'user_id': str(uuid.uuid4()), 'exp': int(time.time()) + 3600},
+                           settings.JWT_SECRET_KEY, algorithm='HS256')
+        request = RequestFactory().get('/user/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        modes = (
+            ('sync', False, None),
+            ('queue', True, None),
+            ('queue+sampled', True, options['sample_rate']),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for name, queued, rate in modes:
+                with open(f'{directory}/{name}.log', 'w') as file:
+                    stream = SlowStream(file, options['write_latency'] / 1e6) if options['write_latency'] else file
+                    handler = QueueStreamHandler(stream) if queued else logging.StreamHandler(stream)
+                    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s'))
+                    result = self.run(request, handler, rate, options['requests'], options['threads'])
+                    handler.close()
+                self.stdout.write(
+                    f"{name:>13}: mean={result['mean']:.1f}us  p50={result['p50']:.1f}us  "
+                    f"p99={result['p99']:.1f}us  {result['rps']:10.1f} req/s"
+                )
+
+    def run(self, request, handler, rate, total, threads):
+        """
+        Выполняет `total` аутентификаций, направив логгер аутентификации только в `handler`.
+        """
+        saved = auth_logger.handlers, auth_logger.filters, auth_logger.propagate, auth_logger.level
+        auth_logger.handlers, auth_logger.filters, auth_logger.propagate = [handler], [], False
+        auth_logger.setLevel(logging.DEBUG)
+        if rate is not None:
+            auth_logger.addFilter(SamplingFilter(rate))
+
+        authentication = JWTAuthentication()
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(count):
+            local = []
+            for _ in range(count):
+                started = time.perf_counter()
+                authentication.authenticate(request)
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(worker, [total // threads] * threads))
+            elapsed = time.perf_counter() - started
+        finally:
+            auth_logger.handlers, auth_logger.filters, auth_logger.propagate = saved[:3]
+            auth_logger.setLevel(saved[3])
+
+        latencies.sort()
+        return {
+            'mean': statistics.fmean(latencies) * 1e6,
+            'p50': statistics.median(latencies) * 1e6,
+            'p99': latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+            'rps': len(latencies) / elapsed,
+        }
+
+
+class SlowStream:
+    """
+    Обёртка над потоком вывода, добавляющая задержку к каждой записи.
+    """
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, data):
+        time.sleep(self.latency)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
@@ -0,0 +1,93 @@
+import statistics
+import time
+import uuid
+
+import jwt
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from user_service.models import User
+
+DISPATCHER = 'sr_user_api.middleware.PathMiddlewareDispatcher'
+
+
+class Command(BaseCommand):
+    """
+    Микробенчмарк накладных расходов middleware на запрос к API: плоский список `MIDDLEWARE`
+    с полной цепочкой для всех путей (как до `PathMiddlewareDispatcher`) против короткой цепочки
+    `STATELESS_MIDDLEWARE`.
+
+    Процесс:
+        1. Создаёт временного пользователя и подписывает для него JWT.
+        2. Собирает два WSGI-обработчика: с плоским списком `MIDDLEWARE` + `FULL_MIDDLEWARE`
+           и с текущими настройками.
+        3. Выполняет `--requests` запросов `GET /user/profile/` (после прогрева профиль берётся из кэша)
+           поочерёдно через оба обработчика сериями по `--batch` запросов. Запросы передают cookie,
+           как браузерный клиент (`csrftoken`, `sessionid`).
+        4. Выводит медиану и p95 времени запроса для каждого варианта и разницу медиан.
+        5. Удаляет пользователя.
+
+    Silk-выборка на время замера отключается, чтобы запросы не записывались в БД.
+
+    Пример:
+        python manage.py benchmark_middleware --requests 20000
+    """
+    help = 'Сравнивает время запроса к API через полный и короткий набор middleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help='Количество запросов на каждый вариант.')
+        parser.add_argument('--batch', type=int, default=500, help='Размер серии запросов одного варианта.')
+        parser.add_argument('--path', default='/user/profile/', help='Путь запроса.')
+
+    def handle(self, *args, **options):
+        if DISPATCHER not in settings.MIDDLEWARE:
+            raise CommandError(f'{DISPATCHER} is not in MIDDLEWARE.')
+        flat_middleware = [path for path in settings.MIDDLEWARE if path != DISPATCHER] + settings.FULL_MIDDLEWARE
+
+        user = User.objects.create(id=uuid.uuid4(), first_name='Benchmark')
+        token = jwt.encode({'user_id': str(user.id), 'exp': int(time.time()) + 3600}, settings.JWT_SECRET_KEY,
+                           algorithm='HS256')
+        environ = RequestFactory().get(
+            options['path'],
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+            HTTP_COOKIE=f'{settings.CSRF_COOKIE_NAME}={"c" * 32}; {settings.SESSION_COOKIE_NAME}={"s" * 32}',
+        ).environ
+
+        try:
+            with override_settings(PROFILING_SAMPLE_RATE=0, LOAD_SHEDDING_ENABLED=False):
+                with override_settings(MIDDLEWARE=flat_middleware):
+                    full = WSGIHandler()
+                handlers = {'MIDDLEWARE (full chain)': full, 'PathMiddlewareDispatcher': WSGIHandler()}
+                for handler in handlers.values():
+                    self.request(handler, environ)
+                timings = {name: [] for name in handlers}
+                for _ in range(max(1, options['requests'] // options['batch'])):
+                    for name, handler in handlers.items():
+                        timings[name].extend(self.measure(handler, environ, options['batch']))
+        finally:
+            User.objects.filter(id=user.id).delete()
+
+        for name, samples in timings.items():
+            samples.sort()
+            self.stdout.write(f"{name:>28}: median {statistics.median(samples) * 1e6:8.1f}us, "
+                              f"p95 {samples[int(len(samples) * 0.95)] * 1e6:8.1f}us per request")
+        baseline, optimized = (statistics.median(samples) for samples in timings.values())
+        self.stdout.write(f"Экономия на запрос: {(baseline - optimized) * 1e6:.1f}us "
+                          f"({(baseline - optimized) / baseline * 100:.1f}%)")
+
+    @staticmethod
+    def request(handler, environ):
+        response = handler(dict(environ), lambda status, headers: None)
+        if response.status_code != 200:
+            raise CommandError(f'Unexpected status {response.status_code} for {environ["PATH_INFO"]}.')
+        response.close()
+
+    def measure(self, handler, environ, count):
+        samples = []
+        for _ in range(count):
+            started = time.perf_counter()
+            self.request(handler, environ)
+            samples.append(time.perf_counter() - started)
+        return samples
@@ -0,0 +1,72 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from sr_user_api.renderers import ORJSONRenderer
+from user_service.models import User
+from user_service.serializers import USER_ROW_FIELDS, UserSerializer, user_row_representation
+
+
+class Command(BaseCommand):
+    """
+    Микробенчмарк пути чтения профиля: `UserSerializer` + `JSONRenderer` против
+    `user_row_representation` + `ORJSONRenderer`.
+
+    Обращений к БД нет: обе реализации получают одного и того же пользователя (объект модели и строку
+    `values()`). Перед замером проверяется, что оба пути выдают одинаковые байты.
+
+    Пример:
+        python manage.py benchmark_serializers --iterations 20000
+    """
+    help = 'Сравнивает скорость UserSerializer/JSONRenderer и быстрого пути чтения профиля.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='Количество итераций на каждый путь.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        user = User(
+            id=uuid.uuid4(),
+            first_name='Анна',
+            last_name='Иванова',
+            native_language='ru',
+            avatar=f'avatars/{"a" * 64}.jpg',
+            settings={
+                'theme': 'dark',
+                'target_languages': ['en', 'de', 'fr'],
+                'notifications': {'email': True, 'push': False},
+                'recent_searches': [f'запрос {i}' for i in range(15)],
+                'daily_goal': 20,
+                'volume': 0.75,
+            },
+            created_at=now,
+            updated_at=now,
+        )
+        row = {field: getattr(user, field) for field in USER_ROW_FIELDS}
+        row['avatar'] = user.avatar.name
+
+        def current():
+            return JSONRenderer().render(UserSerializer(user).data)
+
+        def fast():
+            return ORJSONRenderer().render(user_row_representation(row))
+
+        if current() != fast():
+            raise CommandError('Fast path output differs from UserSerializer output.')
+
+        results = {name: self.measure(func, options['iterations']) for name, func in
+                   (('UserSerializer + JSONRenderer', current), ('row + ORJSONRenderer', fast))}
+        for name, seconds in results.items():
+            self.stdout.write(f"{name:>30}: {seconds / options['iterations'] * 1e6:8.2f}us per response")
+        baseline, optimized = results.values()
+        self.stdout.write(f"Ускорение: x{baseline / optimized:.1f}")
+
+    @staticmethod
+    def measure(func, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return time.perf_counter() - started
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user_service.export import RANGE_FILTERS, iter_ndjson, parse_fields
+from user_service.serializers import UserExportParamsSerializer
+
+
+class Command(BaseCommand):
+    """
+    Выгружает пользователей в формате NDJSON в файл или в stdout.
+
+    Использует тот же потоковый генератор, что и эндпоинт `/user/export/`, поэтому потребление
+    памяти не зависит от размера таблицы.
+
+    Пример:
+        python manage.py export_users --fields id,first_name,native_language --updated-after 2024-10-01 -o users.ndjson
+    """
+    help = 'Выгружает пользователей в формате NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fields', help='Выгружаемые поля через запятую (по умолчанию все).')
+        for name in RANGE_FILTERS:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help='Дата и время в формате ISO 8601.')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Размер порции, читаемой из курсора.')
+        parser.add_argument('-o', '--output', help='Файл для записи (по умолчанию stdout).')
+
+    def handle(self, *args, **options):
+        data = {name: options[name] for name in ('fields', *RANGE_FILTERS) if options[name] is not None}
+        params = UserExportParamsSerializer(data=data)
+        if not params.is_valid():
+            raise CommandError(params.errors)
+
+        fields = params.validated_data.get('fields') or parse_fields(None)
+        filters = {name: params.validated_data.get(name) for name in RANGE_FILTERS}
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        count = 0
+        try:
+            for line in iter_ndjson(fields, filters, options['chunk_size']):
+                output.write(line)
+                count += 1
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+
+        self.stderr.write(f'Выгружено пользователей: {count}')
@@ -0,0 +1,191 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .avatars import AVATAR_DIR, FORMAT_EXTENSIONS, avatar_digest, schedule_variant_generation
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+# Производные изображения: avatars/variants/<sha256>/<size>.<ext>
+VARIANT_NAME = re.compile(rf'^{AVATAR_DIR}/variants/(?P<digest>[0-9a-f]{{64}})/(?P<size>\d+)\.(?P<ext>\w+)$')
+
+VARIANT_FORMATS = {extension: image_format for image_format, extension in FORMAT_EXTENSIONS.items()}
+
+
+def is_immutable(name):
+    """
+    Проверяет, адресуется ли файл по содержимому: такой файл по данному URL никогда не меняется.
+    """
+    return avatar_digest(name) is not None or VARIANT_NAME.match(name) is not None
+
+
+def file_etag(name, stat):
+    """
+    Формирует строгий ETag файла аватара.
+
+    Для файлов, адресуемых по содержимому, ETag строится из имени (в нём уже есть SHA-256),
+    для остальных — из размера и времени изменения файла.
+    """
+    if is_immutable(name):
+        return '"%s"' % name[len(AVATAR_DIR) + 1:].replace('/', '-')
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Разбирает заголовок `Range` с одним диапазоном байтов.
+
+    :param header: Значение заголовка `Range`.
+    :type header: str
+    :param size: Размер файла в байтах.
+    :type size: int
+    :return: Кортеж `(start, end)` включительно, `None`, если диапазон нужно игнорировать
+             (неподдерживаемый формат), или `False`, если диапазон невыполним.
+    :rtype: tuple or None or bool
+    """
+    match = RANGE_HEADER.match(header.strip())
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        suffix = int(end)
+        if suffix == 0:
+            return False
+        return max(size - suffix, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def stat_avatar(relative_name):
+    """
+    Возвращает путь и `os.stat` файла аватара. Если фоновая обработка ещё не успела создать запрошенную
+    производную, её создание ставится в очередь (`schedule_variant_generation`), а запрос получает `404`:
+    поток запроса изображение не обрабатывает.
+
+    :param relative_name: Путь к файлу относительно `MEDIA_ROOT`, начинающийся с `avatars/`.
+    :type relative_name: str
+    :raises Http404: Если файла нет или путь выходит за пределы каталога аватаров.
+    """
+    prefix = f'{AVATAR_DIR}/'
+    if not relative_name.startswith(prefix):
+        raise Http404("Avatar not found.")
+    try:
+        # Путь ограничивается каталогом аватаров, а не всем `MEDIA_ROOT`: `avatars/../...` не выходит за его пределы
+        path = safe_join(os.path.join(settings.MEDIA_ROOT, AVATAR_DIR), relative_name[len(prefix):])
+        try:
+            return path, os.stat(path)
+        except FileNotFoundError:
+            match = VARIANT_NAME.match(relative_name)
+            if match and match['ext'] in VARIANT_FORMATS:
+                schedule_variant_generation(match['digest'], int(match['size']), VARIANT_FORMATS[match['ext']])
+            raise
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("Avatar not found.")
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_avatar(request, name):
+    """
+    Отдаёт файл аватара или его уменьшенной копии из `MEDIA_ROOT/avatars/`.
+
+    Процесс:
+        1. Если запрошенной производной ещё нет, ставит её создание в очередь и возвращает `404` (`stat_avatar`).
+        2. Проверяет условные заголовки по строгому `ETag` и `Last-Modified` и при совпадении
+           возвращает `304 NOT MODIFIED`.
+        3. Для файлов, адресуемых по содержимому (`avatars/<sha256>.<ext>` и их производных),
+           выставляет `Cache-Control: public, max-age=31536000, immutable`, для остальных —
+           `max-age=AVATAR_CACHE_MAX_AGE`.
+        4. Если задан `AVATAR_SENDFILE_MODE` (`x-accel-redirect` или `x-sendfile`), не передаёт содержимое
+           файла, а поручает отдачу фронт-прокси через соответствующий заголовок (прокси сам обрабатывает `Range`).
+        5. Иначе обрабатывает `Range` с одним диапазоном (`206 PARTIAL CONTENT`/`416`) с учётом `If-Range`
+           или отдаёт файл целиком через `FileResponse`.
+
+    :param request: HTTP-запрос (`GET` или `HEAD`).
+    :type request: django.http.HttpRequest
+    :param name: Путь к файлу относительно `avatars/`.
+    :type name: str
+    :return: Ответ с содержимым файла, `304`, `206`, `416` или заголовком для фронт-прокси.
+    :rtype: django.http.HttpResponse
+    :raises Http404: Если файл не найден или путь выходит за пределы каталога аватаров.
+    """
+    relative_name = f'{AVATAR_DIR}/{name}'
+    path, stat = stat_avatar(relative_name)
+    if not os.path.isfile(path):
+        raise Http404("Avatar not found.")
+
+    etag = file_etag(relative_name, stat)
+    immutable = is_immutable(relative_name)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Accept-Ranges'] = 'bytes'
+        if immutable:
+            response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response['Cache-Control'] = f"public, max-age={getattr(settings, 'AVATAR_CACHE_MAX_AGE', 3600)}"
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return with_headers(not_modified)
+
+    sendfile_mode = getattr(settings, 'AVATAR_SENDFILE_MODE', None)
+    if sendfile_mode:
+        response = HttpResponse(content_type=content_type)
+        if sendfile_mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = getattr(settings, 'AVATAR_SENDFILE_PREFIX', '/protected-media/') + relative_name
+        else:
+            response['X-Sendfile'] = path
+        return with_headers(response)
+
+    requested_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range == etag):
+        requested_range = parse_range(range_header, stat.st_size)
+
+    if requested_range is False:
+        response = HttpResponse(status=416, content_type=content_type)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return with_headers(response)
+
+    if requested_range:
+        start, end = requested_range
+        length = end - start + 1
+        body = read_range(path, start, length) if request.method == 'GET' else []
+        response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = str(length)
+        return with_headers(response)
+
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    return with_headers(response)
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# RFC 7396 (JSON Merge Patch): рекурсивное слияние объектов, `null` удаляет ключ
+MERGE_PATCH_SQL = """
+CREATE OR REPLACE FUNCTION jsonb_merge_patch(target jsonb, patch jsonb) RETURNS jsonb AS $$
+BEGIN
+    IF jsonb_typeof(patch) IS DISTINCT FROM 'object' THEN
+        RETURN patch;
+    END IF;
+    IF target IS NULL OR jsonb_typeof(target) <> 'object' THEN
+        target := '{}'::jsonb;
+    END IF;
+    RETURN (
+        SELECT COALESCE(jsonb_object_agg(merged.key, merged.value), '{}'::jsonb)
+        FROM (
+            SELECT t.key, t.value FROM jsonb_each(target) t WHERE NOT patch ? t.key
+            UNION ALL
+            SELECT p.key, jsonb_merge_patch(target -> p.key, p.value)
+            FROM jsonb_each(patch) p WHERE jsonb_typeof(p.value) <> 'null'
+        ) merged
+    );
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+# RFC 6902 (JSON Patch), операции add/remove/replace; пути уже разобраны в массивы ключей
+APPLY_PATCH_SQL = """
+CREATE OR REPLACE FUNCTION jsonb_apply_patch(target jsonb, ops jsonb) RETURNS jsonb AS $$
+DECLARE
+    op jsonb;
+    path text[];
+    parent text[];
+BEGIN
+    FOR op IN SELECT value FROM jsonb_array_elements(ops) LOOP
+        path := ARRAY(SELECT jsonb_array_elements_text(op -> 'path'));
+        parent := path[1:array_length(path, 1) - 1];
+        IF op ->> 'op' = 'remove' THEN
+            target := target #- path;
+        ELSIF op ->> 'op' = 'replace' THEN
+            target := jsonb_set(target, path, op -> 'value', false);
+        ELSIF jsonb_typeof(target #> parent) = 'array' THEN
+            IF path[array_length(path, 1)] = '-' THEN
+                target := jsonb_set(target, parent, (target #> parent) || jsonb_build_array(op -> 'value'));
+            ELSE
+                target := jsonb_insert(target, path, op -> 'value');
+            END IF;
+        ELSE
+            target := jsonb_set(target, path, op -> 'value', true);
+        END IF;
+    END LOOP;
+    RETURN target;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_service', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_PATCH_SQL, reverse_sql='DROP FUNCTION IF EXISTS jsonb_merge_patch(jsonb, jsonb);'),
+        migrations.RunSQL(APPLY_PATCH_SQL, reverse_sql='DROP FUNCTION IF EXISTS jsonb_apply_patch(jsonb, jsonb);'),
+    ]
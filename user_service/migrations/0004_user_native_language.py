@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_service', '0003_settings_jsonb_functions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='native_language',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
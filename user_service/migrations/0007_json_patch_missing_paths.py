@@ -0,0 +1,76 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# Код ошибки, по которому `patch_settings` отличает неприменимый патч (`JSON_PATCH_CONFLICT_SQLSTATE`)
+JSON_PATCH_CONFLICT_SQLSTATE = 'JP409'
+
+# RFC 6902 (JSON Patch), операции add/remove/replace; пути уже разобраны в массивы ключей.
+# Если изменяемого значения (`remove`, `replace`) или родителя добавляемого (`add`) нет либо индекс массива
+# вне диапазона, функция прерывается ошибкой с кодом JSON_PATCH_CONFLICT_SQLSTATE, а не пропускает операцию
+APPLY_PATCH_SQL = f"""
+CREATE OR REPLACE FUNCTION jsonb_apply_patch(target jsonb, ops jsonb) RETURNS jsonb AS $$
+DECLARE
+    op jsonb;
+    path text[];
+    parent text[];
+    key text;
+    container jsonb;
+    index int;
+BEGIN
+    FOR op IN SELECT value FROM jsonb_array_elements(ops) LOOP
+        path := ARRAY(SELECT jsonb_array_elements_text(op -> 'path'));
+        parent := path[1:array_length(path, 1) - 1];
+        key := path[array_length(path, 1)];
+        container := target #> parent;
+        index := NULL;
+
+        IF jsonb_typeof(container) = 'array' THEN
+            IF key = '-' AND op ->> 'op' = 'add' THEN
+                index := jsonb_array_length(container);
+            ELSIF key ~ '^(0|[1-9][0-9]{{0,8}})$' THEN
+                index := key::int;
+            END IF;
+            IF index IS NULL OR index > jsonb_array_length(container)
+                    OR (index = jsonb_array_length(container) AND op ->> 'op' <> 'add') THEN
+                RAISE EXCEPTION 'Path /settings/% does not exist.', array_to_string(path, '/')
+                    USING ERRCODE = '{JSON_PATCH_CONFLICT_SQLSTATE}';
+            END IF;
+        ELSIF jsonb_typeof(container) IS DISTINCT FROM 'object'
+                OR (op ->> 'op' <> 'add' AND NOT container ? key) THEN
+            RAISE EXCEPTION 'Path /settings/% does not exist.', array_to_string(path, '/')
+                USING ERRCODE = '{JSON_PATCH_CONFLICT_SQLSTATE}';
+        END IF;
+
+        IF op ->> 'op' = 'remove' THEN
+            target := target #- path;
+        ELSIF op ->> 'op' = 'replace' THEN
+            target := jsonb_set(target, path, op -> 'value', false);
+        ELSIF index IS NULL THEN
+            target := jsonb_set(target, path, op -> 'value', true);
+        ELSIF index < jsonb_array_length(container) THEN
+            target := jsonb_insert(target, parent || index::text, op -> 'value');
+        ELSIF parent = '{{}}' THEN
+            target := container || jsonb_build_array(op -> 'value');
+        ELSE
+            target := jsonb_set(target, parent, container || jsonb_build_array(op -> 'value'));
+        END IF;
+    END LOOP;
+    RETURN target;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_service', '0006_user_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            APPLY_PATCH_SQL,
+            reverse_sql=import_module('user_service.migrations.0003_settings_jsonb_functions').APPLY_PATCH_SQL,
+        ),
+    ]
@@ -0,0 +1,16 @@
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_service', '0008_search_indexes_upper'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.contrib.postgres.indexes.OpClass('avatar', name='varchar_pattern_ops'), name='user_avatar_pattern_idx'),
+        ),
+    ]
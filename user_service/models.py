@@ -1,5 +1,7 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Cast, Upper
 
 
 class User(models.Model):
@@ -27,6 +29,23 @@ class User(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Поиск подстроки (`__icontains`) по имени и фамилии в API и админке: на PostgreSQL Django строит
+            # `UPPER("поле"::text) LIKE UPPER(...)`, поэтому индексируется именно это выражение
+            GinIndex(OpClass(Upper(Cast('first_name', models.TextField())), name='gin_trgm_ops'),
+                     name='user_first_name_upper_trgm'),
+            GinIndex(OpClass(Upper(Cast('last_name', models.TextField())), name='gin_trgm_ops'),
+                     name='user_last_name_upper_trgm'),
+            # Keyset-пагинация поиска по (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='user_created_at_id_idx'),
+            # Лента изменений по курсору (updated_at, id)
+            models.Index(fields=['updated_at', 'id'], name='user_updated_at_id_idx'),
+            # Поиск пользователя аватара по SHA-256 (`avatar__startswith`, то есть `LIKE 'avatars/<sha256>.%'`)
+            # и по имени файла: `varchar_pattern_ops` позволяет использовать индекс для `LIKE` при любом collation
+            models.Index(OpClass('avatar', name='varchar_pattern_ops'), name='user_avatar_pattern_idx'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
@@ -0,0 +1,181 @@
+import base64
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset-пагинация (по курсору) по паре `(<ordering_field>, id)`.
+
+    В отличие от `OFFSET`, каждая страница выбирается условием `WHERE (field, id) > (курсор)` по индексу,
+    поэтому стоимость запроса не растёт с номером страницы, а `COUNT(*)` не выполняется вовсе.
+    Курсор непрозрачен для клиента: это base64 от значения поля и `id` последней записи страницы.
+
+    Атрибуты:
+        - `ordering_field` (str): Поле модели, задающее порядок (вместе с `id`).
+        - `page_size_setting` (str): Настройка с размером страницы по умолчанию.
+        - `max_page_size_setting` (str): Настройка с максимальным размером страницы.
+    """
+    ordering_field = 'created_at'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size_setting = 'USER_SEARCH_PAGE_SIZE'
+    max_page_size_setting = 'USER_SEARCH_MAX_PAGE_SIZE'
+
+    def encode_cursor(self, instance):
+        position = [getattr(instance, self.ordering_field).isoformat(), str(instance.id)]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value = parse_datetime(value)
+            pk = uuid.UUID(pk)
+        except (AttributeError, TypeError, ValueError):
+            value = None
+        if value is None:
+            raise NotFound('Invalid cursor')
+        return value, pk
+
+    def get_page_size(self, request):
+        default = getattr(settings, self.page_size_setting, 20)
+        maximum = getattr(settings, self.max_page_size_setting, 100)
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, default))
+        except ValueError:
+            page_size = default
+        return max(1, min(page_size, maximum))
+
+    def filter_after(self, queryset, value, pk):
+        field = self.ordering_field
+        return queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Возвращает одну страницу записей после позиции из параметра `cursor`.
+
+        :param queryset: Исходный набор записей (без сортировки).
+        :type queryset: django.db.models.QuerySet
+        :param request: HTTP-запрос с параметрами `cursor` и `limit`.
+        :type request: rest_framework.request.Request
+        :return: Список записей текущей страницы.
+        :rtype: list
+        :raises NotFound: Если курсор повреждён.
+        """
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = self.filter_after(queryset, *self.decode_cursor(cursor))
+
+        rows = list(queryset.order_by(self.ordering_field, 'id')[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        self.next_cursor = self.encode_cursor(self.page[-1]) if self.page else cursor
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'next_cursor': self.next_cursor if self.has_next else None,
+        })
+
+
+class ChangeFeedPagination(KeysetPagination):
+    """
+    Пагинация ленты изменений пользователей по курсору `(updated_at, id)`.
+
+    Чтобы лента не пропускала записи, когда транзакции фиксируются не в порядке своих `updated_at`,
+    отдаются только записи с `updated_at` строго ниже «отметки стабильности»: момента начала
+    самой старой ещё не завершённой пишущей транзакции в БД (`pg_stat_activity`), но не позже текущего
+    времени, минус `USER_CHANGES_SAFETY_WINDOW` секунд на задержку между вычислением `updated_at`
+    в приложении и началом транзакции, а также на расхождение часов. Любая запись, которая ещё может
+    быть зафиксирована, получит `updated_at` не меньше этой отметки и попадёт в следующие страницы.
+
+    В отличие от `KeysetPagination`, курсор возвращается всегда (при пустой странице — тот же),
+    чтобы потребитель мог продолжать опрос с него.
+    """
+    ordering_field = 'updated_at'
+    cursor_query_param = 'since'
+    page_size_setting = 'USER_CHANGES_PAGE_SIZE'
+    max_page_size_setting = 'USER_CHANGES_MAX_PAGE_SIZE'
+
+    def get_high_water_mark(self, using):
+        """
+        Возвращает момент времени, до которого (не включительно) набор изменений уже не может пополниться.
+
+        :param using: Псевдоним базы данных.
+        :type using: str
+        :rtype: datetime.datetime
+        """
+        now = timezone.now()
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Внутри транзакции pg_stat_activity читается из снимка, сделанного при первом обращении
+                cursor.execute("SELECT pg_stat_clear_snapshot()")
+                cursor.execute(
+                    "SELECT min(xact_start) FROM pg_stat_activity "
+                    "WHERE datname = current_database() AND backend_xid IS NOT NULL AND pid <> pg_backend_pid()"
+                )
+                oldest_transaction = cursor.fetchone()[0]
+            if oldest_transaction is not None:
+                now = min(now, oldest_transaction)
+        return now - timedelta(seconds=getattr(settings, 'USER_CHANGES_SAFETY_WINDOW', 2))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = queryset.filter(updated_at__lt=self.get_high_water_mark(queryset.db))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'next_cursor': self.next_cursor,
+            'has_more': self.has_next,
+        })
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для админки, который не выполняет `COUNT(*)` по большим выборкам.
+
+    Для выборки без фильтров количество берётся из статистики PostgreSQL (`pg_class.reltuples`),
+    для отфильтрованной — из оценки планировщика (`EXPLAIN`). Точный `COUNT(*)` выполняется только
+    если оценка не превышает `ADMIN_EXACT_COUNT_THRESHOLD` или БД не PostgreSQL.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return super().count
+
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                estimate = row[0] if row else -1
+            else:
+                sql, params = queryset.order_by().query.sql_with_params()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = plan[0]['Plan']['Plan Rows']
+
+        if estimate < getattr(settings, 'ADMIN_EXACT_COUNT_THRESHOLD', 10000):
+            return super().count
+        return int(estimate)
@@ -0,0 +1,28 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsService(BasePermission):
+    """
+    Разрешение для межсервисных запросов: доступ к данным других пользователей есть только у токенов
+    с областью из `JWT_SERVICE_SCOPES` (см. `SimpleUser.is_service`). Токены конечных пользователей
+    получают `403 FORBIDDEN`.
+    """
+    message = "Service token required."
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and getattr(user, 'is_service', False))
+
+
+def is_self_or_service(user, user_id):
+    """
+    Проверяет, что запрос выполнен от имени пользователя `user_id` или сервиса.
+
+    :param user: Пользователь запроса (`SimpleUser`, `AnonymousUser` или `None`).
+    :param user_id: Идентификатор пользователя, к данным которого запрашивается доступ.
+    :type user_id: str or uuid.UUID
+    :rtype: bool
+    """
+    if not user or not user.is_authenticated:
+        return False
+    return bool(getattr(user, 'is_service', False)) or str(user.id) == str(user_id)
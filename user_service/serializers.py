@@ -1,4 +1,11 @@
+import os
+
+from django.conf import settings
 from rest_framework import serializers
+
+from .avatars import avatar_variant_urls, content_addressed_name
+from .export import parse_fields
+from .jsonpatch import settings_max_bytes, settings_size
 from .models import User
 
 
@@ -14,18 +21,68 @@ class UserSerializer(serializers.ModelSerializer):
         - `first_name` (CharField): Имя пользователя. Необязательное поле.
         - `last_name` (CharField): Фамилия пользователя. Необязательное поле.
         - `native_language` (CharField): Родной язык пользователя для переводов. Необязательное поле.
-        - `avatar` (ImageField): Аватар пользователя. Необязательное поле, загружается в папку `avatars/`.
+        - `avatar` (ImageField): Аватар пользователя. Необязательное поле, загружается в папку `avatars/`
+         под именем, равным SHA-256 содержимого.
+        - `avatar_variants` (SerializerMethodField): URL уменьшенных копий аватара по размерам и форматам.
+         Только для чтения, `null`, если производных нет.
         - `settings` (JSONField): Настройки пользователя в формате JSON. По умолчанию пустой словарь.
         - `created_at` (DateTimeField): Дата и время создания записи пользователя. Только для чтения.
         - `updated_at` (DateTimeField): Дата и время последнего обновления записи пользователя. Только для чтения.
+
+    Необязательный аргумент `fields` ограничивает набор полей представления.
     """
+    avatar_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ['id', 'first_name', 'last_name', 'native_language', 'avatar', 'settings', 'created_at', 'updated_at']
+        fields = ['id', 'first_name', 'last_name', 'native_language', 'avatar', 'avatar_variants', 'settings',
+                  'created_at', 'updated_at']
         extra_kwargs = {
             'id': {'required': True, 'read_only': False},  # Указываем, что поле id обязательно и не read-only
         }
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Разреженный набор полей (`?fields=`/`?exclude=`), см. `parse_sparse_fields`
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_avatar_variants(self, obj):
+        return avatar_variant_urls(obj.avatar.name, self.context.get('request'))
+
+    def validate_avatar(self, value):
+        """
+        Переименовывает загруженный аватар по SHA-256 его содержимого.
+
+        Файл сохраняется позже, в транзакции записи профиля (`save_avatar`): если такой же файл
+        уже есть в хранилище, повторная копия не сохраняется.
+
+        :param value: Загруженный файл изображения или `None`.
+        :type value: django.core.files.uploadedfile.UploadedFile or None
+        :return: Файл с новым именем.
+        :rtype: django.core.files.uploadedfile.UploadedFile or None
+        """
+        if value is None:
+            return value
+
+        value.name = os.path.basename(content_addressed_name(value))
+        return value
+
+    def validate_settings(self, value):
+        """
+        Проверяет, что документ `settings` не превышает `USER_SETTINGS_MAX_BYTES`.
+
+        :param value: Новый документ настроек.
+        :type value: dict
+        :return: Тот же документ.
+        :rtype: dict
+        :raises serializers.ValidationError: Если документ слишком большой.
+        """
+        if settings_size(value) > settings_max_bytes():
+            raise serializers.ValidationError(f"Settings document exceeds {settings_max_bytes()} bytes.")
+        return value
+
     def create(self, validated_data):
         """
         Создаёт новый экземпляр модели `User` с предоставленными валидированными данными.
@@ -42,4 +99,170 @@ class UserSerializer(serializers.ModelSerializer):
         if 'id' not in validated_data:
             raise serializers.ValidationError({"error": "User ID is required."})
 
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+
+# Поля модели, которые выбирает `values()` для `user_row_representation`
+USER_ROW_FIELDS = [field for field in UserSerializer.Meta.fields if field != 'avatar_variants']
+
+# Поля профиля, которые видны любому аутентифицированному пользователю (например, в поиске)
+USER_PUBLIC_FIELDS = ['id', 'first_name', 'last_name', 'avatar', 'avatar_variants']
+
+# Поля представления, вычисляемые из других колонок модели
+DERIVED_FIELDS = {'avatar_variants': 'avatar'}
+
+_avatar_storage = User._meta.get_field('avatar').storage
+_datetime_field = serializers.DateTimeField()
+
+
+def _avatar_url(row, request):
+    avatar = row['avatar']
+    if not avatar:
+        return None
+    url = _avatar_storage.url(avatar)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+_ROW_REPRESENTATIONS = {
+    'id': lambda row, request: str(row['id']),
+    'first_name': lambda row, request: row['first_name'],
+    'last_name': lambda row, request: row['last_name'],
+    'native_language': lambda row, request: row['native_language'],
+    'avatar': _avatar_url,
+    'avatar_variants': lambda row, request: avatar_variant_urls(row['avatar'], request),
+    'settings': lambda row, request: row['settings'],
+    'created_at': lambda row, request: _datetime_field.to_representation(row['created_at']),
+    'updated_at': lambda row, request: _datetime_field.to_representation(row['updated_at']),
+}
+
+
+def user_row_representation(row, request=None, fields=None):
+    """
+    Быстрый путь чтения: формирует представление пользователя из строки `values(*USER_ROW_FIELDS)`.
+
+    Результат совпадает с `UserSerializer(user).data` (те же ключи в том же порядке и те же значения),
+    но без создания объектов модели и полей сериализатора на каждый вызов.
+
+    :param row: Словарь значений полей пользователя (достаточно колонок `user_columns(fields)`).
+    :type row: dict
+    :param request: HTTP-запрос для построения абсолютных URL (как `request` в контексте сериализатора).
+    :type request: rest_framework.request.Request or None
+    :param fields: Поля представления (по умолчанию все поля `UserSerializer`).
+    :type fields: list or None
+    :return: Данные пользователя.
+    :rtype: dict
+    """
+    return {field: _ROW_REPRESENTATIONS[field](row, request) for field in fields or UserSerializer.Meta.fields}
+
+
+def user_columns(fields):
+    """
+    Возвращает колонки модели, которые нужно загрузить из БД для полей представления `fields`.
+
+    :param fields: Поля представления из `UserSerializer.Meta.fields`.
+    :type fields: list
+    :rtype: list
+    """
+    columns = []
+    for field in fields:
+        column = DERIVED_FIELDS.get(field, field)
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+
+def parse_sparse_fields(query_params, allowed=None):
+    """
+    Разбирает параметр `fields` или `exclude` (список полей через запятую) и проверяет его
+    по `allowed`. Параметры взаимоисключающие.
+
+    :param query_params: Параметры запроса.
+    :type query_params: django.http.QueryDict
+    :param allowed: Допустимые поля, по умолчанию — `UserSerializer.Meta.fields`.
+    :type allowed: list or None
+    :return: Выбранные поля в порядке `allowed` или `None`, если параметры не переданы.
+    :rtype: list or None
+    :raises serializers.ValidationError: Если переданы оба параметра, передано неизвестное поле
+        или не выбрано ни одного поля.
+    """
+    allowed = allowed or UserSerializer.Meta.fields
+    if 'fields' in query_params and 'exclude' in query_params:
+        raise serializers.ValidationError({'exclude': ["Cannot be combined with fields."]})
+    selection = {}
+    for param in ('fields', 'exclude'):
+        value = query_params.get(param)
+        if value is None:
+            continue
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise serializers.ValidationError(
+                {param: [f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}."]}
+            )
+        selection[param] = names
+
+    if not selection:
+        return None
+    fields = [field for field in allowed
+              if field in selection.get('fields', allowed) and field not in selection.get('exclude', [])]
+    if not fields:
+        raise serializers.ValidationError({'fields': ["At least one field must be selected."]})
+    return fields
+
+
+def project_fields(data, fields):
+    """
+    Оставляет в представлении пользователя только поля `fields` (все, если `fields` равно `None`).
+    """
+    if fields is None:
+        return data
+    return {field: data[field] for field in fields}
+
+
+class UserBatchRequestSerializer(serializers.Serializer):
+    """
+    Сериализатор запроса на пакетное получение профилей пользователей.
+
+    Поля:
+        - `ids` (ListField): Список UUID пользователей. Не может быть пустым, длина ограничена
+         настройкой `USER_BATCH_MAX_SIZE`.
+    """
+    ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+    def validate_ids(self, value):
+        """
+        Проверяет, что размер пакета не превышает `USER_BATCH_MAX_SIZE`, и убирает повторы,
+        сохраняя порядок, заданный клиентом.
+
+        :param value: Список UUID пользователей.
+        :type value: list
+        :return: Список уникальных UUID в исходном порядке.
+        :rtype: list
+        :raises serializers.ValidationError: Если пакет слишком большой.
+        """
+        max_size = getattr(settings, 'USER_BATCH_MAX_SIZE', 100)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f"Ensure this field has no more than {max_size} elements.")
+        return list(dict.fromkeys(value))
+
+
+class UserExportParamsSerializer(serializers.Serializer):
+    """
+    Сериализатор параметров выгрузки пользователей (`/user/export/` и команда `export_users`).
+
+    Поля:
+        - `fields` (CharField): Выгружаемые поля через запятую. По умолчанию все поля из `EXPORT_FIELDS`.
+        - `created_after` / `created_before` (DateTimeField): Диапазон `created_at` (`>=` и `<`).
+        - `updated_after` / `updated_before` (DateTimeField): Диапазон `updated_at` (`>=` и `<`).
+    """
+    fields = serializers.CharField(required=False, allow_blank=True)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    updated_after = serializers.DateTimeField(required=False)
+    updated_before = serializers.DateTimeField(required=False)
+
+    def validate_fields(self, value):
+        try:
+            return parse_fields(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
@@ -1,3 +1,1605 @@
-from django.test import TestCase
+import asyncio
+import base64
+import fcntl
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from datetime import time as dt_time
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import jwt
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection, connections, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.test import (
+    AsyncClient,
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from silk.models import Request as SilkRequest
+
+from sr_user_api import db_router
+from sr_user_api.authentication import JWTAuthentication, token_cache
+from sr_user_api.db_router import PIN_COOKIE
+from sr_user_api.load_shedding import CRITICAL, SHEDDABLE, AdaptiveConcurrencyMiddleware, AdaptiveLimiter
+from sr_user_api.log import QueueStreamHandler, SamplingFilter
+from sr_user_api.metrics import MetricsMiddleware
+from sr_user_api.middleware import PathMiddlewareDispatcher
+from sr_user_api.profiling import SlowRequestProfilingMiddleware, should_intercept
+from sr_user_api.renderers import ORJSONRenderer
+from sr_user_api.revocation import BloomFilter, RevocationList
+from sr_user_api.token_cache import VerifiedTokenCache
+from user_service import avatars, uploads
+from user_service.cache import get_cached_profile, profile_cache_stats
+from user_service.idempotency import (
+    IN_PROGRESS,
+    REPLAYED_HEADER,
+    claim,
+    complete,
+    idempotency_cache_key,
+    replay,
+    request_fingerprint,
+)
+from user_service.jsonpatch import settings_size
+from user_service.media import serve_avatar
+from user_service.models import User
+from user_service.pagination import ChangeFeedPagination
+from user_service.serializers import USER_PUBLIC_FIELDS
+from user_service.updates import bulk_insert_returning, changed, insert_returning, update_returning
+from user_service.uploads import UPLOAD_CONTENT_TYPE
+from user_service.views import UserSearchView
+
+
+def bearer(user_id, **claims):
+    """
+    Возвращает значение заголовка `Authorization` с JWT-токеном пользователя `user_id`.
+    """
+    token = jwt.encode({'user_id': str(user_id), 'exp': int(time.time()) + 300, **claims}, settings.JWT_SECRET_KEY,
+                       algorithm='HS256')
+    return f'Bearer {token}'
+
+
+def auth_client(user_id, **claims):
+    """
+    Возвращает API-клиент с JWT-токеном пользователя `user_id`.
+    """
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=bearer(user_id, **claims))
+    return client
+
+
+@override_settings(DATABASE_REPLICAS=[], PROFILING_SAMPLE_RATE=0)
+class ProfileCacheTests(TestCase):
+    """
+    Проверяет чтение профиля через кэш и обновление кэша при изменении профиля.
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна')
+        self.client = auth_client(self.user.id)
+
+    def test_repeated_read_is_served_from_cache(self):
+        first = self.client.get('/user/profile/')
+        stats = profile_cache_stats()
+        with self.assertNumQueries(0):
+            second = self.client.get('/user/profile/')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(profile_cache_stats()['hits'], stats['hits'] + 1)
+
+    def test_patch_refreshes_cached_profile(self):
+        self.client.get('/user/profile/')
+        self.client.patch('/user/profile/', {'first_name': 'Мария'}, format='json')
+        self.assertEqual(get_cached_profile(self.user.id)['first_name'], 'Мария')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/user/profile/').json()['first_name'], 'Мария')
+
+    def test_missing_user_is_not_cached(self):
+        user_id = uuid.uuid4()
+        self.assertEqual(auth_client(user_id).get('/user/profile/').status_code, 404)
+        self.assertIsNone(get_cached_profile(user_id))
+
+
+@override_settings(DATABASE_REPLICAS=[], PROFILING_SAMPLE_RATE=0)
+class ConditionalRequestTests(TestCase):
+    """
+    Проверяет `ETag`/`Last-Modified` профиля, ответ `304` на условный GET и `412` на устаревший `If-Match`.
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна')
+        self.client = auth_client(self.user.id)
+
+    def test_if_none_match_returns_not_modified(self):
+        response = self.client.get('/user/profile/')
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get('/user/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        # Без кэша условный запрос читает из БД только `updated_at`
+        caches['default'].clear()
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get('/user/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('first_name', queries[0]['sql'])
+
+    def test_if_modified_since_returns_not_modified(self):
+        last_modified = self.client.get('/user/profile/')['Last-Modified']
+        response = self.client.get('/user/profile/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_profile_gets_new_etag(self):
+        etag = self.client.get('/user/profile/')['ETag']
+        self.client.patch('/user/profile/', {'first_name': 'Мария'}, format='json')
+        response = self.client.get('/user/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stale_if_match_is_rejected(self):
+        etag = self.client.get('/user/profile/')['ETag']
+        response = self.client.patch('/user/profile/', {'first_name': 'Мария'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.patch('/user/profile/', {'first_name': 'Ольга'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Мария')
+
+
+@override_settings(DATABASE_REPLICAS=[], PROFILING_SAMPLE_RATE=0)
+class AsyncProfileTests(TestCase):
+    """
+    Проверяет асинхронные `GET`/`PATCH` профиля (`/user/async/profile/`).
+    """
+    url = '/user/async/profile/'
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна', avatar='avatars/old.png')
+        self.client = AsyncClient()
+
+    def get(self, **headers):
+        return async_to_sync(self.client.get)(self.url, headers={'Authorization': bearer(self.user.id), **headers})
+
+    def patch(self, data, **headers):
+        return async_to_sync(self.client.patch)(self.url, json.dumps(data), content_type='application/json',
+                                                headers={'Authorization': bearer(self.user.id), **headers})
+
+    def test_repeated_read_is_served_from_cache(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.get(**{'If-None-Match': first['ETag']}).status_code, 304)
+
+    def test_stale_if_match_is_rejected(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.patch({'first_name': 'Мария'}, **{'If-Match': etag}).status_code, 200)
+        response = self.patch({'first_name': 'Ольга'}, **{'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Мария')
+
+    def test_unchanged_patch_keeps_updated_at(self):
+        updated_at = User.objects.get(id=self.user.id).updated_at
+        response = self.patch({'first_name': 'Анна'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Анна')
+        self.assertEqual(User.objects.get(id=self.user.id).updated_at, updated_at)
+
+    def test_cleared_avatar_is_scheduled_for_deletion(self):
+        with mock.patch('user_service.async_views.schedule_avatar_processing') as schedule:
+            response = self.patch({'avatar': None})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['avatar'])
+        schedule.assert_called_once_with(None, 'avatars/old.png')
+
+        with mock.patch('user_service.async_views.schedule_avatar_processing') as schedule:
+            self.patch({'avatar': None, 'first_name': 'Мария'})
+        schedule.assert_called_once_with(None, None)
+
+
+def service_client(**claims):
+    """
+    Возвращает API-клиент с межсервисным JWT-токеном (область `service`).
+    """
+    return auth_client(uuid.uuid4(), scope='service', **claims)
+
+
+@override_settings(DATABASE_REPLICAS=[], PROFILING_SAMPLE_RATE=0)
+class CreateUserTests(TestCase):
+    """
+    Проверяет создание пользователя в `/user/create/` и `/user/async/create/`: ответ на конфликт `id`
+    и обработку `Idempotency-Key`.
+    """
+    paths = ('/user/create/', '/user/async/create/')
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна', last_name='Иванова')
+        self.payload = {'id': str(self.user.id), 'first_name': 'Мария'}
+
+    def test_conflict_hides_profile_from_other_callers(self):
+        for path in self.paths:
+            for client in (APIClient(), auth_client(uuid.uuid4())):
+                with self.subTest(path=path, client=client):
+                    response = client.post(path, self.payload, format='json')
+                    self.assertEqual(response.status_code, 409)
+                    self.assertEqual(response.json(), {'detail': 'A user with this id already exists.'})
+
+    def test_conflict_returns_profile_to_owner_and_service(self):
+        for path in self.paths:
+            for client in (auth_client(self.user.id), service_client()):
+                with self.subTest(path=path, client=client):
+                    response = client.post(path, self.payload, format='json')
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual((response.json()['first_name'], response.json()['last_name']),
+                                     ('Анна', 'Иванова'))
+
+    def test_key_is_claimed_while_request_runs(self):
+        cache_key = idempotency_cache_key('/user/create/', 'key-1')
+        records = []
+
+        def insert(user, fields):
+            records.append(caches['default'].get(cache_key))
+            return insert_returning(user, fields)
+
+        payload = {'id': str(uuid.uuid4()), 'first_name': 'Иван'}
+        with mock.patch('user_service.views.insert_returning', side_effect=insert):
+            response = APIClient().post('/user/create/', payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(records, [{'fingerprint': request_fingerprint(payload), 'status': IN_PROGRESS}])
+        self.assertEqual(caches['default'].get(cache_key)['status'], 201)
+
+    def test_repeat_is_replayed_without_queries(self):
+        payload = {'id': str(uuid.uuid4()), 'first_name': 'Иван'}
+        for path in self.paths:
+            with self.subTest(path=path):
+                first = APIClient().post(path, payload, format='json', HTTP_IDEMPOTENCY_KEY=path)
+                self.assertEqual(first.status_code, 201)
+                self.assertNotIn(REPLAYED_HEADER, first)
+                with self.assertNumQueries(0):
+                    second = APIClient().post(path, payload, format='json', HTTP_IDEMPOTENCY_KEY=path)
+                self.assertEqual((second.status_code, second.content), (201, first.content))
+                self.assertEqual(second[REPLAYED_HEADER], 'true')
+                User.objects.filter(id=payload['id']).delete()
+
+    @override_settings(DATABASE_REPLICAS=['default'], DATABASE_PIN_SECONDS=10)
+    def test_repeat_replays_stored_headers_and_cookies(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                payload = {'id': str(uuid.uuid4()), 'first_name': 'Иван'}
+                first = APIClient().post(path, payload, format='json', HTTP_IDEMPOTENCY_KEY=path)
+                self.assertEqual(first.cookies[PIN_COOKIE].value, '1')
+                second = APIClient().post(path, payload, format='json', HTTP_IDEMPOTENCY_KEY=path)
+                self.assertEqual(second[REPLAYED_HEADER], 'true')
+                self.assertEqual(second.cookies[PIN_COOKIE].OutputString(), first.cookies[PIN_COOKIE].OutputString())
+
+        cache_key = idempotency_cache_key('/user/profile/', 'key-1')
+        response = HttpResponse(status=201)
+        response['ETag'] = '"v1"'
+        response['Location'] = '/user/profile/'
+        response['X-Request-Id'] = 'request-1'
+        complete(cache_key, 'fingerprint', {'id': 1}, response)
+        replayed = replay(caches['default'].get(cache_key), 'fingerprint', Response)
+        self.assertEqual((replayed.status_code, replayed.data), (201, {'id': 1}))
+        self.assertEqual((replayed['ETag'], replayed['Location']), ('"v1"', '/user/profile/'))
+        self.assertFalse(replayed.has_header('X-Request-Id'))
+
+    def test_repeat_while_in_progress_returns_409(self):
+        payload = {'id': str(uuid.uuid4()), 'first_name': 'Иван'}
+        for path in self.paths:
+            with self.subTest(path=path):
+                claim(idempotency_cache_key(path, 'key-1'), request_fingerprint(payload))
+                response = APIClient().post(path, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+                self.assertEqual(response.status_code, 409)
+                self.assertNotIn(REPLAYED_HEADER, response)
+        self.assertFalse(User.objects.filter(id=payload['id']).exists())
+
+    def test_key_reused_with_other_body_returns_422(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                payload = {'id': str(uuid.uuid4()), 'first_name': 'Иван'}
+                APIClient().post(path, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+                response = APIClient().post(path, {**payload, 'first_name': 'Пётр'}, format='json',
+                                            HTTP_IDEMPOTENCY_KEY='key-1')
+                self.assertEqual(response.status_code, 422)
+                self.assertEqual(User.objects.get(id=payload['id']).first_name, 'Иван')
+
+    def test_stored_response_is_not_replayed_to_other_callers(self):
+        response = auth_client(self.user.id).post('/user/create/', self.payload, format='json',
+                                                  HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.json()['last_name'], 'Иванова')
+        response = APIClient().post('/user/create/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn(REPLAYED_HEADER, response)
+
+    def test_failed_request_releases_key(self):
+        payload = {'id': str(uuid.uuid4()), 'first_name': 'Иван'}
+        with mock.patch('user_service.views.insert_returning', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                APIClient().post('/user/create/', payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertIsNone(caches['default'].get(idempotency_cache_key('/user/create/', 'key-1')))
+        response = APIClient().post('/user/create/', payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 201)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class BulkCreateTests(TestCase):
+    """
+    Проверяет пакетное создание пользователей списком в `/user/create/`.
+    """
+    def setUp(self):
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна', last_name='Иванова',
+                                        settings={'theme': 'dark'})
+
+    def test_requires_service_token(self):
+        payload = [{'id': str(self.user.id), 'first_name': 'Мария'}]
+        self.assertEqual(APIClient().post('/user/create/?on_conflict=update', payload, format='json').status_code,
+                         403)
+        self.assertEqual(auth_client(self.user.id).post('/user/create/', payload, format='json').status_code, 403)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Анна')
+
+    def test_conflict_ignore_keeps_existing_user(self):
+        new_id = str(uuid.uuid4())
+        response = service_client().post('/user/create/', [
+            {'id': str(self.user.id), 'first_name': 'Мария'},
+            {'id': new_id, 'first_name': 'Иван'},
+            {'id': 'not-a-uuid'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['skipped', 'created', 'invalid'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Анна')
+        self.assertTrue(User.objects.filter(id=new_id, first_name='Иван').exists())
+
+    def test_conflict_update_overwrites_given_fields(self):
+        response = service_client().post('/user/create/?on_conflict=update', [
+            {'id': str(self.user.id), 'first_name': 'Мария', 'last_name': 'Петрова', 'native_language': 'en',
+             'settings': {}},
+        ], format='json')
+        self.assertEqual(response.json()['results'], [{'id': str(self.user.id), 'status': 'updated'}])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.last_name, self.user.native_language, self.user.settings),
+                         ('Мария', 'Петрова', 'en', {}))
+
+    def test_partial_update_keeps_omitted_fields(self):
+        other = User.objects.create(id=uuid.uuid4(), first_name='Иван', native_language='de')
+        updated_at = self.user.updated_at
+        response = service_client().post('/user/create/?on_conflict=update', [
+            {'id': str(self.user.id), 'first_name': 'Мария'},
+            {'id': str(other.id)},
+        ], format='json')
+        self.assertEqual([result['status'] for result in response.json()['results']], ['updated', 'skipped'])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.last_name, self.user.settings),
+                         ('Мария', 'Иванова', {'theme': 'dark'}))
+        self.assertGreater(self.user.updated_at, updated_at)
+        other.refresh_from_db()
+        self.assertEqual((other.first_name, other.native_language), ('Иван', 'de'))
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_outcome_comes_from_insert_returning(self):
+        raced_id, new_id = uuid.uuid4(), uuid.uuid4()
+
+        def insert(objs, fields):
+            # Параллельный запрос создаёт пользователя после проверки элементов, но до вставки
+            User.objects.create(id=raced_id, first_name='Пётр')
+            return bulk_insert_returning(objs, fields)
+
+        payload = [{'id': str(raced_id), 'first_name': 'Иван'}, {'id': str(new_id), 'first_name': 'Мария'},
+                   {'id': str(self.user.id), 'first_name': 'Ольга'}]
+        with mock.patch('user_service.views.bulk_insert_returning', side_effect=insert), \
+                CaptureQueriesContext(connection) as queries:
+            response = service_client().post('/user/create/?on_conflict=update', payload, format='json')
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['updated', 'created', 'updated'])
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('SELECT')])
+        self.assertEqual(User.objects.get(id=raced_id).first_name, 'Иван')
+
+        User.objects.filter(id__in=[raced_id, new_id]).delete()
+        with mock.patch('user_service.views.bulk_insert_returning', side_effect=insert):
+            response = service_client().post('/user/create/', payload, format='json')
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['skipped', 'created', 'skipped'])
+        self.assertEqual(User.objects.get(id=raced_id).first_name, 'Пётр')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ReturningQueryTests(TestCase):
+    """
+    Проверяет `update_returning`, `insert_returning` и `bulk_insert_returning`: один запрос, возвращаемые поля
+    и их типы, конфликт вставки.
+    """
+    def setUp(self):
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна', settings={'theme': 'dark'})
+
+    def test_update_returns_new_values_in_one_query(self):
+        updated_at = timezone.now()
+        other = User.objects.create(id=uuid.uuid4(), first_name='Иван')
+        values = {'first_name': 'Мария', 'settings': {'theme': 'light'}, 'updated_at': updated_at}
+        with self.assertNumQueries(1):
+            rows = update_returning(User.objects.filter(id=self.user.id), values,
+                                    ['id', 'first_name', 'settings', 'updated_at'])
+        self.assertEqual(rows, [{'id': self.user.id, 'first_name': 'Мария', 'settings': {'theme': 'light'},
+                                 'updated_at': updated_at}])
+        self.assertEqual(list(rows[0]), ['id', 'first_name', 'settings', 'updated_at'])
+        other.refresh_from_db()
+        self.assertEqual(other.first_name, 'Иван')
+
+    def test_update_skips_unchanged_rows(self):
+        values = {'first_name': 'Анна', 'settings': {'theme': 'dark'}}
+        with self.assertNumQueries(1):
+            rows = update_returning(User.objects.filter(changed(values), id=self.user.id), values, ['id'])
+        self.assertEqual(rows, [])
+
+    def test_insert_returns_requested_fields(self):
+        user = User(id=uuid.uuid4(), first_name='Иван')
+        with self.assertNumQueries(1):
+            row = insert_returning(user, ['id', 'created_at'])
+        self.assertEqual(list(row), ['id', 'created_at'])
+        self.assertEqual(row['id'], user.id)
+        self.assertEqual(row['created_at'], User.objects.get(id=user.id).created_at)
+        self.assertFalse(user._state.adding)
+
+    def test_bulk_insert_returns_only_inserted_rows(self):
+        users = [User(id=uuid.uuid4(), first_name='Иван'), User(id=self.user.id, first_name='Мария'),
+                 User(id=uuid.uuid4(), first_name='Ольга')]
+        with self.assertNumQueries(1):
+            rows = bulk_insert_returning(users, ['id', 'first_name'])
+        self.assertCountEqual(rows, [{'id': users[0].id, 'first_name': 'Иван'},
+                                     {'id': users[2].id, 'first_name': 'Ольга'}])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Анна')
+        self.assertEqual(bulk_insert_returning([], ['id']), [])
+
+    def test_insert_conflict_returns_none(self):
+        user = User(id=self.user.id, first_name='Мария')
+        with self.assertNumQueries(1):
+            self.assertIsNone(insert_returning(user, ['id']))
+        self.assertTrue(user._state.adding)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Анна')
+
+
+@override_settings(DATABASE_REPLICAS=[], PROFILING_SAMPLE_RATE=0)
+class SparseFieldsTests(TestCase):
+    """
+    Проверяет параметры `fields`/`exclude`: набор полей ответа, загружаемые колонки и обход кэша профиля.
+    """
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна', last_name='Иванова',
+                                        settings={'theme': 'dark'})
+        self.client = auth_client(self.user.id)
+
+    @staticmethod
+    def selected_columns(queries):
+        [sql] = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        return sql[:sql.index(' FROM ')]
+
+    def test_fields_limit_loaded_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/user/profile/', {'fields': 'last_name,first_name'})
+        self.assertEqual(response.json(), {'first_name': 'Анна', 'last_name': 'Иванова'})
+        self.assertTrue(response.has_header('ETag'))
+        columns = self.selected_columns(queries.captured_queries)
+        self.assertIn('"first_name"', columns)
+        self.assertIn('"updated_at"', columns)
+        self.assertNotIn('"settings"', columns)
+        self.assertNotIn('"avatar"', columns)
+
+    def test_exclude_limits_loaded_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/user/profile/', {'exclude': 'settings,avatar,avatar_variants'})
+        self.assertEqual(sorted(response.json()), ['created_at', 'first_name', 'id', 'last_name', 'native_language',
+                                                   'updated_at'])
+        columns = self.selected_columns(queries.captured_queries)
+        self.assertNotIn('"settings"', columns)
+        self.assertNotIn('"avatar"', columns)
+
+    def test_list_views_select_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = service_client().get('/user/search/', {'q': 'Анн', 'fields': 'id,first_name'})
+        self.assertEqual(response.json()['results'], [{'id': str(self.user.id), 'first_name': 'Анна'}])
+        columns = self.selected_columns(queries.captured_queries)
+        self.assertNotIn('"settings"', columns)
+        self.assertNotIn('"last_name"', columns)
+
+    def test_unknown_fields_are_rejected(self):
+        for params in ({'fields': 'first_name,password'}, {'exclude': 'password'}, {'fields': ','}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/user/profile/', params).status_code, 400)
+                self.assertEqual(self.client.get('/user/async/profile/', params,
+                                                 HTTP_AUTHORIZATION=bearer(self.user.id)).status_code, 400)
+
+    def test_fields_and_exclude_cannot_be_combined(self):
+        response = self.client.get('/user/profile/', {'fields': 'first_name', 'exclude': 'settings'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('exclude', response.json())
+        response = service_client().get('/user/search/', {'fields': 'id', 'exclude': 'settings'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sparse_profile_is_not_cached(self):
+        self.client.get('/user/profile/', {'fields': 'first_name'})
+        self.assertIsNone(get_cached_profile(self.user.id))
+
+        full = self.client.get('/user/profile/').json()
+        self.assertEqual(get_cached_profile(self.user.id), full)
+        with self.assertNumQueries(0):
+            response = self.client.get('/user/profile/', {'exclude': 'settings'})
+        self.assertEqual(response.json(), {field: value for field, value in full.items() if field != 'settings'})
+        self.assertEqual(get_cached_profile(self.user.id), full)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class UserSearchTests(TestCase):
+    """
+    Проверяет поиск пользователей и набор полей, доступный вызывающему.
+    """
+    def setUp(self):
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна', settings={'theme': 'dark'})
+
+    def test_end_user_sees_public_fields_only(self):
+        client = auth_client(uuid.uuid4())
+        response = client.get('/user/search/', {'q': 'Анн'})
+        self.assertEqual(response.status_code, 200)
+        [result] = response.json()['results']
+        self.assertEqual(sorted(result), sorted(USER_PUBLIC_FIELDS))
+        self.assertEqual(client.get('/user/search/', {'fields': 'id,settings'}).status_code, 400)
+
+    def test_service_sees_all_fields(self):
+        response = service_client().get('/user/search/', {'q': str(self.user.id), 'fields': 'id,settings'})
+        self.assertEqual(response.json()['results'], [{'id': str(self.user.id), 'settings': {'theme': 'dark'}}])
+
+    def test_invalid_cursor_is_not_found(self):
+        client = auth_client(uuid.uuid4())
+        for position in (['2026-01-01T00:00:00+00:00', 'not-a-uuid'], ['2026-01-01T00:00:00+00:00', 5], ['x', 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            with self.subTest(position=position):
+                self.assertEqual(client.get('/user/search/', {'cursor': cursor}).status_code, 404)
+        self.assertEqual(client.get('/user/search/', {'cursor': '!!!'}).status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'gin_trgm_ops indexes are PostgreSQL-only')
+class UserSearchIndexTests(TestCase):
+    """
+    Проверяет, что поиск подстроки по имени и фамилии использует триграммные индексы.
+    """
+    def test_search_uses_trigram_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest('pg_trgm extension is not installed')
+            # На почти пустой таблице планировщик и так выбрал бы последовательное чтение
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        view = UserSearchView()
+        view.request = Request(RequestFactory().get('/user/search/', {'q': 'Анн'}))
+        plan = view.get_queryset().explain()
+        self.assertIn('Bitmap Index Scan on user_first_name_upper_trgm', plan)
+        self.assertIn('Bitmap Index Scan on user_last_name_upper_trgm', plan)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class UserExportTests(TestCase):
+    """
+    Проверяет потоковую выгрузку пользователей.
+    """
+    def test_service_streams_ndjson(self):
+        user = User.objects.create(id=uuid.uuid4(), first_name='Анна')
+        response = service_client().get('/user/export/', {'fields': 'id,first_name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'id': str(user.id), 'first_name': 'Анна'}])
+
+    def test_end_user_cannot_export(self):
+        self.assertEqual(auth_client(uuid.uuid4()).get('/user/export/').status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class UserChangesTests(TestCase):
+    """
+    Проверяет ленту изменений пользователей и отметку стабильности `ChangeFeedPagination`.
+    """
+    def setUp(self):
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна')
+
+    def test_end_user_cannot_read_feed(self):
+        self.assertEqual(auth_client(self.user.id).get('/user/changes/').status_code, 403)
+
+    @override_settings(USER_CHANGES_SAFETY_WINDOW=-60)
+    def test_sparse_fields_keep_id_and_updated_at(self):
+        response = service_client().get('/user/changes/', {'fields': 'first_name'})
+        self.assertEqual(response.status_code, 200)
+        [result] = response.json()['results']
+        self.assertEqual(sorted(result), ['first_name', 'id', 'updated_at'])
+        self.assertIsNotNone(response.json()['next_cursor'])
+        response = service_client().get('/user/changes/', {'exclude': 'id,updated_at,settings'})
+        [result] = response.json()['results']
+        self.assertIn('id', result)
+        self.assertIn('updated_at', result)
+        self.assertNotIn('settings', result)
+
+    def test_recent_changes_wait_for_high_water_mark(self):
+        response = service_client().get('/user/changes/')
+        self.assertEqual(response.json(), {'results': [], 'next_cursor': None, 'has_more': False})
+
+    @override_settings(USER_CHANGES_SAFETY_WINDOW=5)
+    def test_high_water_mark_trails_now_by_safety_window(self):
+        before = timezone.now()
+        mark = ChangeFeedPagination().get_high_water_mark('default')
+        self.assertLessEqual(before - timedelta(seconds=5), mark)
+        self.assertLessEqual(mark, timezone.now() - timedelta(seconds=5))
+
+    @skipUnless(connection.vendor == 'postgresql', 'pg_stat_activity is PostgreSQL-only')
+    @override_settings(USER_CHANGES_SAFETY_WINDOW=0)
+    def test_high_water_mark_stops_before_open_write_transaction(self):
+        other = connections.create_connection('default')
+        self.addCleanup(other.close)
+        other.set_autocommit(False)
+        with other.cursor() as cursor:
+            # Транзакция получает xid только после первой записи
+            cursor.execute('SELECT txid_current(), now()')
+            xact_start = cursor.fetchone()[1]
+        time.sleep(0.05)
+        self.assertLessEqual(ChangeFeedPagination().get_high_water_mark('default'), xact_start)
+        other.rollback()
+        self.assertGreater(ChangeFeedPagination().get_high_water_mark('default'), xact_start)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class UserBatchTests(TestCase):
+    """
+    Проверяет пакетное чтение профилей и доступ к нему только по сервисному токену.
+    """
+    def setUp(self):
+        self.users = [User.objects.create(id=uuid.uuid4(), first_name=name) for name in ('Анна', 'Иван')]
+        self.ids = [str(user.id) for user in self.users]
+
+    def test_service_gets_profiles_in_requested_order(self):
+        missing = str(uuid.uuid4())
+        response = service_client().post('/user/batch/', {'ids': [self.ids[1], missing, self.ids[0]]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.ids[1], self.ids[0]])
+        self.assertEqual(response.json()['missing'], [missing])
+
+    def test_end_user_cannot_read_other_profiles(self):
+        response = auth_client(self.ids[0]).post('/user/batch/', {'ids': self.ids}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'jsonb_merge_patch/jsonb_apply_patch are PostgreSQL functions')
+@override_settings(DATABASE_REPLICAS=[])
+class SettingsPatchTests(TestCase):
+    """
+    Проверяет частичное обновление `settings` через JSON Merge Patch и JSON Patch.
+    """
+    def setUp(self):
+        self.user = User.objects.create(id=uuid.uuid4(), settings={'theme': 'dark', 'langs': ['ru', 'en'],
+                                                                   'notify': {'email': True, 'push': False}})
+        self.client = auth_client(self.user.id)
+
+    def patch(self, data, content_type='application/json-patch+json'):
+        return self.client.generic('PATCH', '/user/profile/', json.dumps(data), content_type=content_type)
+
+    def assert_settings(self, expected):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.settings, expected)
+
+    def test_merge_patch(self):
+        response = self.patch({'first_name': 'Анна', 'settings': {'theme': None, 'notify': {'push': True},
+                                                                 'langs': ['de']}},
+                              content_type='application/merge-patch+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Анна')
+        self.assert_settings({'langs': ['de'], 'notify': {'email': True, 'push': True}})
+
+    def test_json_patch(self):
+        response = self.patch([
+            {'op': 'replace', 'path': '/settings/theme', 'value': 'light'},
+            {'op': 'add', 'path': '/settings/langs/1', 'value': 'de'},
+            {'op': 'add', 'path': '/settings/langs/-', 'value': 'fr'},
+            {'op': 'remove', 'path': '/settings/notify/push'},
+            {'op': 'add', 'path': '/settings/notify/sms', 'value': None},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assert_settings({'theme': 'light', 'langs': ['ru', 'de', 'en', 'fr'],
+                              'notify': {'email': True, 'sms': None}})
+
+    def test_json_patch_missing_path_conflicts(self):
+        updated_at = User.objects.get(id=self.user.id).updated_at
+        for operation in (
+            {'op': 'remove', 'path': '/settings/missing'},
+            {'op': 'replace', 'path': '/settings/notify/missing', 'value': 1},
+            {'op': 'add', 'path': '/settings/missing/key', 'value': 1},
+            {'op': 'add', 'path': '/settings/theme/key', 'value': 1},
+            {'op': 'add', 'path': '/settings/langs/3', 'value': 'de'},
+            {'op': 'replace', 'path': '/settings/langs/2', 'value': 'de'},
+            {'op': 'remove', 'path': '/settings/langs/x'},
+        ):
+            with self.subTest(operation=operation):
+                # Первая операция применима, но патч отклоняется целиком
+                response = self.patch([{'op': 'replace', 'path': '/settings/theme', 'value': 'light'}, operation])
+                self.assertEqual(response.status_code, 409)
+                self.assertIn('does not exist', response.json()['settings'][0])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.settings['theme'], self.user.updated_at), ('dark', updated_at))
+
+    def test_non_ascii_settings_size_matches_database(self):
+        document = {'name': 'Жанна ' * 20, 'emoji': '😀'}
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT octet_length(%s::jsonb::text)', [json.dumps(document)])
+            self.assertEqual(cursor.fetchone()[0], settings_size(document))
+
+        with override_settings(USER_SETTINGS_MAX_BYTES=settings_size(document)):
+            response = self.patch({'settings': document}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            response = self.patch({'settings': {**document, 'name': document['name'] + 'ы'}},
+                                  content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+            response = self.patch([{'op': 'replace', 'path': '/settings/name', 'value': 'Ж' * 110}])
+            self.assertEqual(response.status_code, 200)
+            self.assert_settings({**document, 'name': 'Ж' * 110})
+            response = self.patch([{'op': 'replace', 'path': '/settings/name', 'value': 'Ж' * 111}])
+            self.assertEqual(response.status_code, 400)
+        self.assert_settings({**document, 'name': 'Ж' * 110})
+
+    def test_json_patch_outside_settings_is_rejected(self):
+        response = self.patch([{'op': 'remove', 'path': '/first_name'}])
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(getattr(settings, 'DATABASE_REPLICAS', None), 'Реплики БД не настроены (DATABASE_REPLICA_HOSTS_USER_API).')
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Проверяет маршрутизацию чтения в реплики и закрепление чтения за основной БД после записи.
+
+    В тестах реплики являются зеркалами тестовой основной БД (`TEST.MIRROR`), то есть отдельными
+    подключениями к той же базе, поэтому используется `TransactionTestCase`.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        db_router._unavailable_until.clear()
+        db_router._lag_checked_at.clear()
+        caches['default'].clear()
+        caches[getattr(settings, 'DATABASE_PIN_CACHE_ALIAS', 'default')].clear()
+        self.replica = settings.DATABASE_REPLICAS[0]
+        self.user = User.objects.create(id=uuid.uuid4(), first_name='Анна')
+        self.client = auth_client(self.user.id)
+
+    def get_profile(self, replica_error=None):
+        replica_connection = connections[self.replica]
+        failure = (mock.patch.object(replica_connection, 'ensure_connection', side_effect=replica_error)
+                   if replica_error else nullcontext())
+        with (CaptureQueriesContext(connections['default']) as primary,
+              CaptureQueriesContext(replica_connection) as replica, failure):
+            response = self.client.get('/user/profile/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(primary), len(replica)
+
+    def test_read_goes_to_replica(self):
+        response, primary, replica = self.get_profile()
+        self.assertEqual(response.json()['first_name'], 'Анна')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_write_pins_reads_to_primary(self):
+        with CaptureQueriesContext(connections[self.replica]) as replica:
+            response = self.client.patch('/user/profile/', {'first_name': 'Мария'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(replica), 0)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # Отметка в кэше действует и без cookie (например, для другого устройства пользователя)
+        self.client.cookies.pop(PIN_COOKIE)
+        caches['default'].clear()
+        caches[getattr(settings, 'DATABASE_PIN_CACHE_ALIAS', 'default')].set(
+            f'{db_router.PIN_CACHE_PREFIX}:{self.user.id}', True)
+        response, primary, replica = self.get_profile()
+        self.assertEqual(response.json()['first_name'], 'Мария')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        with self.assertLogs('sr_user_api.db_router', 'WARNING'):
+            response, primary, replica = self.get_profile(replica_error=OperationalError)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        self.assertIn(self.replica, db_router._unavailable_until)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TokenRevocationTests(TestCase):
+    """
+    Проверяет отклонение отозванных токенов и отсутствие запросов к чёрному списку для остальных.
+    """
+    def setUp(self):
+        token_cache.clear()
+        self.revocations = RevocationList()
+        patcher = mock.patch('sr_user_api.authentication.revocation_list', self.revocations)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(id=uuid.uuid4())
+        self.revoke('revoked-jti')
+
+    @staticmethod
+    def revoke(jti):
+        token = OutstandingToken.objects.create(jti=jti, token='', expires_at=timezone.now() + timedelta(hours=1))
+        BlacklistedToken.objects.create(token=token)
+
+    def get_profile(self, jti):
+        return auth_client(self.user.id, jti=jti).get('/user/profile/')
+
+    def test_revoked_token_is_rejected(self):
+        with self.assertLogs('sr_user_api.authentication', 'WARNING'):
+            self.assertEqual(self.get_profile('revoked-jti').status_code, 403)
+
+    def test_valid_token_does_not_query_blacklist(self):
+        self.get_profile('first-jti')
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.get_profile('second-jti')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'token_blacklist' in query['sql']])
+
+    def test_new_revocation_is_picked_up_after_refresh(self):
+        self.assertEqual(self.get_profile('later-jti').status_code, 200)
+        self.revoke('later-jti')
+        token_cache.clear()
+        with override_settings(JWT_REVOCATION_REFRESH_SECONDS=0), self.assertLogs('sr_user_api.authentication'):
+            self.assertEqual(self.get_profile('later-jti').status_code, 403)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.001)
+        items = [str(uuid.uuid4()) for _ in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        self.assertLess(sum(str(uuid.uuid4()) in bloom for _ in range(10000)), 50)
+
+
+class TokenCacheTests(SimpleTestCase):
+    """
+    Проверяет кэш проверенных JWT-токенов: срок жизни записей, вытеснение, учёт попаданий
+    и проверку отзыва для токенов из кэша.
+    """
+    def setUp(self):
+        self.cache = VerifiedTokenCache(maxsize=2)
+        self.revocations = mock.Mock(is_revoked=mock.Mock(return_value=False))
+        for target, value in (('token_cache', self.cache), ('revocation_list', self.revocations)):
+            patcher = mock.patch(f'sr_user_api.authentication.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def authenticate(token):
+        return JWTAuthentication().authenticate(RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+
+    @staticmethod
+    def auth_outcomes(outcome):
+        return REGISTRY.get_sample_value('jwt_authentication_total', {'outcome': outcome}) or 0
+
+    def test_entry_expires_with_token(self):
+        with mock.patch('sr_user_api.token_cache.time.time', return_value=900):
+            self.cache.set('token', {'user_id': '1', 'exp': 1000})
+        with mock.patch('sr_user_api.token_cache.time.time', return_value=999.9):
+            self.assertEqual(self.cache.get('token'), {'user_id': '1', 'exp': 1000})
+        with mock.patch('sr_user_api.token_cache.time.time', return_value=1000):
+            self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_token_without_future_exp_is_not_cached(self):
+        for payload in ({'user_id': '1'}, {'exp': '9999999999'}, {'exp': time.time() - 1}):
+            with self.subTest(payload=payload):
+                self.cache.set('token', payload)
+                self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        exp = time.time() + 300
+        self.cache.set('first', {'exp': exp})
+        self.cache.set('second', {'exp': exp})
+        self.cache.get('first')
+        self.cache.set('third', {'exp': exp})
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNotNone(self.cache.get('third'))
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_invalid_or_expired_token_is_not_cached(self):
+        expired = jwt.encode({'user_id': '1', 'exp': int(time.time()) - 10}, settings.JWT_SECRET_KEY, algorithm='HS256')
+        forged = jwt.encode({'user_id': '1', 'exp': int(time.time()) + 300}, 'other-secret', algorithm='HS256')
+        for token in (expired, forged, 'not-a-jwt'):
+            with self.subTest(token=token), self.assertLogs('sr_user_api.authentication', 'ERROR'):
+                with self.assertRaises(AuthenticationFailed):
+                    self.authenticate(token)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_hits_and_misses_are_counted(self):
+        token = bearer(uuid.uuid4())[len('Bearer '):]
+        hits, successes = self.auth_outcomes('cache_hit'), self.auth_outcomes('success')
+        self.authenticate(token)
+        user, _ = self.authenticate(token)
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual(self.cache.stats(), {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 1})
+        self.assertEqual(self.auth_outcomes('cache_hit'), hits + 1)
+        self.assertEqual(self.auth_outcomes('success'), successes + 1)
+
+    def test_revoked_token_is_rejected_from_cache(self):
+        token = bearer(uuid.uuid4(), jti='cached-jti')[len('Bearer '):]
+        self.authenticate(token)
+        self.revocations.is_revoked.return_value = True
+        with self.assertLogs('sr_user_api.authentication', 'WARNING'), self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.revocations.is_revoked.assert_called_with('cached-jti')
+
+
+class LoggingTests(SimpleTestCase):
+    """
+    Проверяет сэмплирование записей `SamplingFilter` и запись логов в фоновом потоке `QueueStreamHandler`.
+    """
+    @staticmethod
+    def record(level, message='message %s', args=('x',)):
+        return logging.LogRecord('sr_user_api.authentication', level, __file__, 1, message, args, None)
+
+    def test_sampled_out_records_are_dropped_at_rate(self):
+        sampling = SamplingFilter(rate=0.25)
+        with mock.patch('sr_user_api.log.random.random', side_effect=[0.1, 0.3, 0.24, 0.25, 0.9]):
+            passed = [sampling.filter(self.record(level)) for level in (logging.INFO, logging.DEBUG, logging.INFO,
+                                                                        logging.INFO, logging.DEBUG)]
+        self.assertEqual(passed, [True, False, True, False, False])
+
+        random_state = random.getstate()
+        self.addCleanup(random.setstate, random_state)
+        random.seed(13)
+        self.assertAlmostEqual(sum(sampling.filter(self.record(logging.INFO)) for _ in range(10000)) / 10000, 0.25,
+                               delta=0.02)
+
+    def test_warnings_and_errors_are_always_kept(self):
+        sampling = SamplingFilter(rate=0)
+        with mock.patch('sr_user_api.log.random.random', return_value=0.0):
+            self.assertFalse(sampling.filter(self.record(logging.INFO)))
+        for level in (logging.WARNING, logging.ERROR, logging.CRITICAL):
+            with self.subTest(level=level):
+                self.assertTrue(sampling.filter(self.record(level)))
+
+    def test_records_are_flushed_on_close(self):
+        stream = io.StringIO()
+        handler = QueueStreamHandler(stream)
+        handler.setFormatter(logging.Formatter('{levelname}: {message}', style='{'))
+        self.assertTrue(handler.running)
+        for index in range(100):
+            handler.handle(self.record(logging.INFO, 'line %d', (index,)))
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self.record(logging.ERROR, 'failed', ())
+            record.exc_info = sys.exc_info()
+            handler.handle(record)
+
+        handler.close()
+        self.assertFalse(handler.running)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[:100], [f'INFO: line {index}' for index in range(100)])
+        self.assertEqual(lines[100], 'ERROR: failed')
+        self.assertIn('ValueError: boom', stream.getvalue())
+        self.assertEqual(handler.dropped, 0)
+        handler.close()
+
+
+@override_settings(PROFILING_SAMPLE_RATE=0)
+class MetricsTests(TestCase):
+    """
+    Проверяет сбор метрик запросов и доступ к `/metrics`.
+    """
+    @staticmethod
+    def sample(name, route):
+        return REGISTRY.get_sample_value(name, {'route': route}) or 0
+
+    def request(self, route):
+        request = RequestFactory().get('/metrics-test/')
+        request.resolver_match = mock.Mock(route=route)
+        return request
+
+    def test_streamed_body_queries_are_counted(self):
+        def body():
+            yield str(User.objects.count()).encode()
+            yield str(User.objects.count()).encode()
+
+        middleware = MetricsMiddleware(lambda request: StreamingHttpResponse(body()))
+        queries = self.sample('http_request_db_queries_sum', 'streaming-test')
+        response = middleware(self.request('streaming-test'))
+        self.assertEqual(self.sample('http_request_db_queries_sum', 'streaming-test'), queries)
+        self.assertEqual(b''.join(response), b'00')
+        response.close()
+        self.assertEqual(self.sample('http_request_db_queries_sum', 'streaming-test'), queries + 2)
+
+    def test_async_requests_are_measured(self):
+        async def get_response(request):
+            # Асинхронный ORM выполняет запросы в потоке `sync_to_async`, а не в потоке middleware
+            await User.objects.acount()
+            await sync_to_async(User.objects.count)()
+            return HttpResponse()
+
+        middleware = MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        requests = self.sample('http_request_db_queries_count', 'async-test')
+        queries = self.sample('http_request_db_queries_sum', 'async-test')
+        duration = self.sample('http_request_db_duration_seconds_sum', 'async-test')
+        async_to_sync(middleware)(self.request('async-test'))
+        self.assertEqual(self.sample('http_request_db_queries_count', 'async-test'), requests + 1)
+        self.assertEqual(self.sample('http_request_db_queries_sum', 'async-test'), queries + 2)
+        self.assertGreater(self.sample('http_request_db_duration_seconds_sum', 'async-test'), duration)
+
+    def test_queries_after_request_are_not_counted(self):
+        middleware = MetricsMiddleware(lambda request: HttpResponse())
+        queries = self.sample('http_request_db_queries_sum', 'sync-test')
+        middleware(self.request('sync-test'))
+        User.objects.count()
+        middleware(self.request('sync-test'))
+        self.assertEqual(self.sample('http_request_db_queries_sum', 'sync-test'), queries)
+
+    def test_metrics_endpoint_is_restricted(self):
+        self.assertEqual(Client().get('/metrics').status_code, 200)
+        self.assertEqual(Client(REMOTE_ADDR='203.0.113.5').get('/metrics').status_code, 403)
+        with override_settings(METRICS_AUTH_TOKEN='scrape-token'):
+            client = Client(REMOTE_ADDR='203.0.113.5')
+            self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+
+
+@override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_DEBUG_TOKEN='', PROFILING_SLOW_REQUEST_MS=500,
+                   PROFILING_IGNORE_PATH_PREFIXES=['/silk/', '/metrics'])
+class ProfilingTests(TestCase):
+    """
+    Проверяет выбор запросов для Silk (`should_intercept`) и сохранение медленных запросов.
+    """
+    def request(self, path='/user/profile/', **extra):
+        request = RequestFactory().get(path, **extra)
+        request.resolver_match = mock.Mock(view_name='user_profile')
+        return request
+
+    def run_middleware(self, request, elapsed, status=200):
+        middleware = SlowRequestProfilingMiddleware(lambda request: HttpResponse(status=status))
+        with mock.patch('sr_user_api.profiling.time.perf_counter', side_effect=[10.0, 10.0 + elapsed / 1000]):
+            return middleware(request)
+
+    def test_fast_requests_are_not_persisted(self):
+        self.run_middleware(self.request(), elapsed=499)
+        self.assertFalse(SilkRequest.objects.exists())
+
+    def test_slow_requests_are_recorded(self):
+        self.run_middleware(self.request('/user/profile/', data={'fields': 'id'}), elapsed=1500, status=201)
+        silk_request = SilkRequest.objects.get()
+        self.assertEqual((silk_request.path, silk_request.method, silk_request.view_name),
+                         ('/user/profile/', 'GET', 'user_profile'))
+        self.assertEqual(json.loads(silk_request.query_params), {'fields': 'id'})
+        self.assertAlmostEqual((silk_request.end_time - silk_request.start_time).total_seconds(), 1.5, places=3)
+        self.assertEqual(silk_request.response.status_code, 201)
+
+    def test_intercepted_and_ignored_requests_are_not_recorded_twice(self):
+        request = self.request()
+        request.silk_is_intercepted = True
+        self.run_middleware(request, elapsed=1500)
+        self.run_middleware(self.request('/metrics'), elapsed=1500)
+        with override_settings(PROFILING_SLOW_REQUEST_MS=0):
+            self.run_middleware(self.request(), elapsed=60000)
+        self.assertFalse(SilkRequest.objects.exists())
+
+    def test_sample_rate_is_honoured(self):
+        request = self.request()
+        with mock.patch('sr_user_api.profiling.random.random', return_value=0.05):
+            self.assertFalse(should_intercept(request))
+            with override_settings(PROFILING_SAMPLE_RATE=0.1):
+                self.assertTrue(should_intercept(request))
+            with override_settings(PROFILING_SAMPLE_RATE=0.05):
+                self.assertFalse(should_intercept(request))
+
+    def test_debug_token_forces_profiling(self):
+        with override_settings(PROFILING_DEBUG_TOKEN='profile-me'):
+            self.assertTrue(should_intercept(self.request(HTTP_X_SILK_PROFILE='profile-me')))
+            self.assertFalse(should_intercept(self.request(HTTP_X_SILK_PROFILE='wrong')))
+        self.assertFalse(should_intercept(self.request(HTTP_X_SILK_PROFILE='')))
+
+    def test_ignored_paths_are_never_profiled(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_DEBUG_TOKEN='profile-me'):
+            for path in ('/metrics', '/silk/requests/'):
+                with self.subTest(path=path):
+                    self.assertFalse(should_intercept(self.request(path, HTTP_X_SILK_PROFILE='profile-me')))
+            self.assertTrue(should_intercept(self.request('/user/search/')))
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    """
+    Проверяет, что `ORJSONRenderer` выдаёт те же байты, что и `JSONRenderer` DRF, в том числе там,
+    где ответ формирует родительский рендерер.
+    """
+    def assert_same_bytes(self, data, renderer=None, fallback=False, **kwargs):
+        renderer = renderer or ORJSONRenderer()
+        with mock.patch.object(JSONRenderer, 'render', autospec=True, side_effect=JSONRenderer.render) as parent:
+            rendered = renderer.render(data, **kwargs)
+        expected = JSONRenderer.render(renderer, data, **kwargs)
+        self.assertEqual(rendered, expected)
+        self.assertEqual(parent.called, fallback)
+
+    def test_fast_path_matches_json_renderer(self):
+        moscow = timezone.get_fixed_timezone(180)
+        for data in (
+            {'id': uuid.UUID(int=5), 'first_name': 'Анна', 'avatar': None,
+             'settings': {'theme': 'dark', 'n': [1, 2.5]}},
+            {'aware': datetime(2026, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+             'offset': datetime(2026, 1, 2, 3, 4, 5, tzinfo=moscow), 'naive': datetime(2026, 1, 2, 3, 4, 5, 120000),
+             'date': date(2026, 1, 2), 'time': dt_time(3, 4, 5, 6), 'delta': timedelta(days=1, seconds=3)},
+            {'decimal': Decimal('1.10'), 'lazy': gettext_lazy('Not found.'), 'bytes': b'abc', 'tuple': (1, 2)},
+            {'escapes': '\x00\x1f"\\/\u2028\u2029', 'emoji': '😀'},
+            [0.1, 1.5, 123456789.123, -0.0, 100.0, 2 ** 63 - 1, -2 ** 63, True],
+            ReturnDict({'results': ReturnList([{'id': 1}], serializer=None)}, serializer=None),
+            [], 'x',
+        ):
+            with self.subTest(data=data):
+                self.assert_same_bytes(data)
+
+    def test_fallback_cases_match_json_renderer(self):
+        for data in ([1e16], [1e-05], [0.00001], [2 ** 64], [-2 ** 64 - 1], {1: 'a', None: 'b'}, {'text': '1e5'}):
+            with self.subTest(data=data):
+                self.assert_same_bytes(data, fallback=True)
+
+        self.assert_same_bytes({'a': [1]}, accepted_media_type='application/json; indent=2', fallback=True)
+        self.assert_same_bytes({'a': [1]}, renderer_context={'indent': 4}, fallback=True)
+        ascii_renderer = ORJSONRenderer()
+        ascii_renderer.ensure_ascii = True
+        self.assert_same_bytes({'name': 'Анна'}, renderer=ascii_renderer, fallback=True)
+        pretty_renderer = ORJSONRenderer()
+        pretty_renderer.compact = False
+        self.assert_same_bytes({'a': [1, 2]}, renderer=pretty_renderer, fallback=True)
+
+    def test_non_finite_numbers_are_rejected_like_json_renderer(self):
+        for data in ({'x': float('nan')}, [float('inf')], {'x': [None, Decimal('-Infinity')]}):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render(data)
+                with self.assertRaises(ValueError):
+                    ORJSONRenderer().render(data)
+
+    def test_empty_response(self):
+        self.assertEqual(ORJSONRenderer().render(None), JSONRenderer().render(None))
+
+
+class LoadSheddingTests(SimpleTestCase):
+    """
+    Проверяет адаптивный лимит запросов и отклонение запросов по приоритетам.
+    """
+    def test_sheddable_requests_are_rejected_before_critical(self):
+        limiter = AdaptiveLimiter(initial=4)
+        self.assertIsNotNone(limiter.try_acquire(SHEDDABLE))
+        self.assertIsNotNone(limiter.try_acquire(SHEDDABLE))
+        self.assertIsNone(limiter.try_acquire(SHEDDABLE))
+        self.assertIsNotNone(limiter.try_acquire(CRITICAL))
+        self.assertIsNotNone(limiter.try_acquire(CRITICAL))
+        self.assertIsNone(limiter.try_acquire(CRITICAL))
+
+    def test_limit_decreases_when_latency_grows(self):
+        limiter = AdaptiveLimiter(initial=16)
+        for _ in range(10):
+            limiter.release('user/profile/', 0.01, limiter.try_acquire(CRITICAL))
+        self.assertGreaterEqual(limiter.limit, 16)
+        limiter.release('user/profile/', 1.0, limiter.try_acquire(CRITICAL))
+        self.assertLess(limiter.limit, 16)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_overloaded_request_gets_503_with_retry_after(self):
+        middleware = AdaptiveConcurrencyMiddleware(lambda request: HttpResponse())
+        middleware.limiter = AdaptiveLimiter(initial=1)
+        middleware.limiter.try_acquire(CRITICAL)
+        request = RequestFactory().get('/user/profile/')
+        request.resolver_match = mock.Mock(route='user/profile/')
+        response = middleware.process_view(request, None, (), {})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_avatar_serving_is_not_shed_with_sheddable_routes(self):
+        middleware = AdaptiveConcurrencyMiddleware(lambda request: HttpResponse())
+        middleware.limiter = AdaptiveLimiter(initial=4)
+        middleware.limiter.try_acquire(SHEDDABLE)
+        middleware.limiter.try_acquire(SHEDDABLE)
+        responses = {}
+        for path, route in (('/user/search/', 'user/search/'),
+                            (f'/media/avatars/variants/{"0" * 64}/64.webp', 'media/avatars/<path:name>')):
+            request = RequestFactory().get(path)
+            request.resolver_match = mock.Mock(route=route)
+            responses[route] = middleware.process_view(request, None, (), {})
+        self.assertEqual(responses['user/search/'].status_code, 503)
+        self.assertIsNone(responses['media/avatars/<path:name>'])
+
+    def admit(self, middleware):
+        request = RequestFactory().get('/user/profile/')
+        request.resolver_match = mock.Mock(route='user/profile/')
+        self.assertIsNone(middleware.process_view(request, None, (), {}))
+        self.assertEqual(middleware.limiter.in_flight, 1)
+        return request
+
+    def test_async_request_releases_slot(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = AdaptiveConcurrencyMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.admit(middleware))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(middleware.limiter.in_flight, 0)
+
+    def test_failed_or_cancelled_request_releases_slot(self):
+        async def cancelled(request):
+            raise asyncio.CancelledError
+
+        def failed(request):
+            raise RuntimeError
+
+        for get_response, call, error in ((cancelled, async_to_sync, asyncio.CancelledError),
+                                          (failed, lambda middleware: middleware, RuntimeError)):
+            with self.subTest(get_response=get_response):
+                middleware = AdaptiveConcurrencyMiddleware(get_response)
+                with self.assertRaises(error):
+                    call(middleware)(self.admit(middleware))
+                self.assertEqual(middleware.limiter.in_flight, 0)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class MiddlewareDispatchTests(TestCase):
+    """
+    Проверяет, что API проходит без сессионных middleware, а админка сохраняет сессии и защиту от CSRF.
+    """
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_api_skips_session_middleware(self):
+        user = User.objects.create(id=uuid.uuid4())
+        with mock.patch.object(SessionMiddleware, 'process_request') as process_request:
+            response = auth_client(user.id).get('/user/profile/')
+        self.assertEqual(response.status_code, 200)
+        process_request.assert_not_called()
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+
+    def test_csrf_is_enforced_only_outside_api(self):
+        def view(request):
+            return HttpResponse()
+
+        def get_response(request):
+            return dispatcher.process_view(request, view, (), {}) or view(request)
+
+        dispatcher = PathMiddlewareDispatcher(get_response)
+        self.assertEqual(dispatcher(RequestFactory().post('/admin/')).status_code, 403)
+        self.assertEqual(dispatcher(RequestFactory().post('/user/profile/')).status_code, 200)
+
+    def test_async_chains_are_built_under_asgi(self):
+        def view(request):
+            return HttpResponse()
+
+        async def get_response(request):
+            return await sync_to_async(dispatcher.process_view)(request, view, (), {}) or view(request)
+
+        dispatcher = PathMiddlewareDispatcher(get_response)
+        self.assertTrue(iscoroutinefunction(dispatcher))
+        self.assertTrue(iscoroutinefunction(dispatcher.stateless.handler))
+        self.assertTrue(iscoroutinefunction(dispatcher.full.handler))
+        response = async_to_sync(dispatcher)(RequestFactory().post('/user/profile/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertEqual(async_to_sync(dispatcher)(RequestFactory().post('/admin/')).status_code, 403)
+
+    def test_asgi_requests_pass_through_dispatcher(self):
+        user = User.objects.create(id=uuid.uuid4())
+        response = async_to_sync(AsyncClient().get)('/user/async/profile/', headers={'Authorization': bearer(user.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        response = async_to_sync(AsyncClient(enforce_csrf_checks=True).post)(
+            '/admin/login/', {'username': 'admin', 'password': 'password'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_admin_login_requires_csrf_token(self):
+        credentials = {'username': 'admin', 'password': 'password', 'next': '/admin/'}
+        response = self.client.post('/admin/login/', credentials)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        token = response.cookies[settings.CSRF_COOKIE_NAME].value
+        response = self.client.post('/admin/login/', {**credentials, 'csrfmiddlewaretoken': token})
+        self.assertRedirects(response, '/admin/')
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(self.client.get('/admin/').status_code, 200)
+
+
+@override_settings(AVATAR_SENDFILE_MODE=None, AVATAR_CACHE_MAX_AGE=60, PROFILING_SAMPLE_RATE=0)
+class AvatarServingTests(SimpleTestCase):
+    """
+    Проверяет отдачу файлов аватаров: заголовки кэширования, `Range`/`If-Range`, отдачу через фронт-прокси
+    и ограничение пути каталогом аватаров.
+    """
+    content = bytes(range(100))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(MEDIA_ROOT=directory.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.name = default_storage.save(f'avatars/{"0" * 64}.png', ContentFile(self.content))
+        self.url = f'/media/{self.name}'
+        default_storage.save('uploads/secret/part', ContentFile(b'secret'))
+
+    def test_content_addressed_file_is_immutable(self):
+        response = Client().get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(Client().get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        default_storage.save('avatars/legacy.png', ContentFile(self.content))
+        self.assertEqual(Client().get('/media/avatars/legacy.png')['Cache-Control'], 'public, max-age=60')
+
+    def test_range_returns_partial_content(self):
+        for header, (start, end) in (('bytes=2-5', (2, 5)), ('bytes=-3', (97, 99)), ('bytes=90-200', (90, 99))):
+            with self.subTest(header=header):
+                response = Client().get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/100')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+                self.assertEqual(b''.join(response.streaming_content), self.content[start:end + 1])
+
+    def test_unsatisfiable_range_returns_416(self):
+        for header in ('bytes=100-', 'bytes=5-2', 'bytes=-0'):
+            with self.subTest(header=header):
+                response = Client().get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_if_range_mismatch_returns_full_body(self):
+        etag = Client().get(self.url)['ETag']
+        response = Client().get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(Client().get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_sendfile_modes_delegate_to_proxy(self):
+        with override_settings(AVATAR_SENDFILE_MODE='x-accel-redirect', AVATAR_SENDFILE_PREFIX='/protected/'):
+            response = Client().get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        with override_settings(AVATAR_SENDFILE_MODE='x-sendfile'):
+            response = Client().get(self.url)
+        self.assertEqual(response['X-Sendfile'], default_storage.path(self.name))
+        self.assertEqual(response.content, b'')
+
+    def test_path_outside_avatar_directory_is_not_found(self):
+        for name in ('../uploads/secret/part', 'variants/../../uploads/secret/part', '/etc/passwd'):
+            with self.subTest(name=name):
+                with self.assertRaises(Http404):
+                    serve_avatar(RequestFactory().get('/'), name)
+        self.assertEqual(Client().get('/media/avatars/%2e%2e/uploads/secret/part').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=[], AVATAR_VARIANT_SIZES=(64,), AVATAR_VARIANT_FORMATS=('webp',))
+class AvatarVariantTests(TestCase):
+    """
+    Проверяет постановку в очередь производных аватара по запросу, обработку аватаров при переполненной
+    очереди и удаление неиспользуемых аватаров.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(MEDIA_ROOT=directory.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (200, 100), 'red').save(buffer, format='PNG')
+        self.digest = '0' * 64
+        self.name = default_storage.save(f'avatars/{self.digest}.png', ContentFile(buffer.getvalue()))
+        self.user = User.objects.create(id=uuid.uuid4(), avatar=self.name)
+
+    def test_missing_variant_is_queued_not_generated_on_request(self):
+        url = f'/media/avatars/variants/{self.digest}/64.webp'
+        with mock.patch('user_service.media.schedule_variant_generation') as schedule:
+            self.assertEqual(Client().get(url).status_code, 404)
+        schedule.assert_called_once_with(self.digest, 64, 'webp')
+        self.assertFalse(default_storage.exists(f'avatars/variants/{self.digest}/64.webp'))
+
+        avatars.ensure_avatar_variant(self.digest, 64, 'webp')
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (64, 64)))
+
+    def test_variant_generation_is_queued_once(self):
+        avatars._get_executor()
+        executor = mock.Mock()
+        with mock.patch.object(avatars, '_executor', executor), \
+                mock.patch.object(avatars, '_slots', threading.BoundedSemaphore(1)), \
+                mock.patch.object(avatars, '_pending_variants', set()):
+            avatars.schedule_variant_generation(self.digest, 64, 'webp')
+            avatars.schedule_variant_generation(self.digest, 64, 'webp')
+            avatars.schedule_variant_generation(self.digest, 65, 'webp')
+            [(task, variant)] = [call.args for call in executor.submit.call_args_list]
+            with self.assertLogs('user_service.avatars', 'WARNING'):
+                avatars.schedule_variant_generation('1' * 64, 64, 'webp')
+            self.assertEqual(executor.submit.call_count, 1)
+
+            # Задача выполняется в пуле со своим соединением, которое закрывает по завершении
+            with mock.patch.object(avatars.connections, 'close_all'):
+                task(variant)
+            self.assertTrue(default_storage.exists(f'avatars/variants/{self.digest}/64.webp'))
+            avatars.schedule_variant_generation('1' * 64, 64, 'webp')
+            self.assertEqual(executor.submit.call_count, 2)
+
+    def test_unknown_or_unused_variant_is_not_found(self):
+        self.assertEqual(Client().get(f'/media/avatars/variants/{self.digest}/65.webp').status_code, 404)
+        self.assertEqual(Client().get(f'/media/avatars/variants/{self.digest}/64.png').status_code, 404)
+        with mock.patch('user_service.media.schedule_variant_generation'):
+            self.assertEqual(Client().get(f'/media/avatars/variants/{"1" * 64}/64.webp').status_code, 404)
+        self.assertIsNone(avatars.ensure_avatar_variant('1' * 64, 64, 'webp'))
+        self.assertIsNone(avatars.ensure_avatar_variant(self.digest, 65, 'webp'))
+
+    def test_full_queue_processes_in_request_thread(self):
+        old_name = default_storage.save(f'avatars/{"1" * 64}.png', ContentFile(b'old'))
+        avatars._get_executor()
+        with mock.patch.object(avatars, '_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            with self.assertLogs('user_service.avatars', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+                avatars.schedule_avatar_processing(self.name, old_name)
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(default_storage.exists(f'avatars/variants/{self.digest}/64.webp'))
+
+    def test_save_avatar_reuses_stored_file(self):
+        with transaction.atomic():
+            name = avatars.save_avatar(ContentFile(b'other', name=os.path.basename(self.name)))
+        self.assertEqual(name, self.name)
+        self.assertEqual(default_storage.listdir('avatars')[1], [os.path.basename(self.name)])
+
+    def test_delete_unused_avatar_keeps_referenced_file(self):
+        avatars.delete_unused_avatar(self.name)
+        self.assertTrue(default_storage.exists(self.name))
+        User.objects.filter(id=self.user.id).update(avatar=None)
+        avatars.delete_unused_avatar(self.name)
+        self.assertFalse(default_storage.exists(self.name))
+
+    @skipUnless(connection.vendor == 'postgresql', 'advisory locks are PostgreSQL-only')
+    def test_reference_and_delete_lock_avatar_name(self):
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            avatars.save_avatar(ContentFile(b'other', name=os.path.basename(self.name)))
+        self.assertIn('pg_advisory_xact_lock_shared(hashtext(', ' '.join(query['sql'] for query in queries))
+        with CaptureQueriesContext(connection) as queries:
+            avatars.delete_unused_avatar(self.name)
+        self.assertIn('pg_advisory_xact_lock(hashtext(', ' '.join(query['sql'] for query in queries))
+
+
+class AvatarUploadTests(TestCase):
+    """
+    Проверяет возобновляемую загрузку аватара по частям и проверку изображения в пуле процессов.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(DATABASE_REPLICAS=[], MEDIA_ROOT=f'{directory.name}/media',
+                                      AVATAR_UPLOAD_DIR=f'{directory.name}/uploads')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create(id=uuid.uuid4())
+        self.client = auth_client(self.user.id)
+
+    def create_upload(self, length):
+        response = self.client.post('/user/avatar/uploads/', HTTP_UPLOAD_LENGTH=str(length))
+        self.assertEqual(response.status_code, 201)
+        return response['Location'].removeprefix('http://testserver')
+
+    def send(self, location, chunk, offset):
+        return self.client.generic('PATCH', location, chunk, content_type=UPLOAD_CONTENT_TYPE,
+                                   HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_upload_resumes_from_offset_and_sets_avatar(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), 'red').save(buffer, 'PNG')
+        content = buffer.getvalue()
+        half = len(content) // 2
+        location = self.create_upload(len(content))
+
+        response = self.send(location, content[:half], 0)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], str(half))
+        self.assertEqual(self.send(location, content[:half], 0).status_code, 409)
+        self.assertEqual(self.client.head(location)['Upload-Offset'], str(half))
+
+        response = self.send(location, content[half:], half)
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertRegex(self.user.avatar.name, r'^avatars/[0-9a-f]{64}\.png$')
+        self.assertEqual(self.user.avatar.read(), content)
+        self.assertEqual(self.client.head(location).status_code, 404)
+
+    def test_invalid_image_is_rejected_and_discarded(self):
+        location = self.create_upload(12)
+        response = self.send(location, b'not an image', 0)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('avatar', response.json())
+        self.assertEqual(self.client.head(location).status_code, 404)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar)
+
+    def test_finished_upload_is_not_recreated(self):
+        location = self.create_upload(4)
+        upload_id = location.rstrip('/').rsplit('/', 1)[1]
+        os.remove(uploads.part_path(upload_id))
+        self.assertEqual(self.send(location, b'1234', 0).status_code, 404)
+        self.assertFalse(os.path.exists(uploads.part_path(upload_id)))
+
+        # Загрузку завершил другой запрос, пока этот открывал её файл
+        location = self.create_upload(4)
+        upload_id = location.rstrip('/').rsplit('/', 1)[1]
+        flock = fcntl.flock
+
+        def finish_then_lock(file, operation):
+            if operation & fcntl.LOCK_EX:
+                uploads.delete_upload(upload_id)
+            flock(file, operation)
+
+        with mock.patch('user_service.uploads.fcntl.flock', side_effect=finish_then_lock):
+            self.assertEqual(self.send(location, b'1234', 0).status_code, 404)
+            self.assertEqual(self.client.delete(location).status_code, 404)
+        self.assertFalse(os.path.exists(uploads.part_path(upload_id)))
+
+    def test_upload_size_is_limited(self):
+        with override_settings(AVATAR_UPLOAD_MAX_BYTES=10):
+            response = self.client.post('/user/avatar/uploads/', HTTP_UPLOAD_LENGTH='11')
+        self.assertEqual(response.status_code, 413)
+        location = self.create_upload(4)
+        self.assertEqual(self.send(location, b'12345', 0).status_code, 413)
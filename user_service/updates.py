@@ -0,0 +1,122 @@
+from functools import reduce
+from operator import or_
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery, UpdateQuery
+
+
+def changed(values):
+    """
+    Условие для `UPDATE ... WHERE`: хотя бы одно поле отличается от нового значения.
+
+    Строки, в которых все значения уже совпадают с новыми, не обновляются: не меняется `updated_at`
+    и не пишется новая версия строки в WAL.
+
+    :param values: Новые значения полей (значения или выражения).
+    :type values: dict
+    :rtype: django.db.models.Q
+    """
+    # `exclude` для nullable-полей добавляет `OR поле IS NULL`, то есть работает как `IS DISTINCT FROM`
+    return reduce(or_, (~Q(**{field: value}) for field, value in values.items()))
+
+
+def update_returning(queryset, values, fields):
+    """
+    Обновляет строки `queryset` одним `UPDATE ... RETURNING` и возвращает новые значения полей `fields`.
+
+    `QuerySet.update()` возвращает только количество строк, поэтому SQL строится тем же компилятором
+    и дополняется `RETURNING`, а значения проходят те же преобразования, что и в `values()`.
+    Поддерживается PostgreSQL и SQLite 3.35+.
+
+    :param queryset: Обновляемые строки (фильтры только по полям самой модели).
+    :type queryset: django.db.models.QuerySet
+    :param values: Новые значения полей (значения или выражения), как для `update()`.
+    :type values: dict
+    :param fields: Имена полей, возвращаемых для каждой обновлённой строки.
+    :type fields: list
+    :return: Словари `{поле: значение}` обновлённых строк (пустой список, если ни одна строка не обновлена).
+    :rtype: list[dict]
+    """
+    model = queryset.model
+    using = router.db_for_write(model)
+    connection = connections[using]
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    sql, params = query.get_compiler(using).as_sql()
+
+    returning = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    return _fetch_rows(connection, model, f'{sql} RETURNING {returning}', params, fields)
+
+
+def insert_returning(obj, fields):
+    """
+    Вставляет объект одним `INSERT ... ON CONFLICT DO NOTHING ... RETURNING`.
+
+    Перед вставкой, как и в `save()`, вызываются `pre_save` полей (`auto_now_add`, сохранение файлов).
+    Строка, конфликтующая по первичному ключу, не изменяется.
+
+    :param obj: Новый экземпляр модели.
+    :type obj: django.db.models.Model
+    :param fields: Имена полей, возвращаемых для вставленной строки.
+    :type fields: list
+    :return: Словарь `{поле: значение}` вставленной строки или `None`, если строка уже существовала.
+    :rtype: dict or None
+    """
+    rows = bulk_insert_returning([obj], fields)
+    if not rows:
+        return None
+    obj._state.adding = False
+    obj._state.db = router.db_for_write(type(obj))
+    return rows[0]
+
+
+def bulk_insert_returning(objs, fields):
+    """
+    Вставляет объекты одним `INSERT ... VALUES (...), (...) ON CONFLICT DO NOTHING ... RETURNING`.
+
+    Строки, конфликтующие по первичному ключу, не изменяются и не возвращаются: какие строки вставлены,
+    определяет сам `INSERT`, без предварительного `SELECT`, результат которого к моменту вставки может
+    устареть из-за параллельных запросов. Поддерживается PostgreSQL и SQLite 3.35+.
+
+    :param objs: Новые экземпляры одной модели.
+    :type objs: list
+    :param fields: Имена полей, возвращаемых для каждой вставленной строки.
+    :type fields: list
+    :return: Словари `{поле: значение}` вставленных строк.
+    :rtype: list[dict]
+    """
+    if not objs:
+        return []
+    model = type(objs[0])
+    using = router.db_for_write(model)
+    connection = connections[using]
+    query = InsertQuery(model, on_conflict=OnConflict.IGNORE)
+    query.insert_values(model._meta.local_concrete_fields, objs)
+    compiler = query.get_compiler(using)
+    compiler.returning_fields = [model._meta.get_field(field) for field in fields]
+    [(sql, params)] = compiler.as_sql()
+    return _fetch_rows(connection, model, sql, params, fields)
+
+
+def _fetch_rows(connection, model, sql, params, fields):
+    """
+    Выполняет запрос с `RETURNING` и преобразует значения полей `fields` так же, как `values()`.
+    """
+    columns = [model._meta.get_field(field).get_col(model._meta.db_table) for field in fields]
+    converters = [connection.ops.get_db_converters(column) + column.get_db_converters(connection)
+                  for column in columns]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    result = []
+    for row in rows:
+        item = {}
+        for field, column, value, field_converters in zip(fields, columns, row, converters):
+            for converter in field_converters:
+                value = converter(value, column, connection)
+            item[field] = value
+        result.append(item)
+    return result
@@ -0,0 +1,274 @@
+import fcntl
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Модуль выполняется и в процессах пула проверки изображений, поэтому не импортирует модели Django
+
+UPLOAD_CONTENT_TYPE = 'application/offset+octet-stream'
+TUS_VERSION = '1.0.0'
+CHUNK_SIZE = 64 * 1024
+
+INVALID_IMAGE_MESSAGE = ("Upload a valid image. The file you uploaded was either not an image "
+                         "or a corrupted image.")
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = None
+
+
+class ValidationUnavailable(Exception):
+    """
+    Пул проверки изображений перегружен или не уложился в `AVATAR_VALIDATION_TIMEOUT`.
+    """
+
+
+def upload_dir():
+    path = getattr(settings, 'AVATAR_UPLOAD_DIR', None) or os.path.join(tempfile.gettempdir(), 'avatar-uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def max_upload_bytes():
+    return getattr(settings, 'AVATAR_UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+
+
+def _paths(upload_id):
+    base = os.path.join(upload_dir(), uuid.UUID(str(upload_id)).hex)
+    return f'{base}.part', f'{base}.json'
+
+
+def part_path(upload_id):
+    return _paths(upload_id)[0]
+
+
+def create_upload(user_id, length):
+    """
+    Создаёт пустую загрузку размером `length` байт для пользователя `user_id`.
+
+    Состояние загрузки хранится в каталоге `AVATAR_UPLOAD_DIR`: полученные байты — в файле `<id>.part`
+    (его размер и есть текущее смещение), владелец, размер и срок действия — в `<id>.json`.
+    Каталог должен быть общим для всех воркеров, обслуживающих загрузку. Попутно удаляются
+    загрузки с истёкшим сроком действия.
+
+    :param user_id: Идентификатор владельца загрузки.
+    :type user_id: str
+    :param length: Итоговый размер файла в байтах.
+    :type length: int
+    :return: Идентификатор загрузки и её метаданные.
+    :rtype: tuple[uuid.UUID, dict]
+    """
+    purge_expired_uploads()
+    upload_id = uuid.uuid4()
+    part, meta_path = _paths(upload_id)
+    meta = {
+        'user_id': str(user_id),
+        'length': length,
+        'expires_at': time.time() + getattr(settings, 'AVATAR_UPLOAD_EXPIRE_SECONDS', 24 * 3600),
+    }
+    open(part, 'xb').close()
+    with open(f'{meta_path}.tmp', 'w') as file:
+        json.dump(meta, file)
+    os.replace(f'{meta_path}.tmp', meta_path)
+    return upload_id, meta
+
+
+def get_upload(upload_id):
+    """
+    Возвращает метаданные загрузки (`user_id`, `length`, `expires_at`) или `None`,
+    если загрузки нет или её срок действия истёк.
+
+    :rtype: dict or None
+    """
+    try:
+        with open(_paths(upload_id)[1]) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta['expires_at'] < time.time():
+        delete_upload(upload_id)
+        return None
+    return meta
+
+
+def upload_offset(upload_id):
+    try:
+        return os.path.getsize(part_path(upload_id))
+    except OSError:
+        return None
+
+
+def delete_upload(upload_id):
+    for path in _paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def purge_expired_uploads():
+    now = time.time()
+    directory = upload_dir()
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                expired = json.load(file)['expires_at'] < now
+        except (OSError, ValueError, KeyError):
+            continue
+        if expired:
+            delete_upload(name[:-len('.json')])
+
+
+@contextmanager
+def locked_upload(upload_id):
+    """
+    Открывает файл загрузки на дозапись с эксклюзивной блокировкой (`flock`).
+
+    Файл открывается без `O_CREAT`: часть завершённой или отменённой загрузки не создаётся заново.
+    Если загрузку удалили между открытием файла и получением блокировки, открытый файл уже не связан
+    с каталогом, и загрузка тоже считается отсутствующей.
+
+    :raises BlockingIOError: Если загрузку уже обрабатывает другой запрос.
+    :raises FileNotFoundError: Если загрузки нет.
+    """
+    path = part_path(upload_id)
+    with open(path, 'ab', opener=lambda name, flags: os.open(name, flags & ~os.O_CREAT)) as part:
+        fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            if os.fstat(part.fileno()).st_nlink == 0:
+                raise FileNotFoundError(path)
+            yield part
+        finally:
+            fcntl.flock(part, fcntl.LOCK_UN)
+
+
+def write_chunk(part, stream, size):
+    """
+    Копирует из потока запроса в файл загрузки не больше `size` байт блоками по `CHUNK_SIZE`,
+    не загружая тело запроса в память целиком.
+
+    :param part: Файл загрузки, открытый на дозапись.
+    :type part: io.BufferedWriter
+    :param stream: Поток тела запроса (`request.stream`) или `None` для пустого тела.
+    :param size: Количество байт, которое нужно прочитать (`Content-Length`).
+    :type size: int
+    :return: Количество записанных байт (меньше `size`, если клиент прервал передачу).
+    :rtype: int
+    """
+    written = 0
+    try:
+        while stream is not None and written < size:
+            chunk = stream.read(min(CHUNK_SIZE, size - written))
+            if not chunk:
+                break
+            part.write(chunk)
+            written += len(chunk)
+    finally:
+        part.flush()
+    return written
+
+
+def inspect_image(path, formats, max_pixels):
+    """
+    Проверяет, что файл — изображение допустимого формата и размера, и вычисляет его SHA-256.
+
+    Выполняется в процессе пула проверки: изображение полностью декодируется, чтобы отсеять
+    повреждённые файлы.
+
+    :param path: Путь к файлу.
+    :type path: str
+    :param formats: Допустимые форматы Pillow (`JPEG`, `PNG`, ...).
+    :type formats: tuple
+    :param max_pixels: Максимальное количество пикселей.
+    :type max_pixels: int
+    :return: Дайджест SHA-256 и формат изображения в нижнем регистре.
+    :rtype: tuple[str, str]
+    :raises ValueError: Если файл не является допустимым изображением.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            if image_format not in formats:
+                raise ValueError(f"Unsupported image format. Allowed: {', '.join(formats)}.")
+            if image.width * image.height > max_pixels:
+                raise ValueError(f"Image must not exceed {max_pixels} pixels.")
+            image.verify()
+        # После verify() изображение нельзя декодировать, поэтому файл открывается повторно
+        with Image.open(path) as image:
+            image.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as error:
+        raise ValueError(INVALID_IMAGE_MESSAGE) from error
+    return digest.hexdigest(), image_format.lower()
+
+
+def _get_pool():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            # spawn: воркеры gunicorn многопоточные, а fork многопоточного процесса небезопасен
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'AVATAR_VALIDATION_WORKERS', 2),
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_slots = threading.BoundedSemaphore(getattr(settings, 'AVATAR_VALIDATION_QUEUE_SIZE', 16))
+        return _pool, _pool_slots
+
+
+def validate_upload(upload_id):
+    """
+    Проверяет завершённую загрузку в пуле процессов (`inspect_image`).
+
+    Декодирование изображения не занимает GIL воркера, а количество одновременных проверок ограничено
+    `AVATAR_VALIDATION_WORKERS` процессами и очередью `AVATAR_VALIDATION_QUEUE_SIZE`.
+
+    :param upload_id: Идентификатор загрузки.
+    :type upload_id: uuid.UUID
+    :return: Дайджест SHA-256 и формат изображения в нижнем регистре.
+    :rtype: tuple[str, str]
+    :raises ValueError: Если файл не является допустимым изображением.
+    :raises ValidationUnavailable: Если очередь пула заполнена или проверка не уложилась в таймаут.
+    """
+    global _pool
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise ValidationUnavailable("Очередь проверки изображений переполнена")
+    try:
+        try:
+            future = pool.submit(inspect_image, part_path(upload_id),
+                                 tuple(getattr(settings, 'AVATAR_UPLOAD_FORMATS', ('JPEG', 'PNG', 'WEBP'))),
+                                 getattr(settings, 'AVATAR_UPLOAD_MAX_PIXELS', 40_000_000))
+        except BaseException:
+            slots.release()
+            raise
+        # Место в очереди освобождается, когда процесс действительно закончил проверку, а не по таймауту запроса
+        future.add_done_callback(lambda _: slots.release())
+        return future.result(timeout=getattr(settings, 'AVATAR_VALIDATION_TIMEOUT', 30))
+    except FutureTimeoutError:
+        raise ValidationUnavailable(f"Проверка загрузки {upload_id} не уложилась в таймаут") from None
+    except BrokenProcessPool:
+        # Процесс пула аварийно завершился (например, из-за нехватки памяти при декодировании)
+        logger.error("Пул проверки изображений перезапускается после сбоя на загрузке %s", upload_id)
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise ValidationUnavailable(f"Сбой проверки загрузки {upload_id}") from None
@@ -1,9 +1,30 @@
 from django.urls import path
-from .views import CreateUserView, UserProfileView
+
+from .async_views import AsyncCreateUserView, AsyncUserProfileView
+from .views import (
+    AvatarUploadDetailView,
+    AvatarUploadView,
+    CreateUserView,
+    UserBatchView,
+    UserChangesView,
+    UserExportView,
+    UserProfileView,
+    UserSearchView,
+)
 
 app_name = 'user_service'
 
 urlpatterns = [
     path('create/', CreateUserView.as_view(), name='create_user'),
     path('profile/', UserProfileView.as_view(), name='user_profile'),
+    path('batch/', UserBatchView.as_view(), name='user_batch'),
+    path('search/', UserSearchView.as_view(), name='user_search'),
+    path('export/', UserExportView.as_view(), name='user_export'),
+    path('changes/', UserChangesView.as_view(), name='user_changes'),
+    path('avatar/uploads/', AvatarUploadView.as_view(), name='avatar_uploads'),
+    path('avatar/uploads/<uuid:upload_id>/', AvatarUploadDetailView.as_view(), name='avatar_upload'),
+
+    # Нативные async-представления для развёртывания под ASGI-сервером
+    path('async/create/', AsyncCreateUserView.as_view(), name='async_create_user'),
+    path('async/profile/', AsyncUserProfileView.as_view(), name='async_user_profile'),
 ]
@@ -1,10 +1,71 @@
+import os
+import uuid
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse, UnreadablePostError
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework import generics, permissions, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from sr_user_api.db_router import choose_replica, is_pinned, pin_to_primary, reset_database, use_database
+
+from .avatars import avatar_name, save_avatar, schedule_avatar_processing
+from .cache import get_cached_profile, invalidate_profile, invalidate_profiles, set_cached_profile
+from .conditional import evaluate_preconditions, has_conditional_headers, set_validators
+from .export import RANGE_FILTERS, iter_ndjson, parse_fields
+from .idempotency import idempotent
+from .jsonpatch import (
+    JSON_PATCH_MEDIA_TYPE,
+    MERGE_PATCH_MEDIA_TYPE,
+    JSONPatchParser,
+    MergePatchParser,
+    build_settings_update,
+    json_patch_conflict,
+    settings_max_bytes,
+    settings_size_within_limit,
+)
 from .models import User
-from .serializers import UserSerializer
+from .pagination import ChangeFeedPagination, KeysetPagination
+from .permissions import IsService, is_self_or_service
+from .serializers import (
+    USER_PUBLIC_FIELDS,
+    USER_ROW_FIELDS,
+    UserBatchRequestSerializer,
+    UserExportParamsSerializer,
+    UserSerializer,
+    parse_sparse_fields,
+    project_fields,
+    user_columns,
+    user_row_representation,
+)
+from .updates import bulk_insert_returning, changed, insert_returning, update_returning
+from .uploads import (
+    TUS_VERSION,
+    UPLOAD_CONTENT_TYPE,
+    ValidationUnavailable,
+    create_upload,
+    delete_upload,
+    get_upload,
+    locked_upload,
+    max_upload_bytes,
+    upload_offset,
+    validate_upload,
+    write_chunk,
+)
+
+
+# Поля, которые перезаписываются при пакетном создании с `on_conflict=update`, если они переданы в элементе
+BULK_UPDATE_FIELDS = ['first_name', 'last_name', 'native_language', 'settings']
 
 
 # Создание нового пользователя в "Юзер Сервисе"
@@ -13,7 +74,8 @@ class CreateUserView(generics.CreateAPIView):
     Представление для создания нового пользователя в "Юзер Сервисе".
 
     Позволяет любому пользователю (независимо от аутентификации) создавать новый профиль пользователя
-    после успешной авторизации через внешний сервис.
+    после успешной авторизации через внешний сервис. Если тело запроса — список, пользователи
+    создаются пакетно (см. `create_bulk`); пакетное создание доступно только сервисам.
 
     Атрибуты:
         - `queryset` (QuerySet): Набор всех пользователей.
@@ -24,29 +86,172 @@ class CreateUserView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]  # Так как создается после авторизации, доступ для всех
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         """
         Обрабатывает POST-запросы для создания нового пользователя.
 
         Процесс:
             1. Валидирует входящие данные с помощью `UserSerializer`.
-            2. Если данные валидны, создаёт нового пользователя.
-            3. Возвращает данные созданного пользователя с кодом статуса `201 CREATED`.
+            2. Если данные валидны, создаёт пользователя одним `INSERT ... ON CONFLICT DO NOTHING`
+               и сбрасывает его профиль в кэше. Если передан аватар, ставит в фоновый пул генерацию
+               его уменьшенных копий.
+            3. Возвращает данные созданного пользователя с кодом статуса `201 CREATED`. Чтение профиля
+               пользователя на `DATABASE_PIN_SECONDS` секунд закрепляется за основной БД.
+            4. Если пользователь с таким `id` уже существует (например, при повторе запроса после таймаута),
+               возвращает его текущий профиль с кодом статуса `200 OK` — только самому пользователю
+               или сервису (`is_self_or_service`). Остальные получают `409 CONFLICT` без данных профиля.
+
+        Запросы с заголовком `Idempotency-Key` обрабатываются декоратором `idempotent`: повтор с тем же
+        ключом получает сохранённый ответ без обращения к БД.
 
         :param request: HTTP-запрос, содержащий данные для создания пользователя.
         :type request: rest_framework.request.Request
         :return: Response объект с данными созданного пользователя или ошибками валидации.
         :rtype: rest_framework.response.Response
         """
+        if isinstance(request.data, list):
+            return self.create_bulk(request)
+
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        avatar = serializer.validated_data.get('avatar')
+        user = User(**serializer.validated_data)
+        with transaction.atomic() if avatar else nullcontext():
+            if avatar:
+                user.avatar = save_avatar(avatar)
+            created = insert_returning(user, ['id']) is not None
+        if not created:
+            if not is_self_or_service(request.user, user.id):
+                return Response({"detail": "A user with this id already exists."}, status=status.HTTP_409_CONFLICT)
+            return Response(self.get_serializer(User.objects.get(id=user.id)).data)
+
+        invalidate_profile(user.id)
+        if user.avatar:
+            schedule_avatar_processing(user.avatar.name)
+        data = self.get_serializer(user).data
+        response = Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+        pin_to_primary([user.id], response)
+        return response
+
+    def create_bulk(self, request):
+        """
+        Пакетно создаёт (или обновляет) пользователей из списка в теле запроса.
+
+        Пакетная запись доступна только сервисам (`IsService`): анонимный или пользовательский запрос
+        получает `403`.
+
+        Процесс:
+            1. Проверяет разрешение `IsService`, параметр `on_conflict` (`ignore` — по умолчанию, или `update`)
+               и размер пакета (`USER_BULK_CREATE_MAX_SIZE`).
+            2. Валидирует каждый элемент списка с помощью `UserSerializer` без запросов к БД.
+            3. Записывает валидные элементы частями по `USER_BULK_CREATE_CHUNK_SIZE`: на каждую часть
+               выполняется один `INSERT ... ON CONFLICT DO NOTHING RETURNING id` (`bulk_insert_returning`),
+               и созданными считаются ровно возвращённые им `id` — без отдельного `SELECT`, который мог бы
+               устареть из-за параллельной вставки. При `on_conflict=update` остальные пользователи
+               обновляются через `bulk_create(update_conflicts=True)`, по одному запросу на каждый набор
+               переданных полей: перезаписываются только поля из `BULK_UPDATE_FIELDS`, переданные в элементе;
+               остальные поля не меняются. Элемент без таких полей не обновляет существующего
+               пользователя (`skipped`).
+            4. Сбрасывает профили обновлённых пользователей в кэше.
+            5. Возвращает результат по каждому элементу в исходном порядке: `created`, `updated`, `skipped`
+               или `invalid` с ошибками валидации.
+
+        :param request: HTTP-запрос со списком пользователей.
+        :type request: rest_framework.request.Request
+        :return: Response объект со списком результатов по каждому элементу.
+        :rtype: rest_framework.response.Response
+        """
+        if not IsService().has_permission(request, self):
+            self.permission_denied(request, message=IsService.message)
+
+        on_conflict = request.query_params.get('on_conflict', 'ignore')
+        if on_conflict not in ('ignore', 'update'):
+            return Response({"on_conflict": "Must be 'ignore' or 'update'."}, status=400)
+
+        max_size = getattr(settings, 'USER_BULK_CREATE_MAX_SIZE', 10000)
+        if len(request.data) > max_size:
+            return Response({"detail": f"Ensure the list has no more than {max_size} elements."}, status=400)
+
+        results = [None] * len(request.data)
+        pending = []
+        seen = set()
+        for index, item in enumerate(request.data):
+            serializer = UserSerializer(data=item)
+            if not serializer.is_valid():
+                results[index] = {'status': 'invalid', 'errors': serializer.errors}
+                continue
+            user = User(**serializer.validated_data)
+            if user.id in seen:
+                results[index] = {'id': str(user.id), 'status': 'invalid',
+                                  'errors': {'id': ['Duplicate id in request.']}}
+                continue
+            seen.add(user.id)
+            # Перезаписываются только переданные поля, чтобы не сбросить остальные к значениям по умолчанию
+            update_fields = ()
+            if on_conflict == 'update':
+                update_fields = tuple(name for name in BULK_UPDATE_FIELDS if name in serializer.validated_data)
+            pending.append((index, user, update_fields))
+
+        chunk_size = getattr(settings, 'USER_BULK_CREATE_CHUNK_SIZE', 500)
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            with transaction.atomic():
+                created = {row['id'] for row in bulk_insert_returning([user for _, user, _ in chunk], ['id'])}
+                groups = {}
+                for _, user, update_fields in chunk:
+                    if update_fields and user.id not in created:
+                        groups.setdefault(update_fields, []).append(user)
+                for update_fields, users in groups.items():
+                    User.objects.bulk_create(users, update_conflicts=True, unique_fields=['id'],
+                                             update_fields=[*update_fields, 'updated_at'])
+
+            updated = set()
+            for index, user, update_fields in chunk:
+                if user.id in created:
+                    outcome = 'created'
+                elif update_fields:
+                    outcome = 'updated'
+                    updated.add(user.id)
+                else:
+                    outcome = 'skipped'
+                results[index] = {'id': str(user.id), 'status': outcome}
+            if updated:
+                invalidate_profiles(updated)
+
+        response = Response({'results': results})
+        pin_to_primary([result['id'] for result in results if result['status'] in ('created', 'updated')], response)
+        return response
+
+
+class ReplicaReadMixin:
+    """
+    Направляет чтение в реплику БД (см. `sr_user_api.db_router`).
+
+    Для запросов методами из `replica_read_methods` после аутентификации выбирается доступная реплика,
+    если чтение пользователя не закреплено за основной БД после недавней записи (`is_pinned`).
+    Остальные запросы, а также запросы при недоступных репликах, читают из основной БД.
+
+    Атрибуты:
+        - `replica_read_methods` (tuple): HTTP-методы, чтение которых направляется в реплику.
+    """
+    replica_read_methods = SAFE_METHODS
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in self.replica_read_methods and not is_pinned(request, request.user.id):
+            self._database_token = use_database(choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_database_token', None)
+        if token is not None:
+            reset_database(token)
+            self._database_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
 
 
 # Просмотр и обновление профиля пользователя
-class UserProfileView(APIView):
+class UserProfileView(ReplicaReadMixin, APIView):
     """
     Представление для просмотра и обновления профиля аутентифицированного пользователя.
 
@@ -55,52 +260,602 @@ class UserProfileView(APIView):
     Атрибуты:
         - `permission_classes` (list): Разрешения для доступа к представлению. Только аутентифицированные
          пользователи имеют доступ.
+        - `parser_classes` (list): Парсеры по умолчанию, а также JSON Merge Patch и JSON Patch
+         для частичного обновления `settings`.
     """
     permission_classes = [IsAuthenticated]
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, MergePatchParser, JSONPatchParser]
 
     def get(self, request):
         """
         Обрабатывает GET-запросы для получения профиля текущего пользователя.
 
         Процесс:
-            1. Ищет пользователя по `id`, соответствующему текущему аутентифицированному пользователю.
-            2. Если пользователь найден, возвращает его данные.
-            3. Если пользователь не найден, возвращает ошибку `404 NOT FOUND`.
+            1. Если профиль текущего пользователя есть в кэше, проверяет условные заголовки
+               (`If-None-Match`, `If-Modified-Since`) и возвращает `304 NOT MODIFIED` либо данные из кэша.
+            2. Если профиля нет в кэше, а запрос условный, загружает из БД только `updated_at`
+               и при актуальной версии клиента возвращает `304 NOT MODIFIED` без сериализации.
+            3. Иначе загружает поля пользователя по `id`, соответствующему текущему аутентифицированному
+               пользователю, и формирует ответ быстрым путём `user_row_representation`.
+            4. Если пользователь найден, сохраняет его данные в кэш и возвращает их вместе с `ETag` и `Last-Modified`.
+            5. Если пользователь не найден, возвращает ошибку `404 NOT FOUND`.
+
+        Параметр `fields` или `exclude` (поля через запятую) ограничивает набор полей ответа; из БД при этом
+        загружаются только нужные колонки, а частичный профиль не кэшируется.
 
         :param request: HTTP-запрос.
         :type request: rest_framework.request.Request
-        :return: Response объект с данными пользователя или сообщением об ошибке.
+        :return: Response объект с данными пользователя, ответ `304` или сообщение об ошибке.
         :rtype: rest_framework.response.Response
         """
-        try:
-            user = User.objects.get(id=request.user.id)
-            serializer = UserSerializer(user)
-            return Response(serializer.data)
-        except User.DoesNotExist:
+        user_id = request.user.id
+        fields = parse_sparse_fields(request.query_params)
+        cached = get_cached_profile(user_id)
+        if cached is not None:
+            return (evaluate_preconditions(request, user_id, cached['updated_at'])
+                    or set_validators(Response(project_fields(cached, fields)), user_id, cached['updated_at']))
+
+        if has_conditional_headers(request):
+            updated_at = User.objects.filter(id=user_id).values_list('updated_at', flat=True).first()
+            if updated_at is None:
+                return Response({"detail": "User not found."}, status=404)
+            not_modified = evaluate_preconditions(request, user_id, updated_at)
+            if not_modified is not None:
+                return not_modified
+
+        columns = USER_ROW_FIELDS if fields is None else user_columns([*fields, 'updated_at'])
+        row = User.objects.filter(id=user_id).values(*columns).first()
+        if row is None:
             return Response({"detail": "User not found."}, status=404)
+        data = user_row_representation(row, fields=fields)
+        if fields is None:
+            set_cached_profile(user_id, data)
+        return set_validators(Response(data), user_id, row['updated_at'])
 
     def patch(self, request):
         """
         Обрабатывает PATCH-запросы для частичного обновления профиля текущего пользователя.
 
         Процесс:
-            1. Ищет пользователя по `id`, соответствующему текущему аутентифицированному пользователю.
-            2. Если пользователь найден, валидирует входящие данные с помощью `UserSerializer`.
-            3. Если данные валидны, обновляет профиль пользователя.
-            4. Возвращает обновлённые данные пользователя.
+            1. Если передан `If-Match` или новый аватар, блокирует строку пользователя и читает её версию
+               и текущий аватар. Если версия клиента устарела, возвращает `412 PRECONDITION FAILED`.
+            2. Валидирует входящие данные с помощью `UserSerializer`.
+            3. Обновляет строку одним `UPDATE ... RETURNING` только если хотя бы одно поле действительно
+               изменилось; ответ строится из возвращённой строки без повторного чтения. Если изменений нет,
+               запись (и `updated_at`) не меняется, а в ответе возвращается текущий профиль.
+               При смене аватара ставит в фоновый пул генерацию уменьшенных копий нового аватара
+               и удаление старого.
+            4. Обновляет профиль в кэше и возвращает данные пользователя вместе с `ETag` и `Last-Modified`,
+               а после записи закрепляет чтение пользователя за основной БД на `DATABASE_PIN_SECONDS` секунд.
             5. Если пользователь не найден, возвращает ошибку `404 NOT FOUND`.
 
+        Запросы с типом содержимого `application/merge-patch+json` или `application/json-patch+json`
+        обрабатываются `patch_settings`.
+
         :param request: HTTP-запрос, содержащий данные для обновления пользователя.
         :type request: rest_framework.request.Request
         :return: Response объект с обновлёнными данными пользователя или сообщением об ошибке.
         :rtype: rest_framework.response.Response
         """
-        try:
-            user = User.objects.get(id=request.user.id)
-            serializer = UserSerializer(user, data=request.data, partial=True)
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
+        if request.content_type.split(';')[0].strip() in (MERGE_PATCH_MEDIA_TYPE, JSON_PATCH_MEDIA_TYPE):
+            return self.patch_settings(request)
+
+        user_id = request.user.id
+        # Блокировка строки нужна для проверки версии и для удаления старого аватара
+        locking = has_conditional_headers(request) or 'avatar' in request.data
+        with transaction.atomic() if locking else nullcontext():
+            current = None
+            if locking:
+                current = (User.objects.select_for_update().filter(id=user_id)
+                           .values('updated_at', 'avatar').first())
+                if current is None:
+                    return Response({"detail": "User not found."}, status=404)
+                precondition_failed = evaluate_preconditions(request, user_id, current['updated_at'])
+                if precondition_failed is not None:
+                    return precondition_failed
+
+            # Экземпляр-заглушка нужен только для проверки уникальности `id`: своя строка не считается дублем
+            serializer = UserSerializer(User(id=user_id), data=request.data, partial=True)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=400)
+
+            changes = {field: value for field, value in serializer.validated_data.items() if field != 'id'}
+            if isinstance(changes.get('avatar'), UploadedFile):
+                changes['avatar'] = save_avatar(changes['avatar'])
+            rows = []
+            if changes:
+                rows = update_returning(User.objects.filter(changed(changes), id=user_id),
+                                        {**changes, 'updated_at': timezone.now()}, USER_ROW_FIELDS)
+            if rows and 'avatar' in changes:
+                schedule_avatar_processing(changes['avatar'], current['avatar'])
+
+        if rows:
+            data = user_row_representation(rows[0])
+            set_cached_profile(user_id, data)
+            response = set_validators(Response(data), user_id, rows[0]['updated_at'])
+            pin_to_primary([user_id], response)
+            return response
+        return self.unchanged_profile(user_id)
+
+    @staticmethod
+    def unchanged_profile(user_id):
+        """
+        Возвращает текущий профиль для PATCH-запроса, который ничего не изменил.
+
+        Профиль берётся из кэша, а при его отсутствии читается из основной БД.
+
+        :param user_id: Идентификатор пользователя.
+        :type user_id: str
+        :rtype: rest_framework.response.Response
+        """
+        data = get_cached_profile(user_id)
+        if data is None:
+            row = User.objects.filter(id=user_id).values(*USER_ROW_FIELDS).first()
+            if row is None:
+                return Response({"detail": "User not found."}, status=404)
+            data = user_row_representation(row)
+            set_cached_profile(user_id, data)
+        return set_validators(Response(data), user_id, data['updated_at'])
+
+    def patch_settings(self, request):
+        """
+        Частично обновляет `settings` на стороне PostgreSQL, не загружая документ целиком.
+
+        Процесс:
+            1. Преобразует тело запроса (JSON Merge Patch или JSON Patch) в SQL-выражение над `settings`
+               и валидирует остальные поля профиля с помощью `UserSerializer`.
+            2. Если передан `If-Match`, блокирует строку и проверяет версию клиента (`412 PRECONDITION FAILED`).
+            3. Выполняет один `UPDATE ... RETURNING`, в котором новый документ вычисляется из текущего значения
+               в БД, поэтому параллельные изменения разных ключей не теряются. Условие в `WHERE`
+               ограничивает размер документа `USER_SETTINGS_MAX_BYTES` и пропускает запись, если патч
+               ничего не меняет (тогда `updated_at` остаётся прежним).
+            4. Если операция JSON Patch ссылается на несуществующий путь (`remove`/`replace` — на значение,
+               `add` — на родителя) или индекс за пределами массива, патч не применяется целиком
+               и возвращается `409 CONFLICT`.
+            5. Возвращает обновлённые данные пользователя вместе с новыми `ETag` и `Last-Modified`
+               и после записи закрепляет чтение пользователя за основной БД на `DATABASE_PIN_SECONDS` секунд.
+
+        :param request: HTTP-запрос с телом `application/merge-patch+json` или `application/json-patch+json`.
+        :type request: rest_framework.request.Request
+        :return: Response объект с обновлёнными данными пользователя или сообщением об ошибке.
+        :rtype: rest_framework.response.Response
+        """
+        settings_expression, fields = build_settings_update(request.content_type.split(';')[0].strip(),
+                                                            request.data)
+        serializer = UserSerializer(data=fields, partial=True)
+        if not serializer.is_valid():
             return Response(serializer.errors, status=400)
-        except User.DoesNotExist:
-            return Response({"detail": "User not found."}, status=404)
+
+        user_id = request.user.id
+        updates = {field: value for field, value in serializer.validated_data.items() if field not in ('id', 'avatar')}
+        queryset = User.objects.filter(id=user_id)
+        if settings_expression is not None:
+            updates['settings'] = settings_expression
+            queryset = queryset.filter(settings_size_within_limit(settings_expression))
+
+        try:
+            with transaction.atomic():
+                if has_conditional_headers(request):
+                    updated_at = (User.objects.select_for_update().filter(id=user_id)
+                                  .values_list('updated_at', flat=True).first())
+                    if updated_at is None:
+                        return Response({"detail": "User not found."}, status=404)
+                    precondition_failed = evaluate_preconditions(request, user_id, updated_at)
+                    if precondition_failed is not None:
+                        return precondition_failed
+                rows = []
+                if updates:
+                    rows = update_returning(queryset.filter(changed(updates)),
+                                            {**updates, 'updated_at': timezone.now()}, USER_ROW_FIELDS)
+        except DatabaseError as error:
+            conflict = json_patch_conflict(error)
+            if conflict is None:
+                raise
+            return Response({"settings": [conflict]}, status=409)
+
+        if not rows:
+            if (settings_expression is not None and User.objects.filter(id=user_id)
+                    .exclude(settings_size_within_limit(settings_expression)).exists()):
+                return Response({"settings": [f"Settings document exceeds {settings_max_bytes()} bytes."]},
+                                status=400)
+            return self.unchanged_profile(user_id)
+
+        data = user_row_representation(rows[0])
+        set_cached_profile(user_id, data)
+        response = set_validators(Response(data), user_id, rows[0]['updated_at'])
+        pin_to_primary([user_id], response)
+        return response
+
+
+def upload_response(meta, offset, data=None, status=200):
+    """
+    Ответ с заголовками состояния загрузки: `Upload-Offset`, `Upload-Length`, `Upload-Expires`.
+    """
+    response = Response(data, status=status)
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Upload-Offset'] = str(offset)
+    response['Upload-Length'] = str(meta['length'])
+    response['Upload-Expires'] = http_date(meta['expires_at'])
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+# Возобновляемая загрузка аватара по частям
+class AvatarUploadView(APIView):
+    """
+    Представление для создания возобновляемой загрузки аватара (протокол в духе tus).
+
+    Вместо одного multipart-запроса к `/user/profile/` клиент создаёт загрузку, передаёт файл частями
+    (`PATCH` на адрес из `Location`) и после обрыва соединения продолжает с последнего принятого
+    смещения (`HEAD`). Части пишутся во временный файл потоком, без буферизации тела запроса в памяти.
+
+    Атрибуты:
+        - `permission_classes` (list): Разрешения для доступа к представлению. Только аутентифицированные
+         пользователи имеют доступ.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Обрабатывает POST-запросы для создания загрузки.
+
+        Процесс:
+            1. Читает итоговый размер файла из заголовка `Upload-Length` и проверяет,
+               что он не превышает `AVATAR_UPLOAD_MAX_BYTES`.
+            2. Создаёт пустую загрузку и возвращает `201 CREATED` с её адресом в `Location`,
+               `Upload-Offset: 0` и сроком действия в `Upload-Expires`.
+
+        :param request: HTTP-запрос с заголовком `Upload-Length`.
+        :type request: rest_framework.request.Request
+        :return: Пустой Response объект с заголовками загрузки или сообщение об ошибке.
+        :rtype: rest_framework.response.Response
+        """
+        try:
+            length = int(request.headers.get('Upload-Length', ''))
+        except ValueError:
+            return Response({"detail": "Upload-Length header must be an integer."}, status=400)
+        if length <= 0:
+            return Response({"detail": "Upload-Length must be positive."}, status=400)
+        if length > max_upload_bytes():
+            return Response({"detail": f"Avatar must not exceed {max_upload_bytes()} bytes."}, status=413)
+
+        upload_id, meta = create_upload(request.user.id, length)
+        response = upload_response(meta, 0, status=201)
+        response['Location'] = request.build_absolute_uri(reverse('user_service:avatar_upload', args=[upload_id]))
+        return response
+
+
+class AvatarUploadDetailView(APIView):
+    """
+    Представление для передачи частей загрузки аватара, проверки её состояния и отмены.
+
+    Атрибуты:
+        - `permission_classes` (list): Разрешения для доступа к представлению. Только владелец загрузки
+         имеет к ней доступ.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, upload_id):
+        meta = get_upload(upload_id)
+        if meta is None or meta['user_id'] != str(request.user.id):
+            return None
+        return meta
+
+    def head(self, request, upload_id):
+        """
+        Возвращает текущее смещение загрузки в `Upload-Offset`, с которого клиент продолжает передачу.
+        """
+        meta = self.get_upload(request, upload_id)
+        offset = upload_offset(upload_id) if meta else None
+        if offset is None:
+            return Response(status=404)
+        return upload_response(meta, offset)
+
+    def patch(self, request, upload_id):
+        """
+        Обрабатывает PATCH-запросы с очередной частью файла.
+
+        Процесс:
+            1. Проверяет тип содержимого (`application/offset+octet-stream`), что `Upload-Offset` совпадает
+               с количеством уже принятых байт (иначе `409 CONFLICT` с актуальным смещением) и что часть
+               не выходит за `Upload-Length` (иначе `413`). Одновременно загрузку обрабатывает
+               только один запрос.
+            2. Потоком дописывает тело запроса во временный файл и, пока файл не получен целиком,
+               возвращает `204 NO CONTENT` с новым `Upload-Offset`.
+            3. Когда файл получен целиком, проверяет изображение в пуле процессов (`validate_upload`).
+               Недопустимый файл удаляется с ошибкой `400 BAD REQUEST`; если пул перегружен, возвращается
+               `503` с `Retry-After`, и проверку можно повторить пустым `PATCH` с итоговым смещением.
+            4. Сохраняет файл по SHA-256 содержимого и записывает его в `User.avatar` через `commit_avatar`.
+
+        :param request: HTTP-запрос с частью файла в теле.
+        :type request: rest_framework.request.Request
+        :param upload_id: Идентификатор загрузки.
+        :type upload_id: uuid.UUID
+        :return: Response объект с заголовками загрузки, профилем пользователя или сообщением об ошибке.
+        :rtype: rest_framework.response.Response
+        """
+        meta = self.get_upload(request, upload_id)
+        if meta is None:
+            return Response({"detail": "Upload not found."}, status=404)
+        if request.content_type.split(';')[0].strip() != UPLOAD_CONTENT_TYPE:
+            return Response({"detail": f"Content-Type must be {UPLOAD_CONTENT_TYPE}."}, status=415)
+        try:
+            client_offset = int(request.headers.get('Upload-Offset', ''))
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({"detail": "Upload-Offset header must be an integer."}, status=400)
+
+        try:
+            with locked_upload(upload_id) as part:
+                offset = part.tell()
+                if client_offset != offset:
+                    return upload_response(meta, offset, {"detail": "Upload-Offset does not match."}, status=409)
+                if offset + size > meta['length']:
+                    return upload_response(meta, offset, {"detail": "Chunk exceeds Upload-Length."}, status=413)
+
+                try:
+                    write_chunk(part, request.stream, size)
+                except UnreadablePostError:
+                    # Клиент оборвал соединение: принятые байты сохранены, передачу можно продолжить
+                    return upload_response(meta, part.tell(), {"detail": "Upload interrupted."}, status=400)
+                offset = part.tell()
+                if offset < meta['length']:
+                    return upload_response(meta, offset, status=204)
+
+                try:
+                    digest, image_format = validate_upload(upload_id)
+                except ValueError as error:
+                    delete_upload(upload_id)
+                    return Response({"avatar": [str(error)]}, status=400)
+                except ValidationUnavailable:
+                    response = upload_response(meta, offset, {"detail": "Image validation is busy, retry later."},
+                                               status=503)
+                    response['Retry-After'] = '1'
+                    return response
+
+                name = avatar_name(digest, image_format)
+                with open(part.name, 'rb') as file:
+                    response = self.commit_avatar(request.user.id, File(file, name=os.path.basename(name)))
+                delete_upload(upload_id)
+        except FileNotFoundError:
+            return Response({"detail": "Upload not found."}, status=404)
+        except BlockingIOError:
+            return Response({"detail": "Upload is being written by another request."}, status=409)
+
+        response['Upload-Offset'] = str(offset)
+        response['Tus-Resumable'] = TUS_VERSION
+        return response
+
+    @staticmethod
+    def commit_avatar(user_id, avatar):
+        """
+        Сохраняет проверенный аватар в хранилище и записывает его в профиль пользователя.
+
+        Строка блокируется, чтобы старый аватар был удалён фоновым пулом после фиксации транзакции,
+        а файл сохраняется в той же транзакции (`save_avatar`), чтобы его не удалил `delete_unused_avatar`.
+        Ответ содержит обновлённый профиль, а чтение пользователя закрепляется за основной БД.
+
+        :param user_id: Идентификатор пользователя.
+        :type user_id: str
+        :param avatar: Файл аватара с именем по SHA-256 содержимого.
+        :type avatar: django.core.files.File
+        :rtype: rest_framework.response.Response
+        """
+        with transaction.atomic():
+            current = User.objects.select_for_update().filter(id=user_id).values('avatar').first()
+            if current is None:
+                return Response({"detail": "User not found."}, status=404)
+            name = save_avatar(avatar)
+            rows = update_returning(User.objects.filter(changed({'avatar': name}), id=user_id),
+                                    {'avatar': name, 'updated_at': timezone.now()}, USER_ROW_FIELDS)
+            if rows:
+                schedule_avatar_processing(name, current['avatar'])
+
+        if not rows:
+            return UserProfileView.unchanged_profile(user_id)
+        data = user_row_representation(rows[0])
+        set_cached_profile(user_id, data)
+        response = set_validators(Response(data), user_id, rows[0]['updated_at'])
+        pin_to_primary([user_id], response)
+        return response
+
+    def delete(self, request, upload_id):
+        """
+        Отменяет загрузку и удаляет принятые части.
+        """
+        if self.get_upload(request, upload_id) is None:
+            return Response({"detail": "Upload not found."}, status=404)
+        try:
+            with locked_upload(upload_id):
+                delete_upload(upload_id)
+        except FileNotFoundError:
+            return Response({"detail": "Upload not found."}, status=404)
+        except BlockingIOError:
+            return Response({"detail": "Upload is being written by another request."}, status=409)
+        return Response(status=204)
+
+
+# Пакетное получение профилей для межсервисных запросов
+class UserBatchView(ReplicaReadMixin, APIView):
+    """
+    Представление для пакетного получения профилей пользователей по списку идентификаторов.
+
+    Используется другими сервисами, чтобы за один запрос и один запрос к БД получить профили
+    сразу нескольких пользователей вместо отдельного обращения к `/user/profile/` на каждого.
+
+    Атрибуты:
+        - `permission_classes` (list): Разрешения для доступа к представлению. Только сервисные токены
+         (`IsService`): конечный пользователь не может читать чужие профили.
+    """
+    permission_classes = [IsService]
+    replica_read_methods = ('POST',)  # POST здесь только читает
+
+    def post(self, request):
+        """
+        Обрабатывает POST-запросы для пакетного получения профилей.
+
+        Процесс:
+            1. Валидирует тело запроса (`{"ids": [...]}`) с помощью `UserBatchRequestSerializer`.
+            2. Загружает всех найденных пользователей одним запросом `id__in`.
+            3. Возвращает профили в порядке, заданном клиентом, и отдельный список ненайденных `id`.
+
+        Параметр запроса `fields` или `exclude` ограничивает набор полей профилей и загружаемые колонки.
+
+        :param request: HTTP-запрос со списком идентификаторов пользователей.
+        :type request: rest_framework.request.Request
+        :return: Response объект с ключами `results` и `missing` или ошибками валидации.
+        :rtype: rest_framework.response.Response
+        """
+        request_serializer = UserBatchRequestSerializer(data=request.data)
+        request_serializer.is_valid(raise_exception=True)
+        ids = request_serializer.validated_data['ids']
+
+        fields = parse_sparse_fields(request.query_params)
+        columns = USER_ROW_FIELDS if fields is None else ['id', *user_columns(fields)]
+        rows = {row['id']: row for row in User.objects.filter(id__in=ids).values(*columns)}
+        missing = [str(user_id) for user_id in ids if user_id not in rows]
+
+        return Response({
+            'results': [user_row_representation(rows[user_id], fields=fields) for user_id in ids if user_id in rows],
+            'missing': missing,
+        })
+
+
+class SparseFieldsMixin:
+    """
+    Поддержка разреженных наборов полей (`?fields=`/`?exclude=`) для списочных представлений.
+
+    Выбранные поля передаются в сериализатор, а выборка ограничивается нужными колонками через `only()`
+    (вместе с полем, по которому строится курсор пагинации). Представление может ограничить допустимые
+    поля, переопределив `get_allowed_fields`, а поля из `required_fields` попадают в ответ всегда.
+    """
+    required_fields = ()
+
+    def get_allowed_fields(self):
+        return None
+
+    def get_sparse_fields(self):
+        if not hasattr(self, '_sparse_fields'):
+            allowed = self.get_allowed_fields()
+            fields = parse_sparse_fields(self.request.query_params, allowed)
+            if fields is not None:
+                fields = [field for field in allowed or UserSerializer.Meta.fields
+                          if field in fields or field in self.required_fields]
+            self._sparse_fields = allowed if fields is None else fields
+        return self._sparse_fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_sparse_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+        ordering_field = getattr(self.pagination_class, 'ordering_field', None)
+        return queryset.only(*user_columns(fields), *([ordering_field] if ordering_field else []))
+
+
+# Поиск пользователей по имени и фамилии
+class UserSearchView(ReplicaReadMixin, SparseFieldsMixin, generics.ListAPIView):
+    """
+    Представление для поиска пользователей по имени, фамилии или `id`.
+
+    Параметры запроса:
+        - `q` (str): Подстрока имени или фамилии (поиск через trigram-индексы) либо UUID пользователя.
+        - `cursor` (str): Непрозрачный курсор следующей страницы из ответа `next_cursor`.
+        - `limit` (int): Размер страницы, не больше `USER_SEARCH_MAX_PAGE_SIZE`.
+        - `fields`, `exclude` (str): Поля ответа через запятую (см. `SparseFieldsMixin`).
+
+    Результаты упорядочены по `(created_at, id)` и разбиты на страницы keyset-пагинацией,
+    без `OFFSET` и `COUNT(*)`.
+
+    Сервисам (`IsService`) доступны все поля профиля, остальным пользователям — только публичные
+    (`USER_PUBLIC_FIELDS`).
+
+    Атрибуты:
+        - `serializer_class` (UserSerializer): Сериализатор для данных пользователей.
+        - `permission_classes` (list): Только аутентифицированные пользователи имеют доступ.
+        - `pagination_class` (KeysetPagination): Пагинация по курсору.
+    """
+    serializer_class = UserSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_allowed_fields(self):
+        return None if IsService().has_permission(self.request, self) else USER_PUBLIC_FIELDS
+
+    def get_queryset(self):
+        queryset = User.objects.all()
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            return queryset
+        try:
+            return queryset.filter(id=uuid.UUID(query))
+        except ValueError:
+            return queryset.filter(Q(first_name__icontains=query) | Q(last_name__icontains=query))
+
+
+# Потоковая выгрузка пользователей
+class UserExportView(APIView):
+    """
+    Представление для потоковой выгрузки всех пользователей в формате NDJSON.
+
+    Параметры запроса (см. `UserExportParamsSerializer`):
+        - `fields` (str): Выгружаемые поля через запятую.
+        - `created_after`, `created_before`, `updated_after`, `updated_before` (datetime): Диапазоны дат.
+
+    Ответ формируется построчно через `StreamingHttpResponse` из серверного курсора,
+    поэтому потребление памяти не зависит от размера таблицы.
+
+    Атрибуты:
+        - `permission_classes` (list): Доступ только по сервисному токену (`IsService`).
+    """
+    permission_classes = [IsService]
+
+    def get(self, request):
+        """
+        Обрабатывает GET-запросы на выгрузку пользователей.
+
+        :param request: HTTP-запрос с параметрами выгрузки.
+        :type request: rest_framework.request.Request
+        :return: Потоковый ответ `application/x-ndjson` или ошибки валидации параметров.
+        :rtype: django.http.StreamingHttpResponse or rest_framework.response.Response
+        """
+        params = UserExportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        fields = params.validated_data.get('fields') or parse_fields(None)
+        filters = {name: params.validated_data.get(name) for name in RANGE_FILTERS}
+
+        response = StreamingHttpResponse(iter_ndjson(fields, filters), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="users.ndjson"'
+        return response
+
+
+# Лента изменений пользователей для инкрементальной синхронизации
+class UserChangesView(SparseFieldsMixin, generics.ListAPIView):
+    """
+    Представление ленты изменений пользователей.
+
+    Возвращает пользователей, изменённых после курсора `since`, в порядке `(updated_at, id)`
+    страницами не больше `USER_CHANGES_MAX_PAGE_SIZE`. Первый запрос выполняется без `since`,
+    последующие — с `next_cursor` из предыдущего ответа; `has_more` означает, что следующую страницу
+    можно запросить сразу, иначе стоит повторить запрос позже с тем же курсором. Параметры `fields`
+    и `exclude` ограничивают поля ответа (см. `SparseFieldsMixin`), но `id` и `updated_at` возвращаются
+    всегда: по ним потребитель применяет изменения и сверяет их порядок.
+
+    Лента всегда читает из основной БД: отметка стабильности строится по незавершённым транзакциям,
+    которые видны только на основной БД.
+
+    Атрибуты:
+        - `serializer_class` (UserSerializer): Сериализатор для данных пользователей.
+        - `permission_classes` (list): Доступ только по сервисному токену (`IsService`).
+        - `pagination_class` (ChangeFeedPagination): Пагинация по курсору без пропусков записей.
+        - `required_fields` (tuple): Поля, которые возвращаются при любых `fields`/`exclude`.
+    """
+    queryset = User.objects.all()
+    serializer_class = UserSerializer
+    permission_classes = [IsService]
+    pagination_class = ChangeFeedPagination
+    required_fields = ('id', 'updated_at')